@@ -95,6 +95,7 @@ export class HttpInstrument {
       pendingResponse.resolveOnBeforeRequestEventDetails(details);
       if (this.shouldSaveContent(saveContentOption, details.type)) {
         pendingResponse.addResponseResponseBodyListener(details);
+        pendingResponse.visitId = this.dataReceiver.getVisitId();
       }
       return blockingResponseThatDoesNothing;
     };
@@ -571,13 +572,19 @@ export class HttpInstrument {
   private async logWithResponseBody(
     details: WebRequestOnBeforeRequestEventDetails,
     update: HttpResponse,
+    contentType: string,
   ) {
     const pendingResponse = this.getPendingResponse(details.requestId);
     try {
       const responseBodyListener = pendingResponse.responseBodyListener;
       const respBody = await responseBodyListener.getResponseBody();
       const contentHash = await responseBodyListener.getContentHash();
-      this.dataReceiver.saveContent(respBody, escapeString(contentHash));
+      this.dataReceiver.saveContent(
+        respBody,
+        escapeString(contentHash),
+        contentType,
+        pendingResponse.visitId,
+      );
       update.content_hash = contentHash;
       this.dataReceiver.saveRecord("http_responses", update);
     } catch (err) {
@@ -669,7 +676,7 @@ export class HttpInstrument {
     update.location = parsedHeaders.location;
 
     if (this.shouldSaveContent(saveContent, details.type)) {
-      this.logWithResponseBody(details, update);
+      this.logWithResponseBody(details, update, parsedHeaders.contentType);
     } else {
       this.dataReceiver.saveRecord("http_responses", update);
     }
@@ -678,6 +685,7 @@ export class HttpInstrument {
   private jsonifyHeaders(headers: HttpHeaders) {
     const resultHeaders = [];
     let location = "";
+    let contentType = "";
     if (headers) {
       headers.map((responseHeader) => {
         const { name, value } = responseHeader;
@@ -688,11 +696,15 @@ export class HttpInstrument {
         if (name.toLowerCase() === "location") {
           location = value;
         }
+        if (name.toLowerCase() === "content-type") {
+          contentType = value;
+        }
       });
     }
     return {
       headers: JSON.stringify(resultHeaders),
       location: escapeString(location),
+      contentType: escapeString(contentType),
     };
   }
 }
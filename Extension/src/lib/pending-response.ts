@@ -11,6 +11,10 @@ export class PendingResponse {
   public readonly onBeforeRequestEventDetails: Promise<WebRequestOnBeforeRequestEventDetails>;
   public readonly onCompletedEventDetails: Promise<WebRequestOnCompletedEventDetails>;
   public responseBodyListener: ResponseBodyListener;
+  /**
+   * The visit the request was made in, the body often arrives after it ended
+   */
+  public visitId: number | null = null;
   public resolveOnBeforeRequestEventDetails: (
     details: WebRequestOnBeforeRequestEventDetails,
   ) => void;
@@ -210,8 +210,17 @@ export const saveRecord = function (instrument, record) {
   storageController.send(JSON.stringify([instrument, record]));
 };
 
+export const getVisitId = function () {
+  return visitID;
+};
+
 // Stub for now
-export const saveContent = async function (content, contentHash) {
+export const saveContent = async function (
+  content,
+  contentHash,
+  contentType = "",
+  visitId = visitID,
+) {
   // Send page content to the data aggregator
   // deduplicated by contentHash in a levelDB database
   if (debugging) {
@@ -221,7 +230,13 @@ export const saveContent = async function (content, contentHash) {
   // Since the content might not be a valid utf8 string and it needs to be
   // json encoded later, it is encoded using base64 first.
   const b64 = Uint8ToBase64(content);
-  storageController.send(JSON.stringify(["page_content", [b64, contentHash]]));
+  // The visit and content type end up in the content_catalog table
+  storageController.send(
+    JSON.stringify([
+      "page_content",
+      [b64, contentHash, visitId || -1, crawlID, contentType],
+    ]),
+  );
 };
 
 function encode_utf8(s) {
@@ -0,0 +1,165 @@
+import asyncio
+from types import TracebackType
+from typing import Any, Dict, List, Optional, Type
+
+from .browser_manager import BrowserManagerHandle
+from .command_sequence import CommandSequence
+from .config import BrowserParams, ManagerParams
+from .storage.storage_providers import (
+    StructuredStorageProvider,
+    UnstructuredStorageProvider,
+)
+from .task_manager import STORAGE_CONTROLLER_JOB_LIMIT, TaskManager
+
+
+def _resolve(future: "asyncio.Future[bool]", success: bool) -> None:
+    if not future.done():
+        future.set_result(success)
+
+
+class AsyncTaskManager:
+    """asyncio interface to a TaskManager
+
+    `submit` waits for an idle browser without blocking the event loop and
+    returns a future that resolves to the success of the CommandSequence
+    once all of its data has been saved, like the `callback` would.
+    The browsers are shared with the underlying TaskManager, which is
+    available as `task_manager`.
+
+    .. code-block:: Python
+
+        async with AsyncTaskManager(
+            manager_params, browser_params, structured_provider, None
+        ) as manager:
+            saved = await manager.submit(command_sequence)
+            success = await saved
+
+    Starting and closing the TaskManager blocks, so both run in the default
+    executor. The `blocking` flag of CommandSequences is ignored, await the
+    returned future instead.
+    """
+
+    task_manager: TaskManager
+
+    def __init__(
+        self,
+        manager_params: ManagerParams,
+        browser_params: List[BrowserParams],
+        structured_storage_provider: StructuredStorageProvider,
+        unstructured_storage_provider: Optional[UnstructuredStorageProvider],
+        logger_kwargs: Optional[Dict[Any, Any]] = None,
+    ) -> None:
+        self._task_manager_args = (
+            manager_params,
+            browser_params,
+            structured_storage_provider,
+            unstructured_storage_provider,
+            {} if logger_kwargs is None else logger_kwargs,
+        )
+        self._browser_idle: Optional[asyncio.Event] = None
+
+    async def start(self) -> None:
+        """Launches the TaskManager with all its browsers"""
+        loop = asyncio.get_running_loop()
+        self.task_manager = await loop.run_in_executor(
+            None, TaskManager, *self._task_manager_args
+        )
+        browser_idle = asyncio.Event()
+        self._browser_idle = browser_idle
+
+        def on_browser_idle() -> None:
+            try:
+                loop.call_soon_threadsafe(browser_idle.set)
+            except RuntimeError:
+                # The event loop has been closed already
+                pass
+
+        self.task_manager.idle_listeners.append(on_browser_idle)
+
+    async def __aenter__(self) -> "AsyncTaskManager":
+        await self.start()
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        await self.close()
+
+    async def submit(
+        self, command_sequence: CommandSequence, index: Optional[int] = None
+    ) -> "asyncio.Future[bool]":
+        """Starts the CommandSequence on the first idle browser, or on the
+        browser at index, and returns once it is running
+
+        The returned future resolves once the data of the CommandSequence
+        has been saved. An existing `callback` is still called.
+        """
+        manager = self.task_manager
+        if index is not None and not 0 <= index < len(manager.browsers):
+            raise ValueError(f"There is no browser with index {index}")
+        await self._wait_for_storage_controller()
+        browser = await self._acquire_browser(index)
+
+        loop = asyncio.get_running_loop()
+        saved: "asyncio.Future[bool]" = loop.create_future()
+        callback = command_sequence.callback
+
+        # Called from the TaskManager's completion handler thread
+        def on_done(success: bool) -> None:
+            if callback is not None:
+                callback(success)
+            try:
+                loop.call_soon_threadsafe(_resolve, saved, success)
+            except RuntimeError:
+                # The event loop has been closed already
+                pass
+
+        command_sequence.callback = on_done
+        await loop.run_in_executor(
+            None, manager.start_command_sequence, browser, command_sequence
+        )
+        return saved
+
+    async def _wait_for_storage_controller(self) -> None:
+        """Waits until the storage controller is below its queue limit"""
+        handle = self.task_manager.storage_controller_handle
+        queue_size = handle.get_most_recent_status()
+        loop = asyncio.get_running_loop()
+        while queue_size >= STORAGE_CONTROLLER_JOB_LIMIT:
+            self.task_manager.logger.info(
+                "Blocking command submission until the storage controller "
+                "is below the max queue size of %d. Current queue "
+                "length %d. " % (STORAGE_CONTROLLER_JOB_LIMIT, queue_size)
+            )
+            queue_size = await loop.run_in_executor(None, handle.get_status)
+
+    async def _acquire_browser(self, index: Optional[int]) -> BrowserManagerHandle:
+        assert self._browser_idle is not None
+        manager = self.task_manager
+        loop = asyncio.get_running_loop()
+        while True:
+            if manager.failure_status:
+                # Shuts down the TaskManager and raises the failure
+                await loop.run_in_executor(None, manager.check_failure_status)
+            # Cleared before checking, so that no release gets missed
+            self._browser_idle.clear()
+            # Might join the command thread that just released the browser
+            browser = await loop.run_in_executor(
+                None, manager.acquire_browser, index, False
+            )
+            if browser is not None:
+                return browser
+            await self._browser_idle.wait()
+
+    async def close(self, relaxed: bool = True) -> None:
+        """Closes the TaskManager
+
+        With relaxed=True this waits for all submitted CommandSequences, so
+        the futures of all of them get resolved.
+        """
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.task_manager.close, relaxed
+        )
@@ -372,6 +372,7 @@ class BrowserManagerHandle:
         )
         assert self.command_queue is not None
         assert self.status_queue is not None
+        finalized = True
 
         for command_and_timeout in command_sequence.get_commands_with_timeout():
             command, timeout = command_and_timeout
@@ -485,9 +486,9 @@ class BrowserManagerHandle:
 
             if self.restart_required:
                 self.logger.critical(f"Restart failed for visit id {self.curr_visit_id}")
-                # task_manager.sock.finalize_visit_id(
-                #     success=False, visit_id=self.curr_visit_id
-                # )
+                # The visit gets finalized once the browser has been restarted,
+                # so that no more records for it can arrive
+                finalized = False
                 break
 
         self.logger.info(
@@ -527,6 +528,13 @@ class BrowserManagerHandle:
                 return
             self.restart_required = False
 
+        if not finalized:
+            # Otherwise the callback of the CommandSequence would only be
+            # called once the TaskManager shuts down
+            task_manager.sock.finalize_visit_id(
+                success=False, visit_id=self.curr_visit_id
+            )
+
     def _unpack_pickled_error(self, pickled_error: bytes) -> Tuple[str, str]:
         """Unpacks `pickled_error` into an error `message` and `tb` string."""
         exc = pickle.loads(pickled_error)
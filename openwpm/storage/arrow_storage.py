@@ -4,6 +4,7 @@ import random
 from abc import abstractmethod
 from asyncio import Task
 from collections import defaultdict
+from datetime import datetime, timezone
 from typing import Any, DefaultDict, Dict, List, Optional
 
 import pandas as pd
@@ -13,21 +14,62 @@ from pyarrow import Table
 from openwpm.types import VisitId
 
 from .parquet_schema import PQ_SCHEMAS
+from .record_normalizer import RecordNormalizer
 from .storage_providers import INCOMPLETE_VISITS, StructuredStorageProvider, TableName
 
-CACHE_SIZE = 500
+CACHE_SIZE_BYTES = 256 * 1024**2
+"""Budget for all cached record batches across all tables"""
+
+PARTITION_INSTANCE_ID = "instance_id"
+PARTITION_CRAWL_DATE = "crawl_date"
+PARTITION_VISIT_ID_BUCKET = "visit_id_bucket"
+SUPPORTED_PARTITION_COLS = (
+    PARTITION_INSTANCE_ID,
+    PARTITION_CRAWL_DATE,
+    PARTITION_VISIT_ID_BUCKET,
+)
+VISIT_ID_BUCKETS = 64
 
 
 class ArrowProvider(StructuredStorageProvider):
     """This class implements a StructuredStorage provider that
     serializes records into the arrow format
+
+    Pass `partition_cols` to lay out the written tables as a Hive partitioned
+    dataset (e.g. table_name/instance_id=42/crawl_date=2023-10-13/...).
+    Supported columns are:
+    - instance_id: the random id of this provider instance
+    - crawl_date: the UTC date each record was stored on, so records
+      cached over midnight keep the date they were crawled on
+    - visit_id_bucket: visit_id modulo `visit_id_buckets`
+      (only applied to tables that have a visit_id column)
+
+    Record batches are cached until their combined size reaches
+    `cache_size_bytes`, at which point all tables get flushed.
     """
 
     storing_lock: asyncio.Lock
+    _normalizer: RecordNormalizer
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        partition_cols: Optional[List[str]] = None,
+        visit_id_buckets: int = VISIT_ID_BUCKETS,
+        cache_size_bytes: int = CACHE_SIZE_BYTES,
+    ) -> None:
         super().__init__()
         self.logger = logging.getLogger("openwpm")
+        self.partition_cols: List[str] = list(partition_cols or [])
+        for col in self.partition_cols:
+            if col not in SUPPORTED_PARTITION_COLS:
+                raise ValueError(
+                    f"Unsupported partition column {col}. "
+                    f"Supported columns are {SUPPORTED_PARTITION_COLS}"
+                )
+        if visit_id_buckets < 1:
+            raise ValueError("visit_id_buckets needs to be a positive integer")
+        self.visit_id_buckets = visit_id_buckets
+        self.cache_size_bytes = cache_size_bytes
 
         def factory_function() -> DefaultDict[TableName, List[Dict[str, Any]]]:
             return defaultdict(list)
@@ -39,6 +81,8 @@ class ArrowProvider(StructuredStorageProvider):
 
         # Record batches by TableName
         self._batches: DefaultDict[TableName, List[pa.RecordBatch]] = defaultdict(list)
+        # Combined size of all batches in self._batches
+        self._cache_bytes = 0
         self._instance_id = random.getrandbits(32)
 
         self.flush_events: List[asyncio.Event] = list()
@@ -46,18 +90,21 @@ class ArrowProvider(StructuredStorageProvider):
     async def init(self) -> None:
         # Used to synchronize the finalizing and the flushing
         self.storing_lock = asyncio.Lock()
+        # Adds nulls and the instance_id (for partitioning)
+        self._normalizer = RecordNormalizer(
+            PQ_SCHEMAS, overrides={"instance_id": self._instance_id}
+        )
 
     async def store_record(
         self, table: TableName, visit_id: VisitId, record: Dict[str, Any]
     ) -> None:
-        records = self._records[visit_id]
-        # Add nulls
-        for item in PQ_SCHEMAS[table].names:
-            if item not in record:
-                record[item] = None
-        # Add instance_id (for partitioning)
-        record["instance_id"] = self._instance_id
-        records[table].append(record)
+        normalized = self._normalizer.normalize(table, record)
+        if PARTITION_CRAWL_DATE in self.partition_cols:
+            # Not part of the schema, picked up again in _create_batch
+            normalized[PARTITION_CRAWL_DATE] = (
+                datetime.now(timezone.utc).date().isoformat()
+            )
+        self._records[visit_id][table].append(normalized)
 
     def _create_batch(self, visit_id: VisitId) -> None:
         """Create record batches for all records from `visit_id`"""
@@ -74,7 +121,16 @@ class ArrowProvider(StructuredStorageProvider):
                 batch = pa.RecordBatch.from_pandas(
                     df, schema=PQ_SCHEMAS[table_name], preserve_index=False
                 )
+                if PARTITION_CRAWL_DATE in df.columns:
+                    batch = pa.RecordBatch.from_arrays(
+                        batch.columns
+                        + [pa.array(df[PARTITION_CRAWL_DATE], type=pa.string())],
+                        schema=batch.schema.append(
+                            pa.field(PARTITION_CRAWL_DATE, pa.string())
+                        ),
+                    )
                 self._batches[table_name].append(batch)
+                self._cache_bytes += batch.nbytes
                 self.logger.debug(
                     "Successfully created batch for table %s and "
                     "visit_id %s" % (table_name, visit_id)
@@ -88,11 +144,13 @@ class ArrowProvider(StructuredStorageProvider):
 
         del self._records[visit_id]
 
+    @property
+    def cache_bytes(self) -> int:
+        """The number of bytes currently held in record batches waiting to be flushed"""
+        return self._cache_bytes
+
     def _is_cache_full(self) -> bool:
-        for batches in self._batches.values():
-            if len(batches) > CACHE_SIZE:
-                return True
-        return False
+        return self._cache_bytes >= self.cache_size_bytes
 
     async def finalize_visit_id(
         self, visit_id: VisitId, interrupted: bool = False
@@ -133,11 +191,36 @@ class ArrowProvider(StructuredStorageProvider):
 
             return asyncio.create_task(wait_on_condition(event))
 
+    def _add_partition_columns(self, table: Table) -> Table:
+        """Append the derived columns required by `partition_cols` to `table`
+
+        The crawl_date column is already added by `_create_batch`
+        """
+        if (
+            PARTITION_VISIT_ID_BUCKET in self.partition_cols
+            and "visit_id" in table.column_names
+        ):
+            visit_ids = table.column("visit_id").fill_null(0).to_numpy()
+            table = table.append_column(
+                PARTITION_VISIT_ID_BUCKET,
+                pa.array(visit_ids % self.visit_id_buckets, type=pa.int32()),
+            )
+        return table
+
+    def get_partition_cols(self, table: Table) -> Optional[List[str]]:
+        """Returns the partition columns that apply to `table`
+
+        Meant to be passed on as `partition_cols` to `pq.write_to_dataset`
+        """
+        cols = [col for col in self.partition_cols if col in table.column_names]
+        return cols or None
+
     @abstractmethod
     async def write_table(self, table_name: TableName, table: Table) -> None:
         """Write out the table to persistent storage
 
         This should only return once it's actually saved out
+        Implementations should respect `get_partition_cols`
         """
 
     async def flush_cache(self, lock: Optional[asyncio.Lock] = None) -> None:
@@ -152,18 +235,30 @@ class ArrowProvider(StructuredStorageProvider):
 
         assert lock == self.storing_lock and lock.locked()
 
+        self.logger.debug(
+            "Flushing %d bytes of cached record batches", self._cache_bytes
+        )
         for table_name, batches in self._batches.items():
-            table = pa.Table.from_batches(batches)
+            table = self._add_partition_columns(pa.Table.from_batches(batches))
             await self.write_table(table_name, table)
         self._batches.clear()
+        self._cache_bytes = 0
 
-        for event in self.flush_events:
-            event.set()
-        self.flush_events.clear()
+        self._flushed(self.flush_events)
+        self.flush_events = []
 
         if not has_lock_arg:
             lock.release()
 
+    def _flushed(self, events: List[asyncio.Event]) -> None:
+        """Called with the events of all visits written out by a flush
+
+        Providers whose write_table returns before the data can be read back
+        can hold on to the events and set them later.
+        """
+        for event in events:
+            event.set()
+
     async def shutdown(self) -> None:
         for table_name, batches in self._batches.items():
             if len(batches) != 0:
@@ -0,0 +1,203 @@
+"""
+Deduplication of near-identical blobs by content-defined chunking
+
+Blobs are only deduplicated by their content hash, so two versions of a
+script that differ in a cache buster or a timestamp get stored twice.
+The ChunkedUnstructuredProvider splits every blob into chunks at positions
+picked by a rolling hash over the content, so an edit only changes the
+chunks around it. Every chunk gets stored once and every blob becomes a
+recipe listing the hashes of its chunks:
+
+    <filename>         the recipe, one chunk hash per line
+    chunk-<sha256>     a chunk
+"""
+import hashlib
+from typing import Awaitable, Callable, List, Optional, Set
+
+import numpy as np
+
+from .storage_providers import (
+    ReadableUnstructuredStorageProvider,
+    UnstructuredStorageProvider,
+)
+
+CHUNK_PREFIX = "chunk-"
+MIN_CHUNK_SIZE = 2 * 1024
+AVG_CHUNK_SIZE = 8 * 1024
+MAX_CHUNK_SIZE = 64 * 1024
+
+# One random 64 bit value per byte value, derived from SHA-256 so that
+# the chunk boundaries are the same across platforms and versions
+GEAR = np.array(
+    [
+        int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], "little")
+        for i in range(256)
+    ],
+    dtype=np.uint64,
+)
+
+
+def gear_hashes(data: bytes) -> "np.ndarray":
+    """Returns the Gear hash of the 64 bytes ending at every position
+
+    The hash of a position is the sum of GEAR[byte] << age over the window,
+    which only depends on these bytes. It is built by doubling the window
+    width, so it takes six passes over the data instead of one per byte.
+    """
+    hashes = GEAR[np.frombuffer(data, dtype=np.uint8)]
+    width = 1
+    while width < 64:
+        hashes[width:] += hashes[:-width] << np.uint64(width)
+        width *= 2
+    return hashes
+
+
+def chunk_boundaries(
+    data: bytes,
+    min_chunk_size: int = MIN_CHUNK_SIZE,
+    avg_chunk_size: int = AVG_CHUNK_SIZE,
+    max_chunk_size: int = MAX_CHUNK_SIZE,
+) -> List[int]:
+    """Returns the end offsets of the chunks of data
+
+    A chunk ends where the top log2(avg_chunk_size) bits of the hash are
+    zero, unless that would make it shorter than min_chunk_size. Chunks are
+    cut at max_chunk_size if there is no such position. On average, chunks
+    are about min_chunk_size + avg_chunk_size bytes long.
+    """
+    if len(data) <= min_chunk_size:
+        return [len(data)] if data else []
+    bits = avg_chunk_size.bit_length() - 1
+    mask = np.uint64(((1 << bits) - 1) << (64 - bits))
+    candidates = np.flatnonzero((gear_hashes(data) & mask) == 0) + 1
+    boundaries = []
+    start = 0
+    for end in candidates.tolist():
+        while end - start > max_chunk_size:
+            start += max_chunk_size
+            boundaries.append(start)
+        if end - start >= min_chunk_size:
+            boundaries.append(end)
+            start = end
+    while len(data) - start > max_chunk_size:
+        start += max_chunk_size
+        boundaries.append(start)
+    if start < len(data):
+        boundaries.append(len(data))
+    return boundaries
+
+
+async def reassemble(
+    recipe: bytes, read_chunk: Callable[[str], Awaitable[Optional[bytes]]]
+) -> bytes:
+    """Concatenates the chunks listed in the recipe"""
+    parts = []
+    for chunk_hash in recipe.decode("ascii").split():
+        chunk = await read_chunk(CHUNK_PREFIX + chunk_hash)
+        if chunk is None:
+            raise ValueError(f"Chunk {chunk_hash} is missing")
+        parts.append(chunk)
+    return b"".join(parts)
+
+
+class ChunkedUnstructuredProvider(ReadableUnstructuredStorageProvider):
+    """Splits blobs into content-defined chunks and stores them in store
+
+    Any provider that can store arbitrary filenames works as the store,
+    e.g. a LevelDbProvider or an S3UnstructuredProvider. To read the blobs
+    back, the store also needs to be a ReadableUnstructuredStorageProvider:
+
+    .. code-block:: Python
+
+        provider = ChunkedUnstructuredProvider(LevelDbProvider(db_path))
+        await provider.init()
+        content = await provider.read_blob(content_hash)
+
+    The number of bytes passed in, the bytes of the newly stored chunks and
+    those of the recipes are counted in blob_bytes, chunk_bytes and
+    recipe_bytes. Chunks stored by a previous run are only skipped if the
+    store deduplicates them itself.
+    """
+
+    def __init__(
+        self,
+        store: UnstructuredStorageProvider,
+        min_chunk_size: int = MIN_CHUNK_SIZE,
+        avg_chunk_size: int = AVG_CHUNK_SIZE,
+        max_chunk_size: int = MAX_CHUNK_SIZE,
+    ) -> None:
+        super().__init__()
+        if avg_chunk_size & (avg_chunk_size - 1):
+            raise ValueError("avg_chunk_size needs to be a power of two")
+        if not 0 < min_chunk_size < max_chunk_size:
+            raise ValueError("min_chunk_size needs to be below max_chunk_size")
+        self.store = store
+        self.min_chunk_size = min_chunk_size
+        self.avg_chunk_size = avg_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.file_name_cache: Set[str] = set()
+        """The set of all filenames ever stored, checked before chunking"""
+        self.chunk_cache: Set[str] = set()
+        """The hashes of all chunks stored by this provider"""
+        self.blob_bytes = 0
+        self.chunk_bytes = 0
+        self.recipe_bytes = 0
+
+    async def init(self) -> None:
+        await self.store.init()
+
+    async def _store(self, filename: str, blob: bytes, overwrite: bool) -> None:
+        # Not every provider supports overwrite, e.g. MemoryUnstructuredProvider
+        if overwrite:
+            await self.store.store_blob(filename, blob, overwrite=True)
+        else:
+            await self.store.store_blob(filename=filename, blob=blob)
+
+    async def store_blob(
+        self, filename: str, blob: bytes, overwrite: bool = False
+    ) -> None:
+        if not overwrite and filename in self.file_name_cache:
+            return
+        chunk_hashes = []
+        start = 0
+        for end in chunk_boundaries(
+            blob, self.min_chunk_size, self.avg_chunk_size, self.max_chunk_size
+        ):
+            chunk = blob[start:end]
+            start = end
+            chunk_hash = hashlib.sha256(chunk).hexdigest()
+            chunk_hashes.append(chunk_hash)
+            if chunk_hash in self.chunk_cache:
+                continue
+            await self._store(CHUNK_PREFIX + chunk_hash, chunk, False)
+            self.chunk_cache.add(chunk_hash)
+            self.chunk_bytes += len(chunk)
+        recipe = "\n".join(chunk_hashes).encode("ascii")
+        await self._store(filename, recipe, overwrite)
+        self.file_name_cache.add(filename)
+        self.blob_bytes += len(blob)
+        self.recipe_bytes += len(recipe)
+
+    def _readable_store(self) -> ReadableUnstructuredStorageProvider:
+        if not isinstance(self.store, ReadableUnstructuredStorageProvider):
+            raise TypeError(f"{type(self.store).__name__} can't read or delete blobs")
+        return self.store
+
+    async def read_blob(self, filename: str) -> Optional[bytes]:
+        """Only sees blobs that the store can read, e.g. after a flush_cache"""
+        store = self._readable_store()
+        recipe = await store.read_blob(filename)
+        if recipe is None:
+            return None
+        return await reassemble(recipe, store.read_blob)
+
+    async def delete_blob(self, filename: str) -> None:
+        """Only deletes the recipe, as the chunks may be shared with other blobs"""
+        await self._readable_store().delete_blob(filename)
+        self.file_name_cache.discard(filename)
+
+    async def flush_cache(self) -> None:
+        await self.store.flush_cache()
+
+    async def shutdown(self) -> None:
+        await self.store.shutdown()
@@ -0,0 +1,195 @@
+"""
+Bundled blob uploads for object stores
+
+Uploading every blob as its own object costs one request per blob, while
+most of them are only a few KB. The BundledUnstructuredProvider instead
+concatenates the blobs into bundle objects and uploads one Parquet
+manifest per bundle that maps every blob to its location:
+
+    base_path/bundles/<bundle>.bundle
+    base_path/manifests/<bundle>.parquet  (hash, offset, length)
+
+The BundleReader uses the manifests to fetch single blobs with range reads.
+"""
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import fsspec
+import pyarrow as pa
+import pyarrow.parquet as pq
+from fsspec import AbstractFileSystem
+
+from ..storage_providers import UnstructuredStorageProvider
+from .uploader import MAX_RETRIES, BlobUploader, UploadError
+
+BUNDLE_SUFFIX = ".bundle"
+MAX_BUNDLE_BYTES = 64 * 1024**2
+MAX_CONCURRENT_BUNDLES = 4
+
+MANIFEST_SCHEMA = pa.schema(
+    [
+        pa.field("hash", pa.string(), nullable=False),
+        pa.field("offset", pa.int64(), nullable=False),
+        pa.field("length", pa.int64(), nullable=False),
+    ]
+)
+
+
+class BundledUnstructuredProvider(UnstructuredStorageProvider):
+    """Uploads blobs in bundles of up to max_bundle_bytes
+
+    A bundle gets uploaded once it is full and on every flush_cache, which
+    waits for the upload to finish. The manifest is only uploaded after
+    its bundle, so every blob listed in a manifest can be read.
+    flush_cache and shutdown raise an UploadError listing the blobs of
+    the bundles that failed after all retries.
+
+    protocol and **storage_options select the fsspec filesystem,
+    e.g. protocol="s3" with the S3FileSystem arguments or protocol="gcs".
+    Blobs with overwrite=True are added to the next bundle and take
+    precedence over earlier ones when reading.
+    """
+
+    file_system: AbstractFileSystem
+    uploader: BlobUploader
+
+    def __init__(
+        self,
+        base_path: str,
+        protocol: str = "s3",
+        max_bundle_bytes: int = MAX_BUNDLE_BYTES,
+        max_retries: int = MAX_RETRIES,
+        **storage_options: Any,
+    ) -> None:
+        super().__init__()
+        self.base_path = base_path.rstrip("/")
+        self.protocol = protocol
+        self.max_bundle_bytes = max_bundle_bytes
+        self.max_retries = max_retries
+        self.storage_options = storage_options
+        self.logger = logging.getLogger("openwpm")
+        self.file_name_cache: Set[str] = set()
+        """The set of all filenames ever stored, checked before bundling"""
+        self._buffer = bytearray()
+        self._entries: List[Tuple[str, int, int]] = []
+        # Makes bundle names unique across workers writing to the same path
+        self._prefix = "%d-%08x" % (time.time(), random.getrandbits(32))
+        self._bundle_counter = 0
+        # Blobs of failed bundles, reported by the next flush_cache
+        self._failed: List[str] = []
+
+    async def init(self) -> None:
+        self.file_system = fsspec.filesystem(self.protocol, **self.storage_options)
+        self.uploader = BlobUploader(MAX_CONCURRENT_BUNDLES, self.max_retries)
+
+    async def store_blob(
+        self, filename: str, blob: bytes, overwrite: bool = False
+    ) -> None:
+        if not overwrite and filename in self.file_name_cache:
+            self.logger.info("Not saving out file %s as it already exists", filename)
+            return
+        self.file_name_cache.add(filename)
+        self._entries.append((filename, len(self._buffer), len(blob)))
+        self._buffer += blob
+        if len(self._buffer) >= self.max_bundle_bytes:
+            await self._seal_bundle()
+
+    async def _seal_bundle(self) -> None:
+        """Hands the current bundle to the uploader and starts a new one"""
+        if not self._entries:
+            return
+        name = f"{self._prefix}-{self._bundle_counter:06d}"
+        self._bundle_counter += 1
+        data = bytes(self._buffer)
+        names, offsets, lengths = zip(*self._entries)
+        manifest = pa.table(
+            [list(names), list(offsets), list(lengths)], schema=MANIFEST_SCHEMA
+        )
+        self._buffer = bytearray()
+        self._entries = []
+
+        async def upload() -> None:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._upload_bundle, name, data, manifest
+            )
+
+        def on_failure() -> None:
+            self.file_name_cache.difference_update(names)
+            self._failed.extend(names)
+
+        await self.uploader.submit(name, upload, on_failure)
+
+    def _upload_bundle(self, name: str, data: bytes, manifest: pa.Table) -> None:
+        self.file_system.pipe_file(
+            f"{self.base_path}/bundles/{name}{BUNDLE_SUFFIX}", data
+        )
+        with self.file_system.open(
+            f"{self.base_path}/manifests/{name}.parquet", mode="wb"
+        ) as f:
+            pq.write_table(manifest, f)
+
+    async def flush_cache(self) -> None:
+        await self._seal_bundle()
+        await self.uploader.drain()
+        failed, self._failed = self._failed, []
+        if failed:
+            raise UploadError(failed)
+
+    async def shutdown(self) -> None:
+        await self.flush_cache()
+
+
+class BundleReader:
+    """Reads blobs written by a BundledUnstructuredProvider
+
+    All manifests are loaded when the reader is created. Blobs are then
+    fetched with a single range read each.
+
+    .. code-block:: Python
+
+        reader = BundleReader("bucket/content", protocol="s3")
+        content = reader[content_hash]
+    """
+
+    def __init__(
+        self,
+        base_path: str,
+        protocol: str = "s3",
+        file_system: Optional[AbstractFileSystem] = None,
+        **storage_options: Any,
+    ) -> None:
+        self.base_path = base_path.rstrip("/")
+        self.file_system = file_system or fsspec.filesystem(protocol, **storage_options)
+        self.locations: Dict[str, Tuple[str, int, int]] = {}
+        # Bundle names sort by creation time, so later blobs overwrite earlier ones
+        manifests = sorted(
+            self.file_system.glob(f"{self.base_path}/manifests/*.parquet")
+        )
+        for manifest_path in manifests:
+            name = manifest_path.rsplit("/", 1)[-1].removesuffix(".parquet")
+            bundle = f"{self.base_path}/bundles/{name}{BUNDLE_SUFFIX}"
+            with self.file_system.open(manifest_path, mode="rb") as f:
+                manifest = pq.read_table(f).to_pydict()
+            for content_hash, offset, length in zip(
+                manifest["hash"], manifest["offset"], manifest["length"]
+            ):
+                self.locations[content_hash] = (bundle, offset, length)
+
+    def __getitem__(self, content_hash: str) -> bytes:
+        bundle, offset, length = self.locations[content_hash]
+        data: bytes = self.file_system.cat_file(
+            bundle, start=offset, end=offset + length
+        )
+        return data
+
+    def __contains__(self, content_hash: object) -> bool:
+        return content_hash in self.locations
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.locations)
+
+    def __len__(self) -> int:
+        return len(self.locations)
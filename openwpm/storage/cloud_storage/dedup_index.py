@@ -0,0 +1,97 @@
+"""
+A persistent record of the blobs that are known to exist in a bucket
+
+Every crawl worker starts with an empty file_name_cache, so without it each
+of them would check the bucket again for every commonly loaded script.
+The DedupIndex keeps these names in a local SQLite database that survives
+restarts and can be shared by all workers on a machine. It can be seeded
+from a manifest of the bucket, like an S3 Inventory report.
+
+Blobs are identified by their full path, bucket/key, so that providers
+writing to different buckets or prefixes can share an index.
+"""
+import csv
+import gzip
+import sqlite3
+from pathlib import Path
+from typing import IO, Iterable, Iterator, List
+
+INDEX_COMMIT_SIZE = 1000
+
+
+def read_manifest(path: Path, bucket_name: str) -> Iterator[str]:
+    """Yields the paths of the blobs listed in a bucket manifest
+
+    Supported are plain text files with one object key of bucket_name per
+    line and S3 Inventory CSV reports (the bucket and the key are the first
+    two columns). Both may be gzipped.
+    """
+    if path.suffix == ".gz":
+        f: IO[str] = gzip.open(path, "rt", encoding="utf-8")
+    else:
+        f = path.open(encoding="utf-8")
+    with f:
+        if ".csv" in path.suffixes:
+            for row in csv.reader(f):
+                if len(row) > 1 and row[1]:
+                    yield f"{row[0] or bucket_name}/{row[1]}"
+        else:
+            for line in f:
+                key = line.strip()
+                if key:
+                    yield f"{bucket_name}/{key}"
+
+
+class DedupIndex:
+    """An on-disk set of blob paths
+
+    Names are added in batches and only committed every
+    INDEX_COMMIT_SIZE additions or when `flush` is called.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        # WAL allows several workers to share the index
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS blobs (name TEXT PRIMARY KEY) WITHOUT ROWID"
+        )
+        self._pending: List[str] = []
+
+    def __contains__(self, name: object) -> bool:
+        row = self.db.execute("SELECT 1 FROM blobs WHERE name = ?", (name,)).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        (count,) = self.db.execute("SELECT COUNT(*) FROM blobs").fetchone()
+        return int(count)
+
+    def add(self, name: str) -> None:
+        self._pending.append(name)
+        if len(self._pending) >= INDEX_COMMIT_SIZE:
+            self.flush()
+
+    def add_many(self, names: Iterable[str]) -> None:
+        for name in names:
+            self.add(name)
+        self.flush()
+
+    def load_manifest(self, path: Path, bucket_name: str) -> None:
+        """Adds all blobs listed in the manifest, see `read_manifest`"""
+        self.add_many(read_manifest(path, bucket_name))
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        with self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO blobs VALUES (?)",
+                ((name,) for name in self._pending),
+            )
+        self._pending.clear()
+
+    def close(self) -> None:
+        self.flush()
+        self.db.close()
@@ -0,0 +1,128 @@
+import logging
+from abc import abstractmethod
+from functools import partial
+from pathlib import Path
+from typing import List, Optional, Set
+
+from fsspec.asyn import AsyncFileSystem
+
+from ..codecs import Codec
+from ..storage_providers import UnstructuredStorageProvider
+from .dedup_index import DedupIndex
+from .uploader import MAX_CONCURRENT_UPLOADS, MAX_RETRIES, BlobUploader, UploadError
+
+
+class FsspecUnstructuredProvider(UnstructuredStorageProvider):
+    """Uploads arbitrary bytes through an asynchronous fsspec file system.
+    They will be stored under bucket_name/base_path/filename
+
+    Uploads run concurrently in the background, see BlobUploader for the
+    meaning of max_concurrency and max_retries. flush_cache waits for all
+    of them to finish and raises an UploadError listing the blobs that
+    failed after all retries. shutdown does the same once it has closed
+    the file system.
+
+    Pass dedup_index_path to remember the uploaded blobs across runs (see
+    DedupIndex) and manifest_path to seed that index from a manifest of
+    the bucket. Blobs whose full path is in the index are never checked
+    for or uploaded again.
+
+    Pass a codec (see openwpm.storage.codecs) to compress the blobs before
+    the upload. Their names then get the codec's suffix.
+
+    Subclasses open the file system in `_open_file_system` and close its
+    session in `_close_file_system`.
+    """
+
+    file_system: AsyncFileSystem
+    uploader: BlobUploader
+
+    def __init__(
+        self,
+        bucket_name: str,
+        base_path: str,
+        max_concurrency: int = MAX_CONCURRENT_UPLOADS,
+        max_retries: int = MAX_RETRIES,
+        dedup_index_path: Optional[Path] = None,
+        manifest_path: Optional[Path] = None,
+        codec: Optional[Codec] = None,
+    ) -> None:
+        super().__init__()
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        if manifest_path is not None and dedup_index_path is None:
+            raise ValueError("manifest_path requires a dedup_index_path")
+        self.dedup_index_path = dedup_index_path
+        self.manifest_path = manifest_path
+        self.dedup_index: Optional[DedupIndex] = None
+        self.bucket_name = bucket_name
+        self.base_path = f"{bucket_name}/{base_path}/{{filename}}"
+        self.codec = codec
+
+        self.file_name_cache: Set[str] = set()
+        """The set of all filenames ever uploaded, checked before uploading"""
+        self.logger = logging.getLogger("openwpm")
+
+    @abstractmethod
+    async def _open_file_system(self) -> AsyncFileSystem:
+        """Returns an asynchronous file system with an open session"""
+
+    @abstractmethod
+    async def _close_file_system(self) -> None:
+        """Closes the session of self.file_system"""
+
+    async def init(self) -> None:
+        self.file_system = await self._open_file_system()
+        self.uploader = BlobUploader(self.max_concurrency, self.max_retries)
+        if self.dedup_index_path is not None:
+            self.dedup_index = DedupIndex(self.dedup_index_path)
+            if self.manifest_path is not None:
+                self.dedup_index.load_manifest(self.manifest_path, self.bucket_name)
+
+    async def store_blob(
+        self, filename: str, blob: bytes, overwrite: bool = False
+    ) -> None:
+        target_path = self.base_path.format(filename=filename)
+        if self.codec is not None:
+            target_path += self.codec.suffix
+        if not overwrite and (
+            filename in self.file_name_cache
+            or self.dedup_index is not None
+            and target_path in self.dedup_index
+        ):
+            self.logger.info("Not saving out file %s as it already exists", filename)
+            return
+        # Added right away so that duplicates arriving during the upload get skipped
+        self.file_name_cache.add(filename)
+        if self.codec is not None:
+            blob = self.codec.compress(blob)
+        await self.uploader.submit(
+            filename,
+            partial(self._upload, filename, target_path, blob, overwrite),
+            on_failure=partial(self.file_name_cache.discard, filename),
+        )
+
+    async def _upload(
+        self, filename: str, target_path: str, blob: bytes, overwrite: bool
+    ) -> None:
+        if not overwrite and await self.file_system._exists(target_path):
+            self.logger.info("Not saving out file %s as it already exists", filename)
+        else:
+            await self.file_system._pipe_file(target_path, blob)
+        if self.dedup_index is not None:
+            self.dedup_index.add(target_path)
+
+    async def flush_cache(self) -> None:
+        failed = await self.uploader.drain()
+        if self.dedup_index is not None:
+            self.dedup_index.flush()
+        if failed:
+            raise UploadError(failed)
+
+    async def shutdown(self) -> None:
+        failed: List[str] = await self.uploader.drain()
+        if self.dedup_index is not None:
+            self.dedup_index.close()
+        await self._close_file_system()
+        if failed:
+            raise UploadError(failed)
@@ -1,12 +1,16 @@
-import logging
-from typing import Optional, Set
+from pathlib import Path
+from typing import List, Optional
 
 import pyarrow.parquet as pq
 from gcsfs import GCSFileSystem
 from pyarrow.lib import Table
 
-from ..arrow_storage import ArrowProvider
-from ..storage_providers import TableName, UnstructuredStorageProvider
+from ..arrow_storage import CACHE_SIZE_BYTES, VISIT_ID_BUCKETS, ArrowProvider
+from ..codecs import Codec
+from ..storage_providers import TableName
+from .fsspec_storage import FsspecUnstructuredProvider
+from .spool import MAX_SPOOL_BYTES, SpoolUploader
+from .uploader import MAX_CONCURRENT_UPLOADS, MAX_RETRIES
 
 
 class GcsStructuredProvider(ArrowProvider):
@@ -20,6 +24,14 @@ class GcsStructuredProvider(ArrowProvider):
     base_path/visits/table_name in the given bucket.
 
     Pass a different sub_dir to change this.
+    Pass partition_cols to write Hive partitioned datasets (see ArrowProvider).
+
+    Pass spool_path to write the Parquet files to local disk first and
+    upload them in the background (see SpoolUploader). Visits are then
+    considered saved once their records are on local disk. The spool is
+    limited to max_spool_bytes and uploads left over from a previous run
+    are resumed on init. shutdown raises an UploadError if some of the
+    spooled files still couldn't be uploaded.
     """
 
     file_system: GCSFileSystem
@@ -31,11 +43,23 @@ class GcsStructuredProvider(ArrowProvider):
         base_path: str,
         token: Optional[str] = None,
         sub_dir: str = "visits",
+        partition_cols: Optional[List[str]] = None,
+        visit_id_buckets: int = VISIT_ID_BUCKETS,
+        cache_size_bytes: int = CACHE_SIZE_BYTES,
+        spool_path: Optional[Path] = None,
+        max_spool_bytes: int = MAX_SPOOL_BYTES,
     ) -> None:
-        super().__init__()
+        super().__init__(partition_cols, visit_id_buckets, cache_size_bytes)
         self.project = project
         self.token = token
         self.base_path = f"{bucket_name}/{base_path}/{sub_dir}/{{table_name}}"
+        self.spool: Optional[SpoolUploader] = None
+        if spool_path is not None:
+            self.spool = SpoolUploader(
+                spool_path,
+                self.base_path.removesuffix("/{table_name}"),
+                max_spool_bytes,
+            )
 
     def __str__(self) -> str:
         return f"GCS:{self.base_path.removesuffix('/{table_name}')}"
@@ -45,21 +69,33 @@ class GcsStructuredProvider(ArrowProvider):
         self.file_system = GCSFileSystem(
             project=self.project, token=self.token, access="read_write"
         )
+        if self.spool is not None:
+            await self.spool.start(self.file_system)
 
     async def write_table(self, table_name: TableName, table: Table) -> None:
+        if self.spool is not None:
+            await self.spool.add_table(
+                table_name, table, self.get_partition_cols(table)
+            )
+            return
         pq.write_to_dataset(
             table,
             self.base_path.format(table_name=table_name),
             filesystem=self.file_system,
+            partition_cols=self.get_partition_cols(table),
         )
 
     async def shutdown(self) -> None:
-        pass
+        await super().shutdown()
+        if self.spool is not None:
+            await self.spool.drain()
 
 
-class GcsUnstructuredProvider(UnstructuredStorageProvider):
+class GcsUnstructuredProvider(FsspecUnstructuredProvider):
     """This class allows you to upload arbitrary bytes to GCS.
     They will be stored under bucket_name/base_path/filename
+
+    See FsspecUnstructuredProvider for the uploads and the dedup index.
     """
 
     file_system: GCSFileSystem
@@ -70,40 +106,34 @@ class GcsUnstructuredProvider(UnstructuredStorageProvider):
         bucket_name: str,
         base_path: str,
         token: Optional[str] = None,
+        max_concurrency: int = MAX_CONCURRENT_UPLOADS,
+        max_retries: int = MAX_RETRIES,
+        dedup_index_path: Optional[Path] = None,
+        manifest_path: Optional[Path] = None,
+        codec: Optional[Codec] = None,
     ) -> None:
-        super().__init__()
+        super().__init__(
+            bucket_name,
+            base_path,
+            max_concurrency,
+            max_retries,
+            dedup_index_path,
+            manifest_path,
+            codec,
+        )
         self.project = project
-        self.bucket_name = bucket_name
-        self.base_path = base_path
         self.token = token
-        self.base_path = f"{bucket_name}/{base_path}/{{filename}}"
-
-        self.file_name_cache: Set[str] = set()
-        """The set of all filenames ever uploaded, checked before uploading"""
-        self.logger = logging.getLogger("openwpm")
 
-    async def init(self) -> None:
-        self.file_system = GCSFileSystem(
-            project=self.project, token=self.token, access="read_write"
+    async def _open_file_system(self) -> GCSFileSystem:
+        file_system = GCSFileSystem(
+            project=self.project,
+            token=self.token,
+            access="read_write",
+            asynchronous=True,
+            skip_instance_cache=True,
         )
+        await file_system.set_session()
+        return file_system
 
-    async def store_blob(
-        self, filename: str, blob: bytes, overwrite: bool = False
-    ) -> None:
-        target_path = self.base_path.format(filename=filename)
-        if not overwrite and (
-            filename in self.file_name_cache or self.file_system.exists(target_path)
-        ):
-            self.logger.info("Not saving out file %s as it already exists", filename)
-            return
-
-        with self.file_system.open(target_path, mode="wb") as f:
-            f.write(blob)
-
-        self.file_name_cache.add(filename)
-
-    async def flush_cache(self) -> None:
-        pass
-
-    async def shutdown(self) -> None:
-        pass
+    async def _close_file_system(self) -> None:
+        await self.file_system.session.close()
@@ -1,12 +1,16 @@
-import logging
-from typing import Any, Set
+from pathlib import Path
+from typing import Any, List, Optional
 
 import pyarrow.parquet as pq
 from pyarrow.lib import Table
 from s3fs import S3FileSystem
 
-from ..arrow_storage import ArrowProvider
-from ..storage_providers import TableName, UnstructuredStorageProvider
+from ..arrow_storage import CACHE_SIZE_BYTES, VISIT_ID_BUCKETS, ArrowProvider
+from ..codecs import Codec
+from ..storage_providers import TableName
+from .fsspec_storage import FsspecUnstructuredProvider
+from .spool import MAX_SPOOL_BYTES, SpoolUploader
+from .uploader import MAX_CONCURRENT_UPLOADS, MAX_RETRIES
 
 
 class S3StructuredProvider(ArrowProvider):
@@ -15,6 +19,14 @@ class S3StructuredProvider(ArrowProvider):
     S3StructuredProvider will by default store into
     base_path/visits/table_name in the given bucket.
     Pass a different sub_dir to change this.
+    Pass partition_cols to write Hive partitioned datasets (see ArrowProvider).
+
+    Pass spool_path to write the Parquet files to local disk first and
+    upload them in the background (see SpoolUploader). Visits are then
+    considered saved once their records are on local disk. The spool is
+    limited to max_spool_bytes and uploads left over from a previous run
+    are resumed on init. shutdown raises an UploadError if some of the
+    spooled files still couldn't be uploaded.
 
     **kwargs get passed on to S3FileSystem.__init__
     Please look at https://s3fs.readthedocs.io/en/latest/api.html#s3fs.core.S3FileSystem
@@ -24,11 +36,27 @@ class S3StructuredProvider(ArrowProvider):
     file_system: S3FileSystem
 
     def __init__(
-        self, bucket_name: str, base_path: str, sub_dir: str = "visits", **kwargs: Any
+        self,
+        bucket_name: str,
+        base_path: str,
+        sub_dir: str = "visits",
+        partition_cols: Optional[List[str]] = None,
+        visit_id_buckets: int = VISIT_ID_BUCKETS,
+        cache_size_bytes: int = CACHE_SIZE_BYTES,
+        spool_path: Optional[Path] = None,
+        max_spool_bytes: int = MAX_SPOOL_BYTES,
+        **kwargs: Any,
     ) -> None:
-        super().__init__()
+        super().__init__(partition_cols, visit_id_buckets, cache_size_bytes)
         self.kwargs = kwargs
         self.base_path = f"{bucket_name}/{base_path}/{sub_dir}/{{table_name}}"
+        self.spool: Optional[SpoolUploader] = None
+        if spool_path is not None:
+            self.spool = SpoolUploader(
+                spool_path,
+                self.base_path.removesuffix("/{table_name}"),
+                max_spool_bytes,
+            )
 
     def __str__(self) -> str:
         return f"S3FS:{self.base_path.removesuffix('/{table_name}')}"
@@ -36,21 +64,36 @@ class S3StructuredProvider(ArrowProvider):
     async def init(self) -> None:
         await super(S3StructuredProvider, self).init()
         self.file_system = S3FileSystem(**self.kwargs)
+        if self.spool is not None:
+            await self.spool.start(self.file_system)
 
     async def write_table(self, table_name: TableName, table: Table) -> None:
+        if self.spool is not None:
+            await self.spool.add_table(
+                table_name, table, self.get_partition_cols(table)
+            )
+            return
         self.file_system.start_transaction()
         pq.write_to_dataset(
             table,
             self.base_path.format(table_name=table_name),
             filesystem=self.file_system,
+            partition_cols=self.get_partition_cols(table),
         )
         self.file_system.end_transaction()
 
+    async def shutdown(self) -> None:
+        await super().shutdown()
+        if self.spool is not None:
+            await self.spool.drain()
+
 
-class S3UnstructuredProvider(UnstructuredStorageProvider):
+class S3UnstructuredProvider(FsspecUnstructuredProvider):
     """This class allows you to upload arbitrary bytes to S3.
     They will be stored under bucket_name/base_path/filename
 
+    See FsspecUnstructuredProvider for the uploads and the dedup index.
+
     **kwargs get passed on to S3FileSystem.__init__
     Please look at https://s3fs.readthedocs.io/en/latest/api.html#s3fs.core.S3FileSystem
     for further information
@@ -58,40 +101,34 @@ class S3UnstructuredProvider(UnstructuredStorageProvider):
 
     file_system: S3FileSystem
 
-    def __init__(self, bucket_name: str, base_path: str, **kwargs: Any) -> None:
-        super().__init__()
-        self.kwargs = kwargs
-        self.bucket_name = bucket_name
-        self.base_path = base_path
-        self.base_path = f"{bucket_name}/{base_path}/{{filename}}"
-
-        self.file_name_cache: Set[str] = set()
-        """The set of all filenames ever uploaded, checked before uploading"""
-        self.logger = logging.getLogger("openwpm")
-
-    async def init(self) -> None:
-        self.file_system = S3FileSystem(**self.kwargs)
-
-    async def store_blob(
-        self, filename: str, blob: bytes, overwrite: bool = False
+    def __init__(
+        self,
+        bucket_name: str,
+        base_path: str,
+        max_concurrency: int = MAX_CONCURRENT_UPLOADS,
+        max_retries: int = MAX_RETRIES,
+        dedup_index_path: Optional[Path] = None,
+        manifest_path: Optional[Path] = None,
+        codec: Optional[Codec] = None,
+        **kwargs: Any,
     ) -> None:
-        target_path = self.base_path.format(filename=filename)
-        if not overwrite and (
-            filename in self.file_name_cache or self.file_system.exists(target_path)
-        ):
-            self.logger.info("Not saving out file %s as it already exists", filename)
-            return
-        self.file_system.start_transaction()
-
-        with self.file_system.open(target_path, mode="wb") as f:
-            f.write(blob)
-
-        self.file_system.end_transaction()
-
-        self.file_name_cache.add(filename)
+        super().__init__(
+            bucket_name,
+            base_path,
+            max_concurrency,
+            max_retries,
+            dedup_index_path,
+            manifest_path,
+            codec,
+        )
+        self.kwargs = kwargs
 
-    async def flush_cache(self) -> None:
-        pass
+    async def _open_file_system(self) -> S3FileSystem:
+        file_system = S3FileSystem(
+            asynchronous=True, skip_instance_cache=True, **self.kwargs
+        )
+        await file_system.set_session()
+        return file_system
 
-    async def shutdown(self) -> None:
-        pass
+    async def _close_file_system(self) -> None:
+        await self.file_system._s3.close()
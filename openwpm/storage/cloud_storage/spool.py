@@ -0,0 +1,166 @@
+"""
+Write-behind staging of Parquet files for the cloud structured providers
+
+Instead of streaming every flush to the bucket, the tables get written to
+a local spool directory and uploaded in the background:
+
+    spool_path/.incoming-<pid>-<id>/<write>/...  files still being written
+    spool_path/ready/table_name/...              complete files to upload
+
+Files are only moved to ready/ once they have been written completely,
+so after a restart everything in ready/ gets uploaded. Every SpoolUploader
+writes to its own incoming directory, the ones left behind by processes
+that are no longer running are discarded.
+"""
+import asyncio
+import logging
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import List, Optional
+
+import pyarrow.parquet as pq
+from fsspec import AbstractFileSystem
+from pyarrow.lib import Table
+
+from .uploader import MAX_RETRIES, BlobUploader, UploadError
+
+MAX_SPOOL_BYTES = 10 * 1024**3
+MAX_CONCURRENT_SPOOL_UPLOADS = 8
+SPOOL_RETRY_INTERVAL = 30  # seconds
+INCOMING_PREFIX = ".incoming-"
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Owned by another user
+        pass
+    return True
+
+
+class SpoolUploader:
+    """Writes tables to spool_path and uploads them to remote_root
+
+    Once the files in the spool add up to max_spool_bytes, `add_table`
+    blocks until uploads have freed up space. Uploads that fail after all
+    retries are attempted again with the next `add_table` or `drain`.
+    """
+
+    file_system: AbstractFileSystem
+    uploader: BlobUploader
+
+    def __init__(
+        self,
+        spool_path: Path,
+        remote_root: str,
+        max_spool_bytes: int = MAX_SPOOL_BYTES,
+        max_retries: int = MAX_RETRIES,
+    ) -> None:
+        self.spool_path = spool_path
+        self.incoming_path = (
+            spool_path / f"{INCOMING_PREFIX}{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        )
+        self.ready_path = spool_path / "ready"
+        self.remote_root = remote_root
+        self.max_spool_bytes = max_spool_bytes
+        self.max_retries = max_retries
+        self.logger = logging.getLogger("openwpm")
+        self.spool_bytes = 0
+        self._failed: List[Path] = []
+        self._space_freed: Optional[asyncio.Event] = None
+
+    async def start(self, file_system: AbstractFileSystem) -> None:
+        """Resumes the uploads of files left over by a previous run"""
+        self.file_system = file_system
+        self.uploader = BlobUploader(MAX_CONCURRENT_SPOOL_UPLOADS, self.max_retries)
+        self._space_freed = asyncio.Event()
+        self._remove_stale_incoming()
+        self.ready_path.mkdir(parents=True, exist_ok=True)
+        leftovers = sorted(p for p in self.ready_path.rglob("*") if p.is_file())
+        if leftovers:
+            self.logger.info("Resuming the upload of %d spooled files", len(leftovers))
+        for path in leftovers:
+            self.spool_bytes += path.stat().st_size
+            await self._submit(path)
+
+    def _remove_stale_incoming(self) -> None:
+        """Removes the incoming directories of crashed processes"""
+        for path in self.spool_path.glob(f"{INCOMING_PREFIX}*"):
+            pid = path.name[len(INCOMING_PREFIX) :].split("-", 1)[0]
+            if not pid.isdigit() or not _is_running(int(pid)):
+                shutil.rmtree(path, ignore_errors=True)
+
+    async def add_table(
+        self, table_name: str, table: Table, partition_cols: Optional[List[str]]
+    ) -> None:
+        """Returns once the table is stored in the spool"""
+        assert self._space_freed is not None
+        await self._retry_failed()
+        while self.spool_bytes >= self.max_spool_bytes:
+            self.logger.info("The spool is full, waiting for uploads to finish")
+            self._space_freed.clear()
+            try:
+                await asyncio.wait_for(
+                    self._space_freed.wait(), timeout=SPOOL_RETRY_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                await self._retry_failed()
+        write_path = self.incoming_path / uuid.uuid4().hex
+        written: List[str] = []
+        pq.write_to_dataset(
+            table,
+            str(write_path),
+            partition_cols=partition_cols,
+            file_visitor=lambda written_file: written.append(written_file.path),
+        )
+        for file_path in written:
+            relative = Path(file_path).relative_to(write_path)
+            ready = self.ready_path / table_name / relative
+            ready.parent.mkdir(parents=True, exist_ok=True)
+            with open(file_path, "rb") as f:
+                os.fsync(f.fileno())
+            os.replace(file_path, ready)
+            self.spool_bytes += ready.stat().st_size
+            await self._submit(ready)
+        shutil.rmtree(write_path, ignore_errors=True)
+
+    async def _submit(self, path: Path) -> None:
+        remote_path = f"{self.remote_root}/{path.relative_to(self.ready_path)}"
+
+        async def upload() -> None:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.file_system.put_file, str(path), remote_path
+            )
+            self._remove(path)
+
+        await self.uploader.submit(
+            remote_path, upload, on_failure=lambda: self._failed.append(path)
+        )
+
+    def _remove(self, path: Path) -> None:
+        assert self._space_freed is not None
+        self.spool_bytes -= path.stat().st_size
+        path.unlink()
+        self._space_freed.set()
+
+    async def _retry_failed(self) -> None:
+        failed, self._failed = self._failed, []
+        for path in failed:
+            await self._submit(path)
+
+    async def drain(self) -> None:
+        """Waits for the uploads of all spooled files to finish
+
+        Raises an UploadError listing the files whose upload failed again.
+        They stay in the spool and get uploaded with the next `add_table`,
+        `drain` or on the next start.
+        """
+        await self._retry_failed()
+        await self.uploader.drain()
+        if self._failed:
+            raise UploadError([str(path) for path in self._failed])
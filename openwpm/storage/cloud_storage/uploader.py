@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import random
+from typing import Awaitable, Callable, List, Set
+
+MAX_CONCURRENT_UPLOADS = 32
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5  # seconds
+BACKOFF_MAX = 30  # seconds
+
+
+class UploadError(Exception):
+    """Raised by providers whose background uploads failed after all retries"""
+
+    def __init__(self, failed: List[str]) -> None:
+        self.failed = failed
+        super().__init__(f"Failed to upload {len(failed)} blobs: {failed[:10]}")
+
+
+class BlobUploader:
+    """Runs uploads concurrently on the event loop
+
+    At most `max_concurrency` uploads are in flight at any time. `submit`
+    waits for a free slot, which bounds the memory held by pending blobs.
+    Failed uploads are retried up to `max_retries` times, waiting an
+    exponentially growing, jittered delay between the attempts. The names
+    of the uploads that failed nonetheless are returned by `drain`.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = MAX_CONCURRENT_UPLOADS,
+        max_retries: int = MAX_RETRIES,
+        backoff_base: float = BACKOFF_BASE,
+        backoff_max: float = BACKOFF_MAX,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.logger = logging.getLogger("openwpm")
+        self._tasks: Set["asyncio.Task[bool]"] = set()
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._failed: List[str] = []
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def submit(
+        self,
+        name: str,
+        upload: Callable[[], Awaitable[None]],
+        on_failure: Callable[[], None] = lambda: None,
+    ) -> "asyncio.Task[bool]":
+        """Schedules `upload`, calling `on_failure` if all attempts fail
+
+        The returned task resolves to whether the upload succeeded.
+        """
+        await self._slots.acquire()
+        task = asyncio.create_task(self._run(name, upload, on_failure))
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task: "asyncio.Task[bool]") -> None:
+        self._tasks.discard(task)
+        self._slots.release()
+
+    async def _run(
+        self,
+        name: str,
+        upload: Callable[[], Awaitable[None]],
+        on_failure: Callable[[], None],
+    ) -> bool:
+        for attempt in range(self.max_retries + 1):
+            try:
+                await upload()
+                return True
+            except Exception:
+                if attempt == self.max_retries:
+                    self.logger.error(
+                        "Giving up on uploading %s after %d attempts",
+                        name,
+                        attempt + 1,
+                        exc_info=True,
+                    )
+                    break
+                delay = min(self.backoff_max, self.backoff_base * 2**attempt)
+                self.logger.warning(
+                    "Failed to upload %s, retrying in %.1fs", name, delay
+                )
+                await asyncio.sleep(random.uniform(delay / 2, delay))
+        self._failed.append(name)
+        on_failure()
+        return False
+
+    async def drain(self) -> List[str]:
+        """Waits for all submitted uploads to finish
+
+        Returns the names of the uploads that failed since the last drain.
+        """
+        while self._tasks:
+            await asyncio.gather(*self._tasks)
+        failed, self._failed = self._failed, []
+        return failed
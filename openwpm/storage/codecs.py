@@ -0,0 +1,155 @@
+"""
+Compression codecs for the unstructured storage providers
+
+Every blob gets compressed on its own, which leaves most of the redundancy
+between the stored files unused, as scripts and pages from different sites
+share a lot of boilerplate. The ZstdCodec can make use of it through a
+dictionary trained on a sample of the crawl's own content.
+"""
+import gzip
+import logging
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import zstandard
+
+DICTIONARY_SIZE = 112 * 1024
+TRAINING_SAMPLES = 1000
+SAMPLE_SIZE = 128 * 1024  # bytes kept of every sampled blob
+TRAINING_BYTES = 100 * DICTIONARY_SIZE  # as recommended by zstd
+TRAINING_ATTEMPTS = 3
+
+
+class Codec(ABC):
+    """Compresses blobs one at a time
+
+    `suffix` is the file extension of the compressed blobs
+    """
+
+    suffix: str
+
+    @abstractmethod
+    def compress(self, blob: bytes) -> bytes:
+        pass
+
+    @abstractmethod
+    def decompress(self, data: bytes) -> bytes:
+        pass
+
+
+class GzipCodec(Codec):
+    """Produces the same gzip files as UnstructuredStorageProvider._compress"""
+
+    suffix = ".zip"
+
+    def __init__(self, level: int = 9) -> None:
+        self.level = level
+
+    def compress(self, blob: bytes) -> bytes:
+        return gzip.compress(blob, compresslevel=self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return gzip.decompress(data)
+
+
+def train_dictionary(samples: List[bytes], size: int = DICTIONARY_SIZE) -> bytes:
+    """Trains a zstd dictionary of up to `size` bytes on the given samples"""
+    return zstandard.train_dictionary(size, samples).as_bytes()
+
+
+class ZstdCodec(Codec):
+    """Compresses blobs as zstd frames, optionally using a dictionary
+
+    Parameters
+    ----------
+    level
+        The zstd compression level
+    dictionary_path
+        If the file exists, its dictionary gets used for compression.
+        Otherwise the first `training_samples` blobs are compressed without
+        a dictionary and used to train one, which gets written to
+        dictionary_path and used for all following blobs. Only the first
+        SAMPLE_SIZE bytes of every blob are kept and training starts early
+        once the samples add up to TRAINING_BYTES. If training fails, the
+        next blobs are sampled instead, up to TRAINING_ATTEMPTS times.
+
+    Every frame records the id of the dictionary it was compressed with,
+    so `decompress` handles blobs from before and after the training.
+    """
+
+    suffix = ".zst"
+
+    def __init__(
+        self,
+        level: int = 3,
+        dictionary_path: Optional[Path] = None,
+        training_samples: int = TRAINING_SAMPLES,
+        dictionary_size: int = DICTIONARY_SIZE,
+    ) -> None:
+        self.level = level
+        self.dictionary_path = dictionary_path
+        self.training_samples = training_samples
+        self.dictionary_size = dictionary_size
+        self.logger = logging.getLogger("openwpm")
+        self._samples: List[bytes] = []
+        self._sample_bytes = 0
+        self._training_attempts = 0
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressors: Dict[int, zstandard.ZstdDecompressor] = {
+            0: zstandard.ZstdDecompressor()
+        }
+        self.dictionary: Optional[zstandard.ZstdCompressionDict] = None
+        if dictionary_path is not None and dictionary_path.exists():
+            self._use_dictionary(dictionary_path.read_bytes())
+
+    def _use_dictionary(self, data: bytes) -> None:
+        self.dictionary = zstandard.ZstdCompressionDict(data)
+        self._compressor = zstandard.ZstdCompressor(
+            level=self.level, dict_data=self.dictionary
+        )
+        self._decompressors[self.dictionary.dict_id()] = zstandard.ZstdDecompressor(
+            dict_data=self.dictionary
+        )
+
+    def _train(self) -> None:
+        assert self.dictionary_path is not None
+        samples, self._samples = self._samples, []
+        self._sample_bytes = 0
+        self._training_attempts += 1
+        try:
+            data = train_dictionary(samples, self.dictionary_size)
+        except zstandard.ZstdError:
+            # Happens if the samples are too small or too few
+            self.logger.warning(
+                "Couldn't train a dictionary on %d samples (attempt %d of %d)",
+                len(samples),
+                self._training_attempts,
+                TRAINING_ATTEMPTS,
+            )
+            return
+        self.dictionary_path.write_bytes(data)
+        self._use_dictionary(data)
+        self.logger.info("Trained a zstd dictionary of %d bytes", len(data))
+
+    def compress(self, blob: bytes) -> bytes:
+        if (
+            self.dictionary is None
+            and self.dictionary_path is not None
+            and self._training_attempts < TRAINING_ATTEMPTS
+        ):
+            sample = blob[:SAMPLE_SIZE]
+            self._samples.append(sample)
+            self._sample_bytes += len(sample)
+            if (
+                len(self._samples) >= self.training_samples
+                or self._sample_bytes >= TRAINING_BYTES
+            ):
+                self._train()
+        return self._compressor.compress(blob)
+
+    def decompress(self, data: bytes) -> bytes:
+        dict_id = zstandard.get_frame_parameters(data).dict_id
+        if dict_id not in self._decompressors:
+            raise ValueError(f"Blob was compressed with unknown dictionary {dict_id}")
+        return self._decompressors[dict_id].decompress(data)
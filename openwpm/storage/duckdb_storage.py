@@ -0,0 +1,69 @@
+import asyncio
+from pathlib import Path
+
+import duckdb
+from pyarrow import Table
+
+from .arrow_storage import CACHE_SIZE_BYTES, ArrowProvider
+from .parquet_schema import PQ_SCHEMAS
+from .storage_providers import TableName
+
+_BATCH_VIEW = "_openwpm_batch"
+
+
+class DuckDbProvider(ArrowProvider):
+    """Appends the cached record batches to the tables of a DuckDB database
+
+    DuckDB stores the data column-wise and compressed, so aggregations
+    over a full crawl can be run directly on the database file, e.g.
+
+    .. code-block:: Python
+
+        con = duckdb.connect("crawl-data.duckdb", read_only=True)
+        con.sql("SELECT site_url, COUNT(*) FROM javascript GROUP BY ALL")
+
+    All tables get created from PQ_SCHEMAS when the provider is initialized.
+    As DuckDB only allows a single process to open the database for writing,
+    it can only be queried once the crawl has finished.
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        cache_size_bytes: int = CACHE_SIZE_BYTES,
+    ) -> None:
+        super().__init__(cache_size_bytes=cache_size_bytes)
+        self.db_path = db_path
+
+    async def init(self) -> None:
+        await super().init()
+        self.db = duckdb.connect(str(self.db_path))
+        for table_name, schema in PQ_SCHEMAS.items():
+            self._with_batch(
+                schema.empty_table(),
+                f"CREATE TABLE IF NOT EXISTS {table_name} AS "
+                f"SELECT * FROM {_BATCH_VIEW}",
+            )
+
+    def _with_batch(self, table: Table, query: str) -> None:
+        """Runs query with table registered as _BATCH_VIEW"""
+        self.db.register(_BATCH_VIEW, table)
+        try:
+            self.db.execute(query)
+        finally:
+            self.db.unregister(_BATCH_VIEW)
+
+    async def write_table(self, table_name: TableName, table: Table) -> None:
+        # DuckDB releases the GIL while inserting, so the event loop
+        # can keep receiving records
+        await asyncio.get_running_loop().run_in_executor(
+            None,
+            self._with_batch,
+            table,
+            f"INSERT INTO {table_name} BY NAME SELECT * FROM {_BATCH_VIEW}",
+        )
+
+    async def shutdown(self) -> None:
+        await super().shutdown()
+        self.db.execute("CHECKPOINT")
+        self.db.close()
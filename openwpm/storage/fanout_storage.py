@@ -0,0 +1,210 @@
+import asyncio
+import logging
+from asyncio import Future, Task
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from openwpm.types import VisitId
+
+from .storage_providers import StructuredStorageProvider, TableName
+
+MAX_BUFFERED_OPERATIONS = 100000
+SINK_STALL_TIMEOUT = 60  # seconds a full queue may keep the others waiting
+
+# Returns a task if the operation only completes once that task is done
+Operation = Callable[[], Awaitable[Optional["Task[None]"]]]
+QueueItem = Optional[Tuple[Operation, Optional["Future[None]"]]]
+
+
+def _resolve(done: "Future[None]", error: Optional[BaseException] = None) -> None:
+    if done.done():
+        return
+    if error is None:
+        done.set_result(None)
+    else:
+        done.set_exception(error)
+
+
+class SinkFailedError(Exception):
+    """Set on the operations of a child provider that failed or stalled"""
+
+
+class _Sink:
+    """Applies the operations for one child provider in order
+
+    Every child gets its own queue and worker task, so a slow child only
+    falls behind instead of holding up the others. Once an operation
+    raised, or the queue stayed full for stall_timeout seconds, the child
+    is marked as failed and all further operations are skipped.
+    """
+
+    worker: "Task[None]"
+
+    def __init__(
+        self,
+        provider: StructuredStorageProvider,
+        max_buffered: int,
+        stall_timeout: float,
+    ) -> None:
+        self.provider = provider
+        self.stall_timeout = stall_timeout
+        self.error: Optional[SinkFailedError] = None
+        self.stalled = False
+        self.queue: "asyncio.Queue[QueueItem]" = asyncio.Queue(max_buffered)
+        self.logger = logging.getLogger("openwpm")
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None
+
+    def start(self) -> None:
+        self.worker = asyncio.create_task(self._work())
+
+    def _fail(self, message: str, exc_info: Optional[BaseException] = None) -> None:
+        self.logger.error(
+            "Storage provider %s %s, skipping it from now on",
+            self.provider,
+            message,
+            exc_info=exc_info,
+        )
+        self.error = SinkFailedError(f"Storage provider {self.provider} {message}")
+
+    async def put(self, operation: Operation) -> None:
+        """Queues an operation without waiting for its result"""
+        await self._put((operation, None))
+
+    async def submit(self, operation: Operation) -> "Future[None]":
+        """Queues operation and returns a future that resolves once it completed,
+        or raises a SinkFailedError if the child failed"""
+        done: "Future[None]" = asyncio.get_running_loop().create_future()
+        await self._put((operation, done))
+        if self.failed:
+            _resolve(done, self.error)
+        return done
+
+    async def _put(self, item: QueueItem) -> None:
+        if self.failed:
+            return
+        try:
+            await asyncio.wait_for(self.queue.put(item), self.stall_timeout)
+        except asyncio.TimeoutError:
+            self.stalled = True
+            self._fail(f"didn't take any operation for {self.stall_timeout}s")
+
+    async def _work(self) -> None:
+        while (item := await self.queue.get()) is not None:
+            operation, done = item
+            pending = None
+            if not self.failed:
+                try:
+                    pending = await operation()
+                except Exception as e:
+                    self._fail("failed", exc_info=e)
+            if done is None:
+                continue
+            if pending is None:
+                _resolve(done, self.error)
+            else:
+                pending.add_done_callback(partial(self._pending_done, done))
+
+    def _pending_done(self, done: "Future[None]", task: "Task[None]") -> None:
+        error: Optional[BaseException] = None
+        if task.cancelled():
+            error = SinkFailedError(f"Storage provider {self.provider} got cancelled")
+        elif task.exception() is not None:
+            error = task.exception()
+            self.logger.error(
+                "Storage provider %s failed to save a visit",
+                self.provider,
+                exc_info=error,
+            )
+        _resolve(done, error)
+
+    async def stop(self) -> None:
+        """Shuts the child down once all queued operations are done"""
+        shutdown = await self.submit(self.provider.shutdown)
+        if not self.stalled:
+            # Also queued for failed children, whose worker skips everything
+            try:
+                await asyncio.wait_for(self.queue.put(None), self.stall_timeout)
+            except asyncio.TimeoutError:
+                self.stalled = True
+        if self.stalled:
+            # The worker may never get to the end of the queue
+            self.worker.cancel()
+        await asyncio.gather(shutdown, self.worker, return_exceptions=True)
+
+
+class FanOutStructuredProvider(StructuredStorageProvider):
+    """Passes every record on to several structured providers at once,
+    e.g. a SQLiteStorageProvider for quick inspection and a
+    GcsStructuredProvider for the data pipeline.
+
+    The children work through their own queue of up to max_buffered
+    operations each, so a slow child doesn't slow down the others until
+    its queue is full. A child that raises an exception, or whose queue
+    stays full for stall_timeout seconds, gets logged and skipped from
+    then on, while the other children keep going. The token returned by finalize_visit_id resolves
+    once all children have saved the visit, and raises if any of them
+    failed to.
+    """
+
+    def __init__(
+        self,
+        *providers: StructuredStorageProvider,
+        max_buffered: int = MAX_BUFFERED_OPERATIONS,
+        stall_timeout: float = SINK_STALL_TIMEOUT,
+    ) -> None:
+        super().__init__()
+        if not providers:
+            raise ValueError("At least one storage provider is required")
+        self.providers = providers
+        self.max_buffered = max_buffered
+        self.stall_timeout = stall_timeout
+        self.sinks: List[_Sink] = []
+
+    def __str__(self) -> str:
+        return "FanOut(%s)" % ", ".join(str(p) for p in self.providers)
+
+    async def init(self) -> None:
+        await asyncio.gather(*(provider.init() for provider in self.providers))
+        self.sinks = [
+            _Sink(p, self.max_buffered, self.stall_timeout) for p in self.providers
+        ]
+        for sink in self.sinks:
+            sink.start()
+
+    async def store_record(
+        self, table: TableName, visit_id: VisitId, record: Dict[str, Any]
+    ) -> None:
+        for sink in self.sinks:
+            # Every child gets its own copy in case it modifies the record
+            await sink.put(
+                partial(sink.provider.store_record, table, visit_id, dict(record))
+            )
+
+    async def finalize_visit_id(
+        self, visit_id: VisitId, interrupted: bool = False
+    ) -> Task[None]:
+        saved = [
+            await sink.submit(
+                partial(sink.provider.finalize_visit_id, visit_id, interrupted)
+            )
+            for sink in self.sinks
+        ]
+
+        async def wait_for_children() -> None:
+            results = await asyncio.gather(*saved, return_exceptions=True)
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+
+        return asyncio.create_task(wait_for_children())
+
+    async def flush_cache(self) -> None:
+        flushed = [await sink.submit(sink.provider.flush_cache) for sink in self.sinks]
+        # Failed children are skipped, they don't fail the flush
+        await asyncio.gather(*flushed, return_exceptions=True)
+
+    async def shutdown(self) -> None:
+        await asyncio.gather(*(sink.stop() for sink in self.sinks))
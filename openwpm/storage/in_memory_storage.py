@@ -17,7 +17,7 @@ from pyarrow import Table
 
 from openwpm.types import VisitId
 
-from .arrow_storage import ArrowProvider
+from .arrow_storage import CACHE_SIZE_BYTES, ArrowProvider
 from .storage_providers import (
     StructuredStorageProvider,
     TableName,
@@ -151,8 +151,8 @@ class MemoryUnstructuredProvider(UnstructuredStorageProvider):
 
 
 class MemoryArrowProvider(ArrowProvider):
-    def __init__(self) -> None:
-        super().__init__()
+    def __init__(self, cache_size_bytes: int = CACHE_SIZE_BYTES) -> None:
+        super().__init__(cache_size_bytes=cache_size_bytes)
         self.queue = Queue()
         self.handle = MemoryProviderHandle(self.queue)
 
@@ -1,21 +1,39 @@
 from pathlib import Path
+from typing import Optional, Set
 
 import plyvel
 from plyvel._plyvel import WriteBatch
 
-from .storage_providers import UnstructuredStorageProvider
+from .codecs import Codec
+from .storage_providers import ReadableUnstructuredStorageProvider
 
 LDB_BATCH_SIZE = 100
 
 
-class LevelDbProvider(UnstructuredStorageProvider):
+class LevelDbProvider(ReadableUnstructuredStorageProvider):
+    """Stores blobs in a LevelDB, keyed by their filename (the content hash)
+
+    To deduplicate without reading from disk, the 64 bit hashes of all keys
+    are kept in memory, including those of the blobs still waiting in the
+    current write batch. The set is seeded from the existing keys in `init`.
+    Keeping hashes instead of keys saves most of the memory, at the
+    cost of a negligible chance (below 1e-5 for ten million blobs) of a
+    colliding blob not getting stored.
+
+    LevelDB already compresses its blocks with snappy. Pass a codec (see
+    openwpm.storage.codecs) to compress every blob on its own instead, e.g.
+    with a zstd dictionary. Readers then need to use the same codec.
+    """
+
     ldb: plyvel.DB
     content_batch: WriteBatch
 
-    def __init__(self, db_path: Path):
+    def __init__(self, db_path: Path, codec: Optional[Codec] = None):
         self.db_path = db_path
+        self.codec = codec
         self._ldb_counter = 0
         self._ldb_commit_time = 0
+        self._known_hashes: Set[int] = set()
 
     async def init(self) -> None:
         self.ldb = plyvel.DB(
@@ -25,6 +43,8 @@ class LevelDbProvider(UnstructuredStorageProvider):
             compression="snappy",
         )
         self.content_batch = self.ldb.write_batch()
+        for key in self.ldb.iterator(include_value=False):
+            self._known_hashes.add(hash(key))
 
     async def flush_cache(self) -> None:
         """Write out content batch to LevelDB database"""
@@ -41,11 +61,27 @@ class LevelDbProvider(UnstructuredStorageProvider):
         overwrite: bool = False,
     ) -> None:
         content_hash = str(filename).encode("ascii")
-        if self.ldb.get(content_hash) is not None and not overwrite:
+        key_hash = hash(content_hash)
+        if key_hash in self._known_hashes and not overwrite:
             return
+        if self.codec is not None:
+            blob = self.codec.compress(blob)
         self.content_batch.put(content_hash, blob)
+        self._known_hashes.add(key_hash)
         self._ldb_counter += 1
 
         if self._ldb_counter >= LDB_BATCH_SIZE:
             await self.flush_cache()
             self._ldb_counter = 0
+
+    async def read_blob(self, filename: str) -> Optional[bytes]:
+        """Only sees blobs that have been flushed"""
+        blob: Optional[bytes] = self.ldb.get(str(filename).encode("ascii"))
+        if blob is not None and self.codec is not None:
+            blob = self.codec.decompress(blob)
+        return blob
+
+    async def delete_blob(self, filename: str) -> None:
+        content_hash = str(filename).encode("ascii")
+        self.ldb.delete(content_hash)
+        self._known_hashes.discard(hash(content_hash))
@@ -1,47 +1,272 @@
+import asyncio
 import logging
+import os
+import time
 from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
 
+import pyarrow as pa
 import pyarrow.parquet as pq
 from pyarrow.lib import Table
 
-from .arrow_storage import ArrowProvider
-from .storage_providers import TableName, UnstructuredStorageProvider
+from .arrow_storage import CACHE_SIZE_BYTES, VISIT_ID_BUCKETS, ArrowProvider
+from .codecs import Codec, GzipCodec
+from .storage_providers import ReadableUnstructuredStorageProvider, TableName
+
+IPC_SUFFIX = ".arrows"
+IN_PROGRESS_PREFIX = "."  # Ignored by the pyarrow dataset readers
+MAX_FILE_BYTES = 512 * 1024**2
+MAX_FILE_AGE = 300  # seconds
+
+
+class _RollingParquetWriter:
+    """Keeps a ParquetWriter open on a hidden in-progress file and
+    atomically renames it to its final name once it gets closed"""
+
+    def __init__(self, final_path: Path, schema: pa.Schema) -> None:
+        self.final_path = final_path
+        self.tmp_path = final_path.with_name(IN_PROGRESS_PREFIX + final_path.name)
+        self.sink = pa.OSFile(str(self.tmp_path), mode="wb")
+        self.writer = pq.ParquetWriter(self.sink, schema)
+        self.opened_at = time.time()
+
+    def write_table(self, table: Table, row_group_bytes: Optional[int]) -> None:
+        row_group_size = None
+        if row_group_bytes is not None and table.num_rows:
+            # Converts the byte target into rows based on the average row size
+            row_bytes = max(1, table.nbytes // table.num_rows)
+            row_group_size = max(1, row_group_bytes // row_bytes)
+        self.writer.write_table(table, row_group_size=row_group_size)
+
+    @property
+    def size(self) -> int:
+        return self.sink.tell()
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.opened_at
+
+    def close(self) -> None:
+        self.writer.close()
+        self.sink.close()
+        os.replace(self.tmp_path, self.final_path)
 
 
 class LocalArrowProvider(ArrowProvider):
-    """Stores Parquet files under storage_path/table_name/n.parquet"""
+    """Stores Parquet files under storage_path/table_name/n.parquet
 
-    def __init__(self, storage_path: Path) -> None:
-        super().__init__()
+    If partition_cols are given the files are stored in Hive style
+    partition directories below storage_path/table_name.
+    See ArrowProvider for the supported columns.
+
+    If persistent_writers is set, one ParquetWriter is kept open per table
+    and the flushes triggered by a full cache get appended to it as new
+    row groups. Files are rolled over once they reach max_file_bytes or
+    max_file_age seconds, or when flush_cache gets called directly (e.g. by
+    the StorageController), and only then become visible to readers, as
+    they get written under a hidden name and atomically renamed when they
+    are finalized. The Parquet footer is only written then as well, so the
+    tokens returned by finalize_visit_id resolve once all files holding
+    data of the visit have been finalized. row_group_bytes is the targeted
+    uncompressed size of the row groups, estimated from the average row
+    size of every flush.
+    """
+
+    def __init__(
+        self,
+        storage_path: Path,
+        partition_cols: Optional[List[str]] = None,
+        visit_id_buckets: int = VISIT_ID_BUCKETS,
+        cache_size_bytes: int = CACHE_SIZE_BYTES,
+        persistent_writers: bool = False,
+        row_group_bytes: Optional[int] = None,
+        max_file_bytes: int = MAX_FILE_BYTES,
+        max_file_age: float = MAX_FILE_AGE,
+    ) -> None:
+        super().__init__(partition_cols, visit_id_buckets, cache_size_bytes)
+        if persistent_writers and self.partition_cols:
+            raise ValueError("persistent_writers can't be combined with partition_cols")
         self.storage_path = storage_path
+        self.persistent_writers = persistent_writers
+        self.row_group_bytes = row_group_bytes
+        self.max_file_bytes = max_file_bytes
+        self.max_file_age = max_file_age
+        self._writers: Dict[TableName, _RollingParquetWriter] = {}
+        self._file_counter = 0
+        # The writers used by the current flush
+        self._flush_writers: Set[_RollingParquetWriter] = set()
+        # Flush events waiting for the writers holding their data to be closed
+        self._pending_events: List[
+            Tuple[List[asyncio.Event], Set[_RollingParquetWriter]]
+        ] = []
 
     async def write_table(self, table_name: TableName, table: Table) -> None:
-        pq.write_to_dataset(table, str(self.storage_path / table_name))
+        if not self.persistent_writers:
+            pq.write_to_dataset(
+                table,
+                str(self.storage_path / table_name),
+                partition_cols=self.get_partition_cols(table),
+            )
+            return
+
+        if table_name not in self._writers:
+            table_path = self.storage_path / table_name
+            table_path.mkdir(parents=True, exist_ok=True)
+            file_name = f"{self._instance_id}-{self._file_counter}.parquet"
+            self._file_counter += 1
+            self._writers[table_name] = _RollingParquetWriter(
+                table_path / file_name, table.schema
+            )
+        writer = self._writers[table_name]
+        writer.write_table(table, self.row_group_bytes)
+        self._flush_writers.add(writer)
+        if writer.size >= self.max_file_bytes or writer.age >= self.max_file_age:
+            self._close_writer(table_name)
+
+    def _close_writer(self, table_name: TableName) -> None:
+        writer = self._writers.pop(table_name)
+        size = writer.size
+        writer.close()
+        self.logger.debug(
+            "Finalized %s after writing %d bytes", writer.final_path, size
+        )
+        self._flush_writers.discard(writer)
+        still_pending = []
+        for events, writers in self._pending_events:
+            writers.discard(writer)
+            if writers:
+                still_pending.append((events, writers))
+            else:
+                for event in events:
+                    event.set()
+        self._pending_events = still_pending
+
+    def _flushed(self, events: List[asyncio.Event]) -> None:
+        writers, self._flush_writers = self._flush_writers, set()
+        if writers:
+            self._pending_events.append((events, writers))
+        else:
+            super()._flushed(events)
+
+    async def flush_cache(self, lock: Optional[asyncio.Lock] = None) -> None:
+        await super().flush_cache(lock)
+        # The lock only gets passed in when finalize_visit_id filled up the
+        # cache. Everyone else expects the tokens to resolve after a flush.
+        flushed_by_caller = lock is None
+        for table_name in list(self._writers.keys()):
+            if flushed_by_caller or self._writers[table_name].age >= self.max_file_age:
+                self._close_writer(table_name)
+
+    async def shutdown(self) -> None:
+        await super().shutdown()
+        for table_name in list(self._writers.keys()):
+            self._close_writer(table_name)
 
 
-class LocalGzipProvider(UnstructuredStorageProvider):
-    """Stores files as storage_path/hash.zip"""
+class LocalArrowIpcProvider(ArrowProvider):
+    """Appends record batches to Arrow IPC stream files under
+    storage_path/table_name/instance_id.arrows
+
+    Writing the IPC format is a lot cheaper than encoding Parquet, which makes
+    this provider a good fit for local and debugging crawls.
+    The files can be memory-mapped for zero-copy reads with `read_ipc_table`
+    and converted to Parquet after the crawl with `convert_ipc_to_parquet`.
+    """
+
+    def __init__(
+        self, storage_path: Path, cache_size_bytes: int = CACHE_SIZE_BYTES
+    ) -> None:
+        super().__init__(cache_size_bytes=cache_size_bytes)
+        self.storage_path = storage_path
+        self._writers: Dict[
+            TableName, Tuple[pa.NativeFile, pa.ipc.RecordBatchStreamWriter]
+        ] = {}
+
+    async def write_table(self, table_name: TableName, table: Table) -> None:
+        if table_name not in self._writers:
+            table_path = self.storage_path / table_name
+            table_path.mkdir(parents=True, exist_ok=True)
+            sink = pa.OSFile(
+                str(table_path / f"{self._instance_id}{IPC_SUFFIX}"), mode="wb"
+            )
+            self._writers[table_name] = (sink, pa.ipc.new_stream(sink, table.schema))
+        sink, writer = self._writers[table_name]
+        writer.write_table(table)
+        sink.flush()
+
+    async def shutdown(self) -> None:
+        await super().shutdown()
+        for sink, writer in self._writers.values():
+            writer.close()
+            sink.close()
+        self._writers.clear()
+
+
+def read_ipc_table(path: Path) -> Table:
+    """Memory-maps a single IPC stream file written by LocalArrowIpcProvider
+
+    The returned table references the mapped file instead of copying it
+    """
+    with pa.memory_map(str(path), "r") as source:
+        return pa.ipc.open_stream(source).read_all()
+
+
+def convert_ipc_to_parquet(source_path: Path, target_path: Path) -> None:
+    """Converts the output of a LocalArrowIpcProvider into the layout
+    LocalArrowProvider would have produced
+
+    Every IPC stream file becomes one Parquet file under
+    target_path/table_name/. Batches are converted one at a time
+    to keep the memory usage bounded.
+    """
+    for ipc_file in sorted(source_path.glob(f"*/*{IPC_SUFFIX}")):
+        table_path = target_path / ipc_file.parent.name
+        table_path.mkdir(parents=True, exist_ok=True)
+        with pa.memory_map(str(ipc_file), "r") as source:
+            reader = pa.ipc.open_stream(source)
+            with pq.ParquetWriter(
+                str(table_path / (ipc_file.stem + ".parquet")), reader.schema
+            ) as writer:
+                for batch in reader:
+                    writer.write_batch(batch)
+
+
+class LocalGzipProvider(ReadableUnstructuredStorageProvider):
+    """Stores files as storage_path/hash.zip
+
+    Pass a different codec (see openwpm.storage.codecs) to change the
+    compression. The file extension then follows the codec.
+    """
 
     async def init(self) -> None:
         pass
 
-    def __init__(self, storage_path: Path) -> None:
+    def __init__(self, storage_path: Path, codec: Optional[Codec] = None) -> None:
         super().__init__()
         self.storage_path = storage_path
+        self.codec = codec or GzipCodec()
         self.logger = logging.getLogger("openwpm")
 
     async def store_blob(
         self, filename: str, blob: bytes, overwrite: bool = False
     ) -> None:
-        path = self.storage_path / (filename + ".zip")
+        path = self.storage_path / (filename + self.codec.suffix)
         if path.exists() and not overwrite:
             self.logger.debug(
                 "File %s already exists on disk. Not overwriting", filename
             )
             return
-        compressed = self._compress(blob)
         with path.open(mode="wb") as f:
-            f.write(compressed.read())
+            f.write(self.codec.compress(blob))
+
+    async def read_blob(self, filename: str) -> Optional[bytes]:
+        path = self.storage_path / (filename + self.codec.suffix)
+        if not path.exists():
+            return None
+        return self.codec.decompress(path.read_bytes())
+
+    async def delete_blob(self, filename: str) -> None:
+        (self.storage_path / (filename + self.codec.suffix)).unlink(missing_ok=True)
 
     async def flush_cache(self) -> None:
         pass
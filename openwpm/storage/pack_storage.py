@@ -0,0 +1,284 @@
+"""
+Content-addressed pack files for unstructured data
+
+Instead of creating one file per blob, the LocalPackProvider appends the
+compressed blobs to large segment files and records the location of every
+blob in an SQLite index next to them:
+
+    storage_path/index.sqlite
+    storage_path/000000.pack
+    storage_path/000001.pack
+    ...
+
+Use the PackReader to read blobs back and `repack` to reclaim the space
+taken up by overwritten blobs.
+
+Usage:
+    python -m openwpm.storage.pack_storage storage_path
+    (repacks the pack files in storage_path)
+"""
+import logging
+import mmap
+import os
+import sqlite3
+import sys
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Set, Tuple
+
+from .codecs import Codec, GzipCodec
+from .storage_providers import UnstructuredStorageProvider
+
+PACK_SUFFIX = ".pack"
+INDEX_NAME = "index.sqlite"
+MAX_SEGMENT_BYTES = 1024**3
+INDEX_BATCH_SIZE = 100
+
+INDEX_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS blobs (
+        hash TEXT PRIMARY KEY,
+        segment INTEGER NOT NULL,
+        offset INTEGER NOT NULL,
+        length INTEGER NOT NULL
+    ) WITHOUT ROWID
+"""
+
+IndexEntry = Tuple[str, int, int, int]
+
+
+def _segment_path(storage_path: Path, segment: int) -> Path:
+    return storage_path / f"{segment:06d}{PACK_SUFFIX}"
+
+
+def _segment_ids(storage_path: Path) -> List[int]:
+    return sorted(int(p.stem) for p in storage_path.glob(f"*{PACK_SUFFIX}"))
+
+
+def _sync_and_close(segment: BinaryIO) -> None:
+    segment.flush()
+    os.fsync(segment.fileno())
+    segment.close()
+
+
+def _open_index(storage_path: Path) -> sqlite3.Connection:
+    con = sqlite3.connect(storage_path / INDEX_NAME)
+    con.execute(INDEX_SCHEMA)
+    return con
+
+
+class LocalPackProvider(UnstructuredStorageProvider):
+    """Appends compressed blobs to segment files of up to max_segment_bytes
+
+    Blobs are gzipped unless a different codec (see openwpm.storage.codecs)
+    is passed. The PackReader needs to be given the same codec.
+
+    Every blob is recorded as hash -> (segment, offset, length) in the
+    index. Index entries are only committed after the segment they point
+    to has been flushed, so the index never references data that is
+    missing from disk. Each provider instance starts a new segment, so
+    a crashed writer never leaves a partially written segment in use.
+    """
+
+    index: sqlite3.Connection
+
+    def __init__(
+        self,
+        storage_path: Path,
+        max_segment_bytes: int = MAX_SEGMENT_BYTES,
+        codec: Optional[Codec] = None,
+    ) -> None:
+        super().__init__()
+        self.storage_path = storage_path
+        self.max_segment_bytes = max_segment_bytes
+        self.codec = codec or GzipCodec()
+        self.logger = logging.getLogger("openwpm")
+        self._known_hashes: Set[str] = set()
+        self._pending: List[IndexEntry] = []
+        self._segment: Optional[BinaryIO] = None
+        self._segment_id = -1
+        self._offset = 0
+
+    async def init(self) -> None:
+        self.storage_path.mkdir(parents=True, exist_ok=True)
+        self.index = _open_index(self.storage_path)
+        for (content_hash,) in self.index.execute("SELECT hash FROM blobs"):
+            self._known_hashes.add(content_hash)
+        segments = _segment_ids(self.storage_path)
+        self._segment_id = segments[-1] if segments else -1
+
+    def _roll_segment(self) -> BinaryIO:
+        self._close_segment()
+        self._segment_id += 1
+        path = _segment_path(self.storage_path, self._segment_id)
+        self._segment = path.open(mode="xb")
+        self._offset = 0
+        self.logger.debug("Started new pack segment %s", path)
+        return self._segment
+
+    def _close_segment(self) -> None:
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+    async def store_blob(
+        self, filename: str, blob: bytes, overwrite: bool = False
+    ) -> None:
+        if filename in self._known_hashes and not overwrite:
+            self.logger.debug("Blob %s is already stored. Not overwriting", filename)
+            return
+        compressed = self.codec.compress(blob)
+        segment = self._segment
+        if (
+            segment is None
+            or self._offset > 0
+            and self._offset + len(compressed) > self.max_segment_bytes
+        ):
+            await self.flush_cache()
+            segment = self._roll_segment()
+        segment.write(compressed)
+        self._pending.append(
+            (filename, self._segment_id, self._offset, len(compressed))
+        )
+        self._offset += len(compressed)
+        self._known_hashes.add(filename)
+
+        if len(self._pending) >= INDEX_BATCH_SIZE:
+            await self.flush_cache()
+
+    async def flush_cache(self) -> None:
+        """Flushes the current segment, then commits the pending index entries"""
+        if self._segment is not None:
+            self._segment.flush()
+            os.fsync(self._segment.fileno())
+        if self._pending:
+            with self.index:
+                self.index.executemany(
+                    "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?)", self._pending
+                )
+            self._pending.clear()
+
+    async def shutdown(self) -> None:
+        await self.flush_cache()
+        self._close_segment()
+        self.index.close()
+
+
+class PackReader:
+    """Reads blobs written by a LocalPackProvider
+
+    Segments are memory-mapped on first use, so random reads only touch
+    the pages of the requested blob.
+
+    .. code-block:: Python
+
+        with PackReader(storage_path) as reader:
+            content = reader[content_hash]
+    """
+
+    def __init__(self, storage_path: Path, codec: Optional[Codec] = None) -> None:
+        self.storage_path = storage_path
+        self.codec = codec or GzipCodec()
+        self.index = sqlite3.connect(
+            f"file:{storage_path / INDEX_NAME}?mode=ro", uri=True
+        )
+        self._maps: Dict[int, mmap.mmap] = {}
+
+    def _map(self, segment: int) -> mmap.mmap:
+        if segment not in self._maps:
+            with _segment_path(self.storage_path, segment).open(mode="rb") as f:
+                self._maps[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._maps[segment]
+
+    def read_compressed(self, content_hash: str) -> bytes:
+        """Returns the blob without decompressing it"""
+        row = self.index.execute(
+            "SELECT segment, offset, length FROM blobs WHERE hash = ?",
+            (content_hash,),
+        ).fetchone()
+        if row is None:
+            raise KeyError(content_hash)
+        segment, offset, length = row
+        return self._map(segment)[offset : offset + length]
+
+    def __getitem__(self, content_hash: str) -> bytes:
+        return self.codec.decompress(self.read_compressed(content_hash))
+
+    def __contains__(self, content_hash: object) -> bool:
+        row = self.index.execute(
+            "SELECT 1 FROM blobs WHERE hash = ?", (content_hash,)
+        ).fetchone()
+        return row is not None
+
+    def __iter__(self) -> Iterator[str]:
+        for (content_hash,) in self.index.execute("SELECT hash FROM blobs"):
+            yield content_hash
+
+    def __len__(self) -> int:
+        (count,) = self.index.execute("SELECT COUNT(*) FROM blobs").fetchone()
+        return int(count)
+
+    def close(self) -> None:
+        for segment_map in self._maps.values():
+            segment_map.close()
+        self._maps.clear()
+        self.index.close()
+
+    def __enter__(self) -> "PackReader":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+def repack(storage_path: Path, max_segment_bytes: int = MAX_SEGMENT_BYTES) -> None:
+    """Rewrites all blobs referenced by the index into new segments and
+    deletes the old ones, dropping overwritten blobs and any data a
+    crashed writer left behind.
+
+    Must not run while a LocalPackProvider is writing to storage_path.
+    The index is switched over in a single transaction, so an interrupted
+    repack leaves the old segments in use.
+    """
+    logger = logging.getLogger("openwpm")
+    old_segments = _segment_ids(storage_path)
+    next_segment = old_segments[-1] + 1 if old_segments else 0
+    index = _open_index(storage_path)
+    entries: List[IndexEntry] = []
+    out: Optional[BinaryIO] = None
+    offset = 0
+    with PackReader(storage_path) as reader:
+        rows = index.execute("SELECT hash FROM blobs ORDER BY segment, offset")
+        for (content_hash,) in rows.fetchall():
+            compressed = reader.read_compressed(content_hash)
+            if out is None or offset + len(compressed) > max_segment_bytes:
+                if out is not None:
+                    _sync_and_close(out)
+                    next_segment += 1
+                path = _segment_path(storage_path, next_segment)
+                out = path.open(mode="xb")
+                offset = 0
+            out.write(compressed)
+            entries.append((content_hash, next_segment, offset, len(compressed)))
+            offset += len(compressed)
+    if out is not None:
+        _sync_and_close(out)
+    with index:
+        index.execute("DELETE FROM blobs")
+        index.executemany("INSERT INTO blobs VALUES (?, ?, ?, ?)", entries)
+    index.execute("VACUUM")
+    index.close()
+    for segment in old_segments:
+        _segment_path(storage_path, segment).unlink()
+    logger.info(
+        "Repacked %d blobs from %d into %d segments",
+        len(entries),
+        len(old_segments),
+        len(_segment_ids(storage_path)),
+    )
+
+
+def main() -> None:
+    repack(Path(sys.argv[1]))
+
+
+if __name__ == "__main__":
+    main()
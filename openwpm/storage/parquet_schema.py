@@ -244,3 +244,15 @@ fields = [
     pa.field("instance_id", pa.uint32(), nullable=False),
 ]
 PQ_SCHEMAS["dns_responses"] = pa.schema(fields)
+
+# content_catalog
+fields = [
+    pa.field("content_hash", pa.string(), nullable=False),
+    pa.field("browser_id", pa.uint32()),
+    pa.field("visit_id", pa.int64()),
+    pa.field("size", pa.int64(), nullable=False),
+    pa.field("mime_type", pa.string()),
+    pa.field("compression_ratio", pa.float64()),
+    pa.field("instance_id", pa.uint32(), nullable=False),
+]
+PQ_SCHEMAS["content_catalog"] = pa.schema(fields)
@@ -0,0 +1,78 @@
+"""
+Record normalisation shared by the structured storage providers
+
+Records arrive as plain dicts from the StorageController. Before they can be
+stored, missing columns need to be filled in and values that the storage
+backends can't represent (bytes, dicts and callables) need to be coerced into
+strings. This module compiles a template per table once, so that both steps
+happen in a single pass over the record.
+"""
+import json
+from typing import Any, Dict, Mapping, Optional
+
+import pyarrow as pa
+
+from .storage_providers import TableName
+
+# Values of these types never need to be coerced
+_PASSTHROUGH_TYPES = frozenset([str, int, float, bool, type(None)])
+
+
+def coerce_value(value: Any) -> Any:
+    """Turns values the storage backends can't handle into strings"""
+    if isinstance(value, bytes):
+        return str(value, errors="ignore")
+    elif type(value) == dict:
+        return json.dumps(value)
+    elif callable(value):
+        return str(value)
+    return value
+
+
+class RecordNormalizer:
+    """Normalises records for a fixed set of table schemas
+
+    Parameters
+    ----------
+    schemas
+        If given, every record gets all columns of its table's schema,
+        with None for the columns that are missing from the record.
+        Records for tables without a schema are passed through as is.
+    overrides
+        Values that get set on every record, regardless of its content
+    coerce
+        Whether to coerce bytes, dicts and callables into strings
+
+    The record passed to `normalize` is never modified.
+    """
+
+    def __init__(
+        self,
+        schemas: Optional[Mapping[str, pa.Schema]] = None,
+        overrides: Optional[Dict[str, Any]] = None,
+        coerce: bool = True,
+    ) -> None:
+        self.overrides: Dict[str, Any] = dict(overrides or {})
+        self.coerce = coerce
+        self._templates: Dict[str, Dict[str, Any]] = {}
+        if schemas is not None:
+            for table, schema in schemas.items():
+                template: Dict[str, Any] = dict.fromkeys(schema.names)
+                template.update(self.overrides)
+                self._templates[table] = template
+
+    def normalize(self, table: TableName, record: Dict[str, Any]) -> Dict[str, Any]:
+        """Returns a normalised copy of `record`"""
+        template = self._templates.get(table)
+        if template is None:
+            normalized = dict(record)
+        else:
+            normalized = template.copy()
+            normalized.update(record)
+        if self.overrides:
+            normalized.update(self.overrides)
+        if self.coerce:
+            for key, value in normalized.items():
+                if type(value) not in _PASSTHROUGH_TYPES:
+                    normalized[key] = coerce_value(value)
+        return normalized
@@ -246,3 +246,15 @@ CREATE TABLE IF NOT EXISTS dns_responses (
   is_TRR INTEGER, 
   time_stamp DATETIME NOT NULL
  );
+
+/*
+# Content catalog
+ */
+CREATE TABLE IF NOT EXISTS content_catalog (
+  content_hash TEXT NOT NULL,
+  browser_id INTEGER,
+  visit_id INTEGER,
+  size INTEGER NOT NULL,
+  mime_type TEXT,
+  compression_ratio REAL
+);
@@ -0,0 +1,121 @@
+import logging
+from asyncio import Task
+from pathlib import Path
+from typing import Any, Dict, Literal, Optional
+
+from openwpm.types import VisitId
+
+from .shards import MAIN_SHARD, get_shard_path, get_shard_paths
+from .sql_provider import SQLiteStorageProvider
+from .storage_controller import INVALID_VISIT_ID
+from .storage_providers import StructuredStorageProvider, TableName
+
+__all__ = ["ShardedSQLiteProvider", "get_shard_paths"]
+
+VISITS_PER_SHARD = 10000
+
+ShardBy = Literal["browser", "visits"]
+
+
+class ShardedSQLiteProvider(StructuredStorageProvider):
+    """Writes every shard into its own SQLite database under
+    storage_path/crawl-data-<shard>.sqlite so that writes to different
+    shards don't contend for the same database lock.
+
+    shard_by="browser" creates one shard per browser_id, shard_by="visits"
+    starts a new shard every visits_per_shard visits and closes the
+    previous one once all of its visits are finalized.
+    All records of a visit end up in the shard picked for its first record,
+    which goes to the main shard if it doesn't carry a browser_id. Records
+    that don't belong to a visit (like the task and crawl tables) go to the
+    main shard as well.
+
+    Use openwpm.utilities.db_utils.query_db with storage_path to query all
+    shards at once. Keep in mind that the AUTOINCREMENT ids (e.g.
+    http_requests.id) are only unique within a shard.
+    """
+
+    def __init__(
+        self,
+        storage_path: Path,
+        shard_by: ShardBy = "browser",
+        visits_per_shard: int = VISITS_PER_SHARD,
+        **kwargs: Any,
+    ) -> None:
+        """kwargs get passed on to every SQLiteStorageProvider"""
+        super().__init__()
+        if shard_by not in ("browser", "visits"):
+            raise ValueError(f"Unsupported shard_by {shard_by}")
+        self.storage_path = storage_path
+        self.shard_by = shard_by
+        self.visits_per_shard = visits_per_shard
+        self.kwargs = kwargs
+        self.logger = logging.getLogger("openwpm")
+        self.shards: Dict[str, SQLiteStorageProvider] = {}
+        # The shard of every visit that hasn't been finalized yet
+        self._visit_shards: Dict[VisitId, str] = {}
+        self._visit_counter = 0
+
+    async def init(self) -> None:
+        self.storage_path.mkdir(parents=True, exist_ok=True)
+
+    def _shard_name(self, visit_id: VisitId, record: Dict[str, Any]) -> str:
+        if visit_id == INVALID_VISIT_ID:
+            return MAIN_SHARD
+        if visit_id in self._visit_shards:
+            return self._visit_shards[visit_id]
+        if self.shard_by == "browser":
+            if "browser_id" in record:
+                shard = "browser-%d" % record["browser_id"]
+            else:
+                shard = MAIN_SHARD
+        else:
+            shard = "%05d" % (self._visit_counter // self.visits_per_shard)
+            self._visit_counter += 1
+        self._visit_shards[visit_id] = shard
+        return shard
+
+    async def _get_shard(self, name: str) -> SQLiteStorageProvider:
+        if name not in self.shards:
+            shard = SQLiteStorageProvider(
+                get_shard_path(self.storage_path, name),
+                **self.kwargs,
+            )
+            await shard.init()
+            self.shards[name] = shard
+            self.logger.info("Opened new SQLite shard %s", name)
+        return self.shards[name]
+
+    async def store_record(
+        self, table: TableName, visit_id: VisitId, record: Dict[str, Any]
+    ) -> None:
+        shard = await self._get_shard(self._shard_name(visit_id, record))
+        await shard.store_record(table, visit_id, record)
+
+    async def finalize_visit_id(
+        self, visit_id: VisitId, interrupted: bool = False
+    ) -> Optional[Task[None]]:
+        name = self._visit_shards.pop(visit_id, MAIN_SHARD)
+        shard = await self._get_shard(name)
+        token = await shard.finalize_visit_id(visit_id, interrupted)
+        if self._is_retired(name):
+            # Committing on shutdown also resolves the token
+            del self.shards[name]
+            await shard.shutdown()
+            self.logger.info("Closed SQLite shard %s", name)
+        return token
+
+    def _is_retired(self, name: str) -> bool:
+        """Whether a shard won't receive any more records"""
+        if self.shard_by != "visits" or name == MAIN_SHARD:
+            return False
+        current = "%05d" % (self._visit_counter // self.visits_per_shard)
+        return name != current and name not in self._visit_shards.values()
+
+    async def flush_cache(self) -> None:
+        for shard in self.shards.values():
+            await shard.flush_cache()
+
+    async def shutdown(self) -> None:
+        for shard in self.shards.values():
+            await shard.shutdown()
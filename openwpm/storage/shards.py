@@ -0,0 +1,22 @@
+"""File naming of the shards written by the ShardedSQLiteProvider
+
+Kept free of any other OpenWPM imports, so that readers of a crawl like
+openwpm.utilities.db_utils can find the shards without loading the storage
+providers.
+"""
+from pathlib import Path
+from typing import List, Union
+
+SHARD_PREFIX = "crawl-data-"
+SHARD_SUFFIX = ".sqlite"
+MAIN_SHARD = "main"
+
+
+def get_shard_path(storage_path: Union[str, Path], name: str) -> Path:
+    """Returns the database of the shard called name"""
+    return Path(storage_path) / f"{SHARD_PREFIX}{name}{SHARD_SUFFIX}"
+
+
+def get_shard_paths(storage_path: Union[str, Path]) -> List[Path]:
+    """Returns the databases written by a ShardedSQLiteProvider"""
+    return sorted(Path(storage_path).glob(f"{SHARD_PREFIX}*{SHARD_SUFFIX}"))
@@ -1,7 +1,14 @@
-import json
+import asyncio
 import logging
 import os
+import queue
 import sqlite3
+import threading
+import time
+from asyncio import Task
+from collections import defaultdict
+from concurrent.futures import Future
+from functools import partial
 from pathlib import Path
 from sqlite3 import (
     Connection,
@@ -11,30 +18,192 @@ from sqlite3 import (
     OperationalError,
     ProgrammingError,
 )
-from typing import Any, Dict, List, Tuple
+from typing import (
+    Any,
+    Callable,
+    DefaultDict,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 from openwpm.types import VisitId
 
+from .record_normalizer import RecordNormalizer
 from .storage_providers import StructuredStorageProvider, TableName
 
 SCHEMA_FILE = os.path.join(os.path.dirname(__file__), "schema.sql")
+SQL_BATCH_SIZE = 1000  # rows
+SQL_BATCH_TIMEOUT = 5  # seconds a row may stay buffered
+SQL_COMMIT_INTERVAL = 1  # seconds between commits while the writer is busy
+SQL_QUEUE_SIZE = 100  # queued operations before handing off more waits
+SQL_ERRORS = (OperationalError, ProgrammingError, IntegrityError, InterfaceError)
+
+PRAGMA_PROFILE_DEFAULT: Dict[str, Union[str, int]] = {
+    # WAL lets readers query the database while the crawl is writing to it
+    "journal_mode": "WAL",
+    # Safe against application crashes in WAL mode, only power loss
+    # can roll back the most recent transactions
+    "synchronous": "NORMAL",
+    "cache_size": -64 * 1024,  # KiB
+    "mmap_size": 256 * 1024**2,
+    "temp_store": "MEMORY",
+}
+"""Used by SQLiteStorageProvider unless told otherwise"""
+
+PRAGMA_PROFILE_BULK_LOAD: Dict[str, Union[str, int]] = {
+    # page_size only takes effect on a new database
+    "page_size": 16384,
+    "journal_mode": "MEMORY",
+    "synchronous": "OFF",
+    "locking_mode": "EXCLUSIVE",
+    "cache_size": -512 * 1024,  # KiB
+    "mmap_size": 1024**3,
+    "temp_store": "MEMORY",
+}
+"""Maximum write throughput, e.g. for importing existing data.
+The database can get corrupted if the process crashes and
+no other connection can read it while it is open.
+"""
+
+T = TypeVar("T")
 
 
 class SQLiteStorageProvider(StructuredStorageProvider):
+    """Stores all records in a SQLite database
+
+    All sqlite3 calls happen on a dedicated writer thread, so that slow
+    inserts and commits don't block the event loop of the StorageController.
+    The thread works through a queue of operations and commits whenever the
+    queue runs empty or SQL_COMMIT_INTERVAL seconds have passed since the
+    last commit. The tokens returned by finalize_visit_id resolve once the
+    records of the visit have been committed, or raise if the commit failed.
+    Once SQL_QUEUE_SIZE operations are queued, store_record,
+    finalize_visit_id and flush_cache wait for the writer to catch up
+    without blocking the event loop.
+    """
+
     db: Connection
     cur: Cursor
+    _loop: asyncio.AbstractEventLoop
+    _writer: threading.Thread
+    _writer_caught_up: asyncio.Event
 
-    def __init__(self, db_path: Path) -> None:
+    def __init__(
+        self,
+        db_path: Path,
+        batch_size: int = SQL_BATCH_SIZE,
+        pragmas: Optional[Dict[str, Union[str, int]]] = None,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        pragmas
+            The PRAGMA statements to run when opening the database, in order.
+            Defaults to PRAGMA_PROFILE_DEFAULT, pass an empty dict to keep
+            the SQLite defaults.
+        """
         super().__init__()
         self.db_path = db_path
+        self.batch_size = batch_size
+        self.pragmas = dict(PRAGMA_PROFILE_DEFAULT if pragmas is None else pragmas)
+        for name, value in self.pragmas.items():
+            if not name.isidentifier() or not (
+                isinstance(value, int) or value.isidentifier()
+            ):
+                raise ValueError(f"Invalid pragma {name} = {value}")
         self._sql_counter = 0
-        self._sql_commit_time = 0
+        self._sql_commit_time = 0.0
         self.logger = logging.getLogger("openwpm")
+        # Only coerces values, as missing columns should get the SQL defaults
+        self._normalizer = RecordNormalizer()
+        # Rows waiting to be handed to the writer by table and column names
+        self._insert_buffers: DefaultDict[
+            Tuple[TableName, Tuple[str, ...]], List[Tuple[Any, ...]]
+        ] = defaultdict(list)
+        self._buffered_rows = 0
+        self._oldest_buffered_time: Optional[float] = None
+        # Hands off the buffers once the oldest row reaches SQL_BATCH_TIMEOUT
+        self._batch_timer: Optional[asyncio.TimerHandle] = None
+
+        # Unbounded, so that the batch timer can always hand off the buffers
+        self._queue: "queue.Queue[Optional[Callable[[], None]]]" = queue.Queue()
+
+        # Everything below is only accessed from the writer thread
+        self._statement_cache: Dict[Tuple[TableName, Tuple[str, ...]], str] = {}
+        self._commit_waiters: List["asyncio.Future[None]"] = []
 
     async def init(self) -> None:
-        self.db = sqlite3.connect(str(self.db_path))
-        self.cur = self.db.cursor()
-        self._create_tables()
+        self._loop = asyncio.get_running_loop()
+        self._writer_caught_up = asyncio.Event()
+        ready: "Future[None]" = Future()
+        self._writer = threading.Thread(
+            target=self._run_writer, args=(ready,), name="SQLiteWriter", daemon=True
+        )
+        self._writer.start()
+        await asyncio.wrap_future(ready)
+
+    def _run_writer(self, ready: "Future[None]") -> None:
+        try:
+            self.db = sqlite3.connect(str(self.db_path))
+            self.cur = self.db.cursor()
+            self._apply_pragmas()
+            self._create_tables()
+        except BaseException as e:
+            ready.set_exception(e)
+            return
+        ready.set_result(None)
+
+        self._sql_commit_time = time.time()
+        while True:
+            operation = self._queue.get()
+            if operation is None:
+                break
+            try:
+                operation()
+            except Exception as e:
+                self.logger.error("SQLite writer operation failed", exc_info=e)
+            if (
+                not self._writer_caught_up.is_set()
+                and self._queue.qsize() < SQL_QUEUE_SIZE
+            ):
+                self._loop.call_soon_threadsafe(self._writer_caught_up.set)
+            if (
+                self._queue.empty()
+                or time.time() - self._sql_commit_time >= SQL_COMMIT_INTERVAL
+            ):
+                self._commit()
+        self._commit()
+        self.db.close()
+
+    def _run_in_writer(self, fn: Callable[[], T]) -> "Future[T]":
+        """Schedules `fn` on the writer thread"""
+        future: "Future[T]" = Future()
+
+        def operation() -> None:
+            try:
+                future.set_result(fn())
+            except BaseException as e:
+                future.set_exception(e)
+
+        self._queue.put(operation)
+        return future
+
+    async def _wait_for_writer(self) -> None:
+        """Waits while SQL_QUEUE_SIZE or more operations are queued"""
+        while self._queue.qsize() >= SQL_QUEUE_SIZE:
+            self._writer_caught_up.clear()
+            # The writer might have caught up before the event got cleared
+            if self._queue.qsize() < SQL_QUEUE_SIZE:
+                break
+            await self._writer_caught_up.wait()
+
+    def _apply_pragmas(self) -> None:
+        for name, value in self.pragmas.items():
+            self.db.execute(f"PRAGMA {name} = {value}")
 
     def _create_tables(self) -> None:
         """Create tables (if this is a new database)"""
@@ -42,68 +211,156 @@ class SQLiteStorageProvider(StructuredStorageProvider):
             self.db.executescript(f.read())
         self.db.commit()
 
+    def _commit(self) -> None:
+        """Commits and resolves the tokens of all visits written so far"""
+        error: Optional[Exception] = None
+        if self.db.in_transaction:
+            try:
+                self.db.commit()
+            except SQL_ERRORS as e:
+                self.logger.error("Failed to commit to %s", self.db_path, exc_info=e)
+                error = e
+                # Otherwise the next commits would fail as well
+                self.db.rollback()
+        self._sql_commit_time = time.time()
+        waiters, self._commit_waiters = self._commit_waiters, []
+        for waiter in waiters:
+            self._loop.call_soon_threadsafe(_resolve, waiter, error)
+
     async def flush_cache(self) -> None:
-        self.db.commit()
+        await self._wait_for_writer()
+        self._hand_off_buffers()
+        await asyncio.wrap_future(self._run_in_writer(self._commit))
 
     async def store_record(
         self, table: TableName, visit_id: VisitId, record: Dict[str, Any]
     ) -> None:
         """Submit a record to be stored
         The storing might not happen immediately
+
+        Records are buffered per table and set of columns and handed to the
+        writer thread once the buffer is full or SQL_BATCH_TIMEOUT seconds
+        after the oldest record got buffered, and whenever the cache gets
+        flushed or a visit gets finalized.
         """
-        assert self.cur is not None
-        statement, args = self._generate_insert(table=table, data=record)
-        for i in range(len(args)):
-            if isinstance(args[i], bytes):
-                args[i] = str(args[i], errors="ignore")
-            elif callable(args[i]):
-                args[i] = str(args[i])
-            elif type(args[i]) == dict:
-                args[i] = json.dumps(args[i])
+        normalized = self._normalizer.normalize(table, record)
+        key = (table, tuple(normalized.keys()))
+        self._insert_buffers[key].append(tuple(normalized.values()))
+        self._buffered_rows += 1
+        if self._oldest_buffered_time is None:
+            self._oldest_buffered_time = time.time()
+            self._batch_timer = self._loop.call_later(
+                SQL_BATCH_TIMEOUT, self._hand_off_buffers
+            )
+        if (
+            self._buffered_rows >= self.batch_size
+            or time.time() - self._oldest_buffered_time >= SQL_BATCH_TIMEOUT
+        ):
+            await self._wait_for_writer()
+            self._hand_off_buffers()
+
+    def _hand_off_buffers(self) -> None:
+        """Queue all buffered rows to be written by the writer thread"""
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        if not self._insert_buffers:
+            return
+        buffers = self._insert_buffers
+        self._insert_buffers = defaultdict(list)
+        self._buffered_rows = 0
+        self._oldest_buffered_time = None
+        self._queue.put(partial(self._write_buffers, buffers))
+
+    def _write_buffers(
+        self,
+        buffers: Dict[Tuple[TableName, Tuple[str, ...]], List[Tuple[Any, ...]]],
+    ) -> None:
+        """Insert the given rows into the database without committing"""
+        if not self.db.in_transaction:
+            # Otherwise releasing the savepoint would commit
+            self.cur.execute("BEGIN")
+        for (table, columns), rows in buffers.items():
+            statement = self._get_insert_statement(table, columns)
+            self.cur.execute("SAVEPOINT insert_batch")
+            try:
+                self.cur.executemany(statement, rows)
+                self._sql_counter += len(rows)
+            except SQL_ERRORS:
+                # Insert the rows one by one to only drop the broken ones
+                self.cur.execute("ROLLBACK TO insert_batch")
+                for row in rows:
+                    self._insert_row(statement, row)
+            self.cur.execute("RELEASE insert_batch")
+
+    def _insert_row(self, statement: str, args: Tuple[Any, ...]) -> None:
         try:
             self.cur.execute(statement, args)
             self._sql_counter += 1
-        except (
-            OperationalError,
-            ProgrammingError,
-            IntegrityError,
-            InterfaceError,
-        ) as e:
+        except SQL_ERRORS as e:
             self.logger.error(
                 "Unsupported record:\n%s\n%s\n%s\n%s\n"
                 % (type(e), e, statement, repr(args))
             )
 
+    def _get_insert_statement(self, table: TableName, columns: Tuple[str, ...]) -> str:
+        key = (table, columns)
+        statement = self._statement_cache.get(key)
+        if statement is None:
+            statement = self._generate_insert(table, columns)
+            self._statement_cache[key] = statement
+        return statement
+
     @staticmethod
-    def _generate_insert(
-        table: TableName, data: Dict[str, Any]
-    ) -> Tuple[str, List[Any]]:
-        """Generate a SQL query from `record`"""
-        statement = "INSERT INTO %s (" % table
-        value_str = "VALUES ("
-        values = list()
-        first = True
-        for field, value in data.items():
-            statement += "" if first else ", "
-            statement += field
-            value_str += "?" if first else ",?"
-            values.append(value)
-            first = False
-        statement = statement + ") " + value_str + ")"
-        return statement, values
-
-    def execute_statement(self, statement: str) -> None:
-        self.cur.execute(statement)
-        self.db.commit()
+    def _generate_insert(table: TableName, columns: Tuple[str, ...]) -> str:
+        """Generate a parameterized INSERT statement for `columns`"""
+        return "INSERT INTO %s (%s) VALUES (%s)" % (
+            table,
+            ", ".join(columns),
+            ",".join("?" * len(columns)),
+        )
+
+    async def execute_statement(self, statement: str) -> None:
+        """Executes and commits `statement`"""
+        await self._wait_for_writer()
+        self._hand_off_buffers()
+
+        def execute() -> None:
+            self.cur.execute(statement)
+            self._commit()
+
+        await asyncio.wrap_future(self._run_in_writer(execute))
 
     async def finalize_visit_id(
         self, visit_id: VisitId, interrupted: bool = False
-    ) -> None:
+    ) -> Task[None]:
+        await self._wait_for_writer()
+        self._hand_off_buffers()
         if interrupted:
             self.logger.warning("Visit with visit_id %d got interrupted", visit_id)
-            self.cur.execute("INSERT INTO incomplete_visits VALUES (?)", (visit_id,))
-        self.db.commit()
+            self._queue.put(partial(self._insert_incomplete_visit, visit_id))
+
+        committed: "asyncio.Future[None]" = self._loop.create_future()
+        self._queue.put(partial(self._commit_waiters.append, committed))
+
+        async def wait_on_commit(f: "asyncio.Future[None]") -> None:
+            await f
+
+        return asyncio.create_task(wait_on_commit(committed))
+
+    def _insert_incomplete_visit(self, visit_id: VisitId) -> None:
+        self._insert_row("INSERT INTO incomplete_visits VALUES (?)", (visit_id,))
 
     async def shutdown(self) -> None:
-        self.db.commit()
-        self.db.close()
+        self._hand_off_buffers()
+        self._queue.put(None)
+        await self._loop.run_in_executor(None, self._writer.join)
+
+
+def _resolve(future: "asyncio.Future[None]", error: Optional[Exception]) -> None:
+    if future.done():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
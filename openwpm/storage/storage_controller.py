@@ -5,10 +5,11 @@ import queue
 import random
 import socket
 import time
+import zlib
 from asyncio import IncompleteReadError, Task
 from asyncio.base_events import Server
 from collections import defaultdict
-from typing import Any, DefaultDict, Dict, List, NoReturn, Optional, Tuple
+from typing import Any, DefaultDict, Dict, List, NoReturn, Optional, Set, Tuple
 
 from multiprocess import Queue
 
@@ -29,6 +30,8 @@ ACTION_TYPE_FINALIZE = "Finalize"
 ACTION_TYPE_INITIALIZE = "Initialize"
 
 RECORD_TYPE_CREATE = "create_table"
+CONTENT_CATALOG_TABLE = TableName("content_catalog")
+CATALOG_BATCH_SIZE = 1000  # content_catalog rows written out together
 STATUS_TIMEOUT = 120  # seconds
 SHUTDOWN_SIGNAL = "SHUTDOWN"
 BATCH_COMMIT_TIMEOUT = 30  # commit a batch if no new records for N seconds
@@ -82,6 +85,10 @@ class StorageController:
         """
         self.structured_storage = structured_storage
         self.unstructured_storage = unstructured_storage
+        self.cataloged_hashes: Set[str] = set()
+        """Contains the content hashes that already have a row in the content_catalog"""
+        self._catalog_rows = 0
+        self._catalog_tokens: Set[Task[None]] = set()
         self._last_record_received: Optional[float] = None
 
     async def _handler(
@@ -130,18 +137,26 @@ class StorageController:
                 )
 
             if record_type == RECORD_TYPE_CONTENT:
-                assert len(data) == 2
+                # Older extensions only send the content and its hash
+                assert len(data) in (2, 5)
                 if self.unstructured_storage is None:
                     self.logger.error(
                         """Tried to save content while not having
                         provided any unstructured storage provider."""
                     )
                     continue
-                content, content_hash = data
+                content, content_hash = data[:2]
                 content = base64.b64decode(content)
                 await self.unstructured_storage.store_blob(
                     filename=content_hash, blob=content
                 )
+                if len(data) == 5:
+                    visit_id, browser_id, mime_type = data[2:]
+                else:
+                    visit_id, browser_id, mime_type = INVALID_VISIT_ID, None, None
+                await self._catalog_content(
+                    content, content_hash, VisitId(visit_id), browser_id, mime_type
+                )
                 continue
 
             if "visit_id" not in data:
@@ -174,6 +189,64 @@ class StorageController:
             )
         )
 
+    async def _catalog_content(
+        self,
+        content: bytes,
+        content_hash: str,
+        visit_id: VisitId,
+        browser_id: Optional[int],
+        mime_type: Optional[str],
+    ) -> None:
+        """Adds a row to the content_catalog the first time a content hash is seen
+
+        The compression ratio is estimated with zlib at level 1 and doesn't
+        depend on how the unstructured storage provider compresses the content.
+        Response bodies often arrive after their visit has been finalized, so
+        the rows are collected under INVALID_VISIT_ID instead and written out
+        every CATALOG_BATCH_SIZE rows and whenever the storage gets flushed.
+        """
+        if content_hash in self.cataloged_hashes:
+            return
+        self.cataloged_hashes.add(content_hash)
+        if mime_type:
+            # Drop parameters like the charset
+            mime_type = mime_type.split(";", 1)[0].strip().lower()
+        record = {
+            "content_hash": content_hash,
+            "browser_id": browser_id,
+            "visit_id": None if visit_id == INVALID_VISIT_ID else visit_id,
+            "size": len(content),
+            "mime_type": mime_type or None,
+            "compression_ratio": len(content) / len(zlib.compress(content, 1)),
+        }
+        # Not using store_record, as that drops the visit_id of these records
+        self.store_record_tasks[INVALID_VISIT_ID].append(
+            asyncio.create_task(
+                self.structured_storage.store_record(
+                    table=CONTENT_CATALOG_TABLE,
+                    visit_id=INVALID_VISIT_ID,
+                    record=record,
+                )
+            )
+        )
+        self._catalog_rows += 1
+        if self._catalog_rows >= CATALOG_BATCH_SIZE:
+            await self._finalize_catalog()
+
+    async def _finalize_catalog(self) -> None:
+        """Hands the collected content_catalog rows to the structured storage"""
+        if not self._catalog_rows:
+            return
+        self._catalog_rows = 0
+        token = await self.finalize_visit_id(INVALID_VISIT_ID, success=True)
+        if token is not None:
+            self._catalog_tokens.add(token)
+            token.add_done_callback(self._catalog_saved)
+
+    def _catalog_saved(self, token: Task[None]) -> None:
+        self._catalog_tokens.discard(token)
+        _token_saved(token, INVALID_VISIT_ID, self.logger)
+
     async def _handle_meta(self, visit_id: VisitId, data: Dict[str, Any]) -> None:
         """
         Messages for the table RECORD_TYPE_SPECIAL are meta information
@@ -252,6 +325,7 @@ class StorageController:
 
     async def shutdown(self, completion_queue_task: Task[None]) -> None:
         self.logger.info("Entering self.shutdown")
+        await self._finalize_catalog()
         completion_tokens = {}
         visit_ids = list(self.store_record_tasks.keys())
         for visit_id in visit_ids:
@@ -260,16 +334,22 @@ class StorageController:
                 completion_tokens[visit_id] = t
         await self.structured_storage.flush_cache()
         await completion_queue_task
+        if self._catalog_tokens:
+            await asyncio.wait(self._catalog_tokens)
         for visit_id, token in completion_tokens.items():
-            await token
+            await asyncio.wait([token])
+            _token_saved(token, visit_id, self.logger)
             self.completion_queue.put((visit_id, False))
 
-        await self.structured_storage.shutdown()
-        self.logger.info("structured_storage is shut down")
-
-        if self.unstructured_storage is not None:
-            await self.unstructured_storage.flush_cache()
-            await self.unstructured_storage.shutdown()
+        try:
+            await self.structured_storage.shutdown()
+            self.logger.info("structured_storage is shut down")
+        finally:
+            if self.unstructured_storage is not None:
+                try:
+                    await self.unstructured_storage.flush_cache()
+                finally:
+                    await self.unstructured_storage.shutdown()
 
     async def should_shutdown(self) -> None:
         """Returns when we should shut down"""
@@ -305,9 +385,15 @@ class StorageController:
                 "Saving current records since no new data has "
                 "been written for %d seconds." % diff
             )
+            await self._finalize_catalog()
             await self.structured_storage.flush_cache()
             if self.unstructured_storage:
-                await self.unstructured_storage.flush_cache()
+                try:
+                    await self.unstructured_storage.flush_cache()
+                except Exception:
+                    self.logger.error(
+                        "Failed to flush the unstructured storage", exc_info=True
+                    )
             self._last_record_received = None
 
     async def update_completion_queue(self) -> None:
@@ -317,10 +403,11 @@ class StorageController:
             # is forbidden
             new_finalize_tasks: List[Tuple[VisitId, Optional[Task[None]], bool]] = []
             for visit_id, token, success in self.finalize_tasks:
-                if (
-                    not token or token.done()
-                ):  # Either way all data for the visit_id was saved out
+                if not token:
                     self.completion_queue.put((visit_id, success))
+                elif token.done():
+                    saved = _token_saved(token, visit_id, self.logger)
+                    self.completion_queue.put((visit_id, success and saved))
                 else:
                     new_finalize_tasks.append((visit_id, token, success))
             self.finalize_tasks = new_finalize_tasks
@@ -369,6 +456,18 @@ class StorageController:
         asyncio.run(self._run(), debug=True)
 
 
+def _token_saved(token: Task[None], visit_id: VisitId, logger: logging.Logger) -> bool:
+    """Whether the completion token of a finished visit reports it as saved"""
+    if token.cancelled():
+        logger.error("Saving visit_id %d got cancelled", visit_id)
+        return False
+    error = token.exception()
+    if error is not None:
+        logger.error("Failed to save visit_id %d", visit_id, exc_info=error)
+        return False
+    return True
+
+
 class DataSocket:
     """Wrapper around ClientSocket to make sending records to the StorageController more convenient"""
 
@@ -389,6 +488,27 @@ class DataSocket:
             )
         )
 
+    def store_content(
+        self,
+        content: bytes,
+        content_hash: str,
+        visit_id: VisitId,
+        browser_id: int,
+        mime_type: Optional[str] = None,
+    ) -> None:
+        self.socket.send(
+            (
+                RECORD_TYPE_CONTENT,
+                (
+                    base64.b64encode(content).decode("ascii"),
+                    content_hash,
+                    visit_id,
+                    browser_id,
+                    mime_type,
+                ),
+            )
+        )
+
     def finalize_visit_id(self, visit_id: VisitId, success: bool) -> None:
         self.socket.send(
             (
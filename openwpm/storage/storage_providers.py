@@ -112,3 +112,20 @@ class UnstructuredStorageProvider(StorageProvider):
             writer.write(blob)
         out_f.seek(0)
         return out_f
+
+
+class ReadableUnstructuredStorageProvider(UnstructuredStorageProvider):
+    """An UnstructuredStorageProvider that can also read and delete blobs
+
+    Required for the local tier of a TieredUnstructuredProvider
+    """
+
+    @abstractmethod
+    async def read_blob(self, filename: str) -> Optional[bytes]:
+        """Returns the bytes stored under filename or None if there are none"""
+        pass
+
+    @abstractmethod
+    async def delete_blob(self, filename: str) -> None:
+        """Removes the blob stored under filename, if there is one"""
+        pass
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import sqlite3
+from collections import deque
+from pathlib import Path
+from typing import Deque, List, Optional, Set, Tuple
+
+from .cloud_storage.uploader import UploadError
+from .storage_providers import (
+    ReadableUnstructuredStorageProvider,
+    UnstructuredStorageProvider,
+)
+
+MIGRATION_BATCH_SIZE = 100
+MAX_LOCAL_BYTES = 10 * 1024**3
+
+
+class TieredUnstructuredProvider(UnstructuredStorageProvider):
+    """Stores blobs in a fast local provider and moves them to a remote one
+    in the background
+
+    store_blob only waits for the local tier, e.g. a LevelDbProvider or a
+    LocalGzipProvider. Every migration_batch_size blobs a background task
+    reads the blobs back from the local tier and stores them in the remote
+    tier, e.g. an S3UnstructuredProvider. A blob only counts as migrated
+    once the remote tier's flush_cache returned without reporting it as
+    failed (see UploadError). Once the blobs stored locally add up to more
+    than max_local_bytes, the oldest migrated ones get deleted from the
+    local tier. Sizes are counted before compression.
+
+    flush_cache only flushes the local tier and starts the migration of all
+    pending blobs, shutdown waits until all of them have been migrated.
+    Blobs that the remote tier failed to store stay in the local tier and
+    are retried with the next migration. Pass journal_path to keep track
+    of the pending and migrated blobs in an SQLite database, so that the
+    blobs left over when the crawl got killed get migrated on the next init.
+    """
+
+    journal: sqlite3.Connection
+
+    def __init__(
+        self,
+        local: ReadableUnstructuredStorageProvider,
+        remote: UnstructuredStorageProvider,
+        migration_batch_size: int = MIGRATION_BATCH_SIZE,
+        max_local_bytes: int = MAX_LOCAL_BYTES,
+        journal_path: Optional[Path] = None,
+    ) -> None:
+        super().__init__()
+        if not isinstance(local, ReadableUnstructuredStorageProvider):
+            raise TypeError(f"{type(local).__name__} can't be used as the local tier")
+        self.local = local
+        self.remote = remote
+        self.migration_batch_size = migration_batch_size
+        self.max_local_bytes = max_local_bytes
+        self.journal_path = journal_path
+        self.logger = logging.getLogger("openwpm")
+        self.file_name_cache: Set[str] = set()
+        """The set of all filenames ever stored, checked before storing"""
+        self.local_bytes = 0
+        # Blobs waiting for the migration as (filename, size, overwrite)
+        self._pending: List[Tuple[str, int, bool]] = []
+        # Migrated blobs that are still stored locally, oldest first
+        self._migrated: Deque[Tuple[str, int]] = deque()
+        self._migrations: Set["asyncio.Task[None]"] = set()
+        self._migration_lock: Optional[asyncio.Lock] = None
+
+    async def init(self) -> None:
+        await self.local.init()
+        await self.remote.init()
+        self._migration_lock = asyncio.Lock()
+        self.journal = sqlite3.connect(
+            ":memory:" if self.journal_path is None else self.journal_path
+        )
+        self.journal.execute("PRAGMA journal_mode = WAL")
+        self.journal.execute(
+            "CREATE TABLE IF NOT EXISTS blobs (name TEXT PRIMARY KEY, "
+            "size INTEGER NOT NULL, overwrite INTEGER NOT NULL, "
+            "migrated INTEGER NOT NULL)"
+        )
+        rows = self.journal.execute(
+            "SELECT name, size, overwrite, migrated FROM blobs ORDER BY rowid"
+        )
+        for filename, size, overwrite, migrated in rows:
+            self.file_name_cache.add(filename)
+            self.local_bytes += size
+            if migrated:
+                self._migrated.append((filename, size))
+            else:
+                self._pending.append((filename, size, bool(overwrite)))
+        if self._pending:
+            self.logger.info(
+                "Resuming the migration of %d blobs left over by a previous run",
+                len(self._pending),
+            )
+            self._start_migration()
+
+    async def store_blob(
+        self, filename: str, blob: bytes, overwrite: bool = False
+    ) -> None:
+        if not overwrite and filename in self.file_name_cache:
+            return
+        await self._store(self.local, filename, blob, overwrite)
+        self.file_name_cache.add(filename)
+        self.local_bytes += len(blob)
+        self._pending.append((filename, len(blob), overwrite))
+        self.journal.execute(
+            "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, 0)",
+            (filename, len(blob), overwrite),
+        )
+        if len(self._pending) >= self.migration_batch_size:
+            self._start_migration()
+
+    @staticmethod
+    async def _store(
+        provider: UnstructuredStorageProvider,
+        filename: str,
+        blob: bytes,
+        overwrite: bool,
+    ) -> None:
+        # Not every provider supports overwrite, e.g. MemoryUnstructuredProvider
+        if overwrite:
+            await provider.store_blob(filename, blob, overwrite=True)
+        else:
+            await provider.store_blob(filename=filename, blob=blob)
+
+    def _start_migration(self) -> None:
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.create_task(self._migrate(batch))
+        self._migrations.add(task)
+        task.add_done_callback(self._migrations.discard)
+
+    async def _migrate(self, batch: List[Tuple[str, int, bool]]) -> None:
+        assert self._migration_lock is not None
+        # One batch at a time, so blobs get evicted in the order they came in
+        async with self._migration_lock:
+            await self.local.flush_cache()
+            # The pending blobs are now stored locally
+            self.journal.commit()
+            stored = []
+            failed: Set[str] = set()
+            for filename, size, overwrite in batch:
+                blob = await self.local.read_blob(filename)
+                if blob is None:
+                    self.logger.error("Blob %s is missing in the local tier", filename)
+                    self.journal.execute(
+                        "DELETE FROM blobs WHERE name = ?", (filename,)
+                    )
+                    self.local_bytes -= size
+                    continue
+                try:
+                    await self._store(self.remote, filename, blob, overwrite)
+                except Exception:
+                    self.logger.error(
+                        "Failed to migrate blob %s", filename, exc_info=True
+                    )
+                    failed.add(filename)
+                stored.append((filename, size, overwrite))
+            try:
+                await self.remote.flush_cache()
+            except UploadError as e:
+                self.logger.error("Failed to migrate %d blobs", len(e.failed))
+                failed.update(e.failed)
+            except Exception:
+                self.logger.error("Failed to flush the remote tier", exc_info=True)
+                failed.update(filename for filename, _, _ in stored)
+            migrated = []
+            for filename, size, overwrite in stored:
+                if filename in failed:
+                    # Stays in the local tier until the next migration
+                    self._pending.append((filename, size, overwrite))
+                else:
+                    migrated.append((filename, size))
+            self.journal.executemany(
+                "UPDATE blobs SET migrated = 1 WHERE name = ?",
+                ((filename,) for filename, _ in migrated),
+            )
+            self._migrated.extend(migrated)
+            await self._evict()
+            self.journal.commit()
+
+    async def _evict(self) -> None:
+        while self.local_bytes > self.max_local_bytes and self._migrated:
+            filename, size = self._migrated.popleft()
+            await self.local.delete_blob(filename)
+            self.journal.execute("DELETE FROM blobs WHERE name = ?", (filename,))
+            self.local_bytes -= size
+
+    async def flush_cache(self) -> None:
+        await self.local.flush_cache()
+        self.journal.commit()
+        self._start_migration()
+
+    async def shutdown(self) -> None:
+        self._start_migration()
+        while self._migrations:
+            await asyncio.gather(*self._migrations)
+        if self._pending:
+            self.logger.warning(
+                "%d blobs couldn't be migrated and stay in the local tier",
+                len(self._pending),
+            )
+        self.journal.close()
+        await self.local.shutdown()
+        await self.remote.shutdown()
@@ -1,11 +1,23 @@
 import logging
 import os
 import pickle
+import queue
 import threading
 import time
-from functools import reduce
+from functools import partial, reduce
 from types import TracebackType
-from typing import Any, Dict, List, Optional, Set, Type
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+)
 
 import psutil
 import tblib
@@ -34,10 +46,11 @@ from .utilities.storage_watchdog import StorageLogger
 
 tblib.pickling_support.install()
 
-SLEEP_CONS = 0.1  # command sleep constant (in seconds)
 BROWSER_MEMORY_LIMIT = 1500  # in MB
 
 STORAGE_CONTROLLER_JOB_LIMIT = 10000  # number of records in the queue
+MAX_IN_FLIGHT = 1000  # command sequences that haven't been saved yet
+FAILURE_CHECK_INTERVAL = 1  # seconds
 
 
 class TaskManager:
@@ -104,6 +117,11 @@ class TaskManager:
         self.failure_status: Optional[Dict[str, Any]] = None
         self.threadlock = threading.Lock()
         self.failure_count = 0
+        # Command threads signal this when their browser becomes idle
+        self.browser_idle = threading.Condition()
+        self.idle_browsers: Set[int] = set()
+        self.idle_listeners: List[Callable[[], None]] = []
+        """Called from the command threads whenever a browser becomes idle"""
 
         self.failure_limit = manager_params.failure_limit
         # Start logging server thread
@@ -122,6 +140,7 @@ class TaskManager:
 
         # Sets up the BrowserManager(s) + associated queues
         self.browsers = self._initialize_browsers(browser_params)
+        self.idle_browsers.update(range(len(self.browsers)))
         self._launch_browsers()
 
         # Start the manager watchdog
@@ -314,6 +333,8 @@ class TaskManager:
         if self.closing:
             return
         self.closing = True
+        # Wake up submitters waiting for a browser, so that they can fail
+        self._notify_browser_idle()
 
         for browser in self.browsers:
             if (
@@ -331,7 +352,7 @@ class TaskManager:
         if hasattr(self, "callback_thread"):
             self.callback_thread.join()
 
-    def _check_failure_status(self) -> None:
+    def check_failure_status(self) -> None:
         """Check the status of command failures. Raise exceptions as necessary
 
         The failure status property is used by the various asynchronous
@@ -363,30 +384,96 @@ class TaskManager:
 
     # CRAWLER COMMAND CODE
 
-    def _start_thread(
+    def start_command_sequence(
         self, browser: BrowserManagerHandle, command_sequence: CommandSequence
     ) -> threading.Thread:
-        """starts the command execution thread"""
+        """Starts the command execution thread on a browser returned by
+        acquire_browser, which gets released again if that fails
+
+        Blocks while fetching the visit_id from the storage controller.
+        """
+        try:
+            return self._start_command_thread(browser, command_sequence)
+        except BaseException:
+            self._release_browser(browser)
+            raise
 
+    def _start_command_thread(
+        self, browser: BrowserManagerHandle, command_sequence: CommandSequence
+    ) -> threading.Thread:
         # Check status flags before starting thread
         if self.closing:
             self.logger.error("Attempted to execute command on a closed TaskManager")
             raise RuntimeError("Attempted to execute command on a closed TaskManager")
-        self._check_failure_status()
+        self.check_failure_status()
+        browser.current_timeout = command_sequence.total_timeout
         visit_id = self.storage_controller_handle.get_next_visit_id()
         browser.set_visit_id(visit_id)
         if command_sequence.callback:
             self.unsaved_command_sequences[visit_id] = command_sequence
 
         # Start command execution thread
-        args = (self, command_sequence)
-        thread = threading.Thread(target=browser.execute_command_sequence, args=args)
+        args = (browser, command_sequence)
+        thread = threading.Thread(target=self._run_command_sequence, args=args)
         thread.name = f"BrowserManagerHandle-{browser.browser_id}"
         browser.command_thread = thread
         thread.daemon = True
         thread.start()
         return thread
 
+    def _run_command_sequence(
+        self, browser: BrowserManagerHandle, command_sequence: CommandSequence
+    ) -> None:
+        """Target of the command execution threads"""
+        try:
+            browser.execute_command_sequence(self, command_sequence)
+        finally:
+            self._release_browser(browser)
+
+    def acquire_browser(
+        self, index: Optional[int], blocking: bool = True
+    ) -> Optional[BrowserManagerHandle]:
+        """Blocks until the browser at index (or any browser if index is None)
+        is idle and marks it as busy
+
+        With blocking=False, None is returned instead of waiting. Either way
+        this joins the command thread that last used the browser.
+        """
+        with self.browser_idle:
+            while True:
+                if self.closing:
+                    self.logger.error(
+                        "Attempted to execute command on a closed TaskManager"
+                    )
+                    raise RuntimeError(
+                        "Attempted to execute command on a closed TaskManager"
+                    )
+                if index is None and self.idle_browsers:
+                    # Keep the order of self.browsers, like first come, first serve
+                    index = min(self.idle_browsers)
+                if index is not None and index in self.idle_browsers:
+                    self.idle_browsers.remove(index)
+                    break
+                if not blocking:
+                    return None
+                self.browser_idle.wait()
+        browser = self.browsers[index]
+        # The thread that released the browser might still be exiting
+        if browser.command_thread is not None:
+            browser.command_thread.join()
+        return browser
+
+    def _release_browser(self, browser: BrowserManagerHandle) -> None:
+        with self.browser_idle:
+            self.idle_browsers.add(self.browsers.index(browser))
+        self._notify_browser_idle()
+
+    def _notify_browser_idle(self) -> None:
+        with self.browser_idle:
+            self.browser_idle.notify_all()
+        for listener in list(self.idle_listeners):
+            listener()
+
     def _mark_command_sequences_complete(self) -> None:
         """Polls the storage controller for saved records
         and calls their callbacks
@@ -429,36 +516,85 @@ class TaskManager:
                 agg_queue_size = self.storage_controller_handle.get_status()
 
         # Distribute command
-        if index is None:
-            # send to first browser available
-            command_executed = False
-            while True:
-                for browser in self.browsers:
-                    if browser.ready():
-                        browser.current_timeout = command_sequence.total_timeout
-                        thread = self._start_thread(browser, command_sequence)
-                        command_executed = True
-                        break
-                if command_executed:
-                    break
-                time.sleep(SLEEP_CONS)
-        elif 0 <= index < len(self.browsers):
-            # send the command to this specific browser
-            while True:
-                if self.browsers[index].ready():
-                    self.browsers[
-                        index
-                    ].current_timeout = command_sequence.total_timeout
-                    thread = self._start_thread(self.browsers[index], command_sequence)
-                    break
-                time.sleep(SLEEP_CONS)
-        else:
+        if index is not None and not 0 <= index < len(self.browsers):
             self.logger.info("Command index type is not supported or out of range")
             return
+        # None sends it to the first browser available
+        browser = self.acquire_browser(index)
+        assert browser is not None
+        thread = self.start_command_sequence(browser, command_sequence)
 
         if command_sequence.blocking:
             thread.join()
-            self._check_failure_status()
+            self.check_failure_status()
+
+    def execute_command_sequences(
+        self,
+        command_sequences: Iterable[CommandSequence],
+        max_in_flight: int = MAX_IN_FLIGHT,
+    ) -> Iterator[Tuple[CommandSequence, bool]]:
+        """
+        Executes the command sequences on the first browsers available and
+        yields every command sequence together with its success once all of
+        its data has been saved, in the order they complete
+
+        The command sequences are only taken from the iterable when a browser
+        is available and fewer than max_in_flight of them are still waiting
+        to be saved, so it can be a generator over a large list of sites.
+        Storage providers like the LocalArrowProvider only save a visit
+        together with its batch, so max_in_flight should be well above the
+        number of browsers to keep all of them busy.
+        Callbacks set on the command sequences are still called.
+        Nothing happens until the returned iterator is consumed:
+
+        .. code-block:: Python
+
+            sequences = (make_command_sequence(url) for url in urls)
+            for command_sequence, success in manager.execute_command_sequences(
+                sequences
+            ):
+                ...
+        """
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight needs to be at least 1")
+        completed: "queue.Queue[Tuple[CommandSequence, bool]]" = queue.Queue()
+
+        def on_done(
+            command_sequence: CommandSequence,
+            callback: Optional[Callable[[bool], None]],
+            success: bool,
+        ) -> None:
+            if callback is not None:
+                callback(success)
+            completed.put((command_sequence, success))
+
+        in_flight = 0
+        for command_sequence in command_sequences:
+            while in_flight >= max_in_flight:
+                yield self._wait_for_completion(completed)
+                in_flight -= 1
+            command_sequence.callback = partial(
+                on_done, command_sequence, command_sequence.callback
+            )
+            self.execute_command_sequence(command_sequence)
+            in_flight += 1
+            while not completed.empty():
+                yield completed.get()
+                in_flight -= 1
+        while in_flight:
+            yield self._wait_for_completion(completed)
+            in_flight -= 1
+
+    def _wait_for_completion(
+        self, completed: "queue.Queue[Tuple[CommandSequence, bool]]"
+    ) -> Tuple[CommandSequence, bool]:
+        """Blocks until a command sequence completed and raises if
+        a command execution thread set the failure status in the meantime"""
+        while True:
+            try:
+                return completed.get(timeout=FAILURE_CHECK_INTERVAL)
+            except queue.Empty:
+                self.check_failure_status()
 
     # DEFINITIONS OF HIGH LEVEL COMMANDS
     # NOTE: These wrappers are provided for convenience. To issue sequential
@@ -0,0 +1,129 @@
+"""Prepares the SQLite output of a finished crawl for analysis
+
+The tables in schema.sql deliberately come without secondary indexes, as
+every index slows down the ingestion during the crawl. Run this once after
+the crawl to build covering indexes for the common join keys, a couple of
+views joining the related tables and a materialized per-visit summary.
+
+Usage:
+    python -m openwpm.utilities.build_analysis_tables crawl-data.sqlite
+"""
+import sqlite3
+import sys
+from pathlib import Path
+from typing import List, Tuple
+
+ANALYSIS_INDEXES: List[Tuple[str, Tuple[str, ...]]] = [
+    ("site_visits", ("browser_id", "visit_id")),
+    ("crawl_history", ("visit_id", "command_status")),
+    ("http_requests", ("visit_id", "request_id")),
+    ("http_requests", ("url",)),
+    ("http_responses", ("visit_id", "request_id", "response_status", "content_hash")),
+    ("http_responses", ("content_hash",)),
+    ("http_redirects", ("visit_id", "old_request_id", "new_request_id")),
+    ("javascript", ("visit_id", "symbol", "operation")),
+    ("javascript", ("script_url",)),
+    ("javascript_cookies", ("visit_id", "host", "name")),
+    ("navigations", ("visit_id",)),
+    ("callstacks", ("visit_id", "request_id")),
+    ("dns_responses", ("visit_id", "request_id")),
+    ("incomplete_visits", ("visit_id",)),
+    # Created by build_cookie_table
+    ("http_request_cookies", ("header_id",)),
+    ("http_response_cookies", ("header_id",)),
+]
+
+ANALYSIS_VIEWS = {
+    "http_exchanges": """
+        SELECT req.visit_id, req.browser_id, req.request_id, req.url,
+               req.top_level_url, req.method, req.resource_type,
+               req.is_third_party_channel, req.is_third_party_to_top_window,
+               req.time_stamp AS request_time_stamp,
+               resp.response_status, resp.is_cached, resp.content_hash,
+               resp.time_stamp AS response_time_stamp
+        FROM http_requests AS req
+        LEFT JOIN http_responses AS resp
+            ON resp.visit_id = req.visit_id AND resp.request_id = req.request_id
+    """,
+    "http_request_callstacks": """
+        SELECT req.visit_id, req.request_id, req.url, cs.call_stack
+        FROM http_requests AS req
+        JOIN callstacks AS cs
+            ON cs.visit_id = req.visit_id AND cs.request_id = req.request_id
+    """,
+}
+
+VISIT_SUMMARY = """
+    CREATE TABLE visit_summary AS
+    SELECT sv.visit_id, sv.browser_id, sv.site_url, sv.site_rank,
+        EXISTS (
+            SELECT 1 FROM incomplete_visits AS iv WHERE iv.visit_id = sv.visit_id
+        ) AS incomplete,
+        (SELECT COUNT(*) FROM crawl_history AS ch
+            WHERE ch.visit_id = sv.visit_id AND ch.command_status != 'ok'
+        ) AS failed_commands,
+        (SELECT COUNT(*) FROM http_requests AS req
+            WHERE req.visit_id = sv.visit_id) AS http_requests,
+        (SELECT COUNT(*) FROM http_responses AS resp
+            WHERE resp.visit_id = sv.visit_id) AS http_responses,
+        (SELECT COUNT(DISTINCT resp.content_hash) FROM http_responses AS resp
+            WHERE resp.visit_id = sv.visit_id) AS stored_contents,
+        (SELECT COUNT(*) FROM javascript AS js
+            WHERE js.visit_id = sv.visit_id) AS javascript_calls,
+        (SELECT COUNT(DISTINCT js.script_url) FROM javascript AS js
+            WHERE js.visit_id = sv.visit_id) AS javascript_scripts,
+        (SELECT COUNT(*) FROM javascript_cookies AS jc
+            WHERE jc.visit_id = sv.visit_id) AS javascript_cookies
+    FROM site_visits AS sv
+"""
+
+
+def _existing_tables(con: sqlite3.Connection) -> List[str]:
+    rows = con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    return [row[0] for row in rows]
+
+
+def build_indexes(con: sqlite3.Connection) -> None:
+    """Creates the ANALYSIS_INDEXES for all tables that exist in the database"""
+    tables = _existing_tables(con)
+    for table, columns in ANALYSIS_INDEXES:
+        if table not in tables:
+            continue
+        index_name = "idx_%s_%s" % (table, "_".join(columns))
+        con.execute(
+            "CREATE INDEX IF NOT EXISTS %s ON %s (%s)"
+            % (index_name, table, ", ".join(columns))
+        )
+
+
+def build_views(con: sqlite3.Connection) -> None:
+    for name, query in ANALYSIS_VIEWS.items():
+        con.execute("CREATE VIEW IF NOT EXISTS %s AS %s" % (name, query))
+
+
+def build_visit_summary(con: sqlite3.Connection) -> None:
+    """(Re)creates the visit_summary table with one row of counts per visit"""
+    con.execute("DROP TABLE IF EXISTS visit_summary")
+    con.execute(VISIT_SUMMARY)
+    con.execute(
+        "CREATE UNIQUE INDEX idx_visit_summary_visit_id ON visit_summary (visit_id)"
+    )
+
+
+def build_analysis_tables(db: Path) -> None:
+    """Builds indexes, views and the visit_summary and updates the statistics
+    the query planner relies on. Safe to run repeatedly."""
+    with sqlite3.connect(db) as con:
+        build_indexes(con)
+        build_views(con)
+        build_visit_summary(con)
+        con.execute("ANALYZE")
+    con.close()
+
+
+def main() -> None:
+    build_analysis_tables(Path(sys.argv[1]))
+
+
+if __name__ == "__main__":
+    main()
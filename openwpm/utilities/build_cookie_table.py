@@ -179,6 +179,15 @@ def build_http_cookie_table(database, verbose=False):
                     version VARCHAR(100), \
                     accessed DATETIME);"
     )
+    # Lets the NOT EXISTS checks below use an index lookup
+    cur1.execute(
+        "CREATE INDEX IF NOT EXISTS idx_http_request_cookies_header_id \
+                    ON http_request_cookies (header_id);"
+    )
+    cur1.execute(
+        "CREATE INDEX IF NOT EXISTS idx_http_response_cookies_header_id \
+                    ON http_response_cookies (header_id);"
+    )
     con.commit()
 
     # Parse http request cookies
@@ -188,8 +197,8 @@ def build_http_cookie_table(database, verbose=False):
     cur1.execute(
         """SELECT id, browser_id, headers, time_stamp
                     FROM http_requests
-                    WHERE id NOT IN (SELECT header_id FROM
-                    http_request_cookies)"""
+                    WHERE NOT EXISTS (SELECT 1 FROM http_request_cookies
+                    WHERE header_id = http_requests.id)"""
     )
 
     row = cur1.fetchone()
@@ -228,8 +237,8 @@ def build_http_cookie_table(database, verbose=False):
     cur1.execute(
         """SELECT id, browser_id, url, headers, time_stamp
                     FROM http_responses
-                    WHERE id NOT IN (SELECT header_id
-                    FROM http_response_cookies)"""
+                    WHERE NOT EXISTS (SELECT 1 FROM http_response_cookies
+                    WHERE header_id = http_responses.id)"""
     )
 
     row = cur1.fetchone()
@@ -1,26 +1,126 @@
+import logging
 import sqlite3
+import sys
 from collections.abc import Iterable
 from pathlib import Path
 from typing import Any, AnyStr, Iterator, List, Optional, Tuple, Union
 
 import plyvel
 
+from openwpm.storage.shards import get_shard_paths
+
+# SQLITE_MAX_ATTACHED of the default SQLite build
+MAX_ATTACHED_SHARDS = 10
+# The largest limit any SQLite build can be raised to
+SQLITE_MAX_ATTACHED = 125
+
+
+def _get_shards(db: Path) -> List[Path]:
+    shards = get_shard_paths(db)
+    if not shards:
+        raise ValueError(f"No SQLite shards found in {db}")
+    return shards
+
+
+def _raise_attach_limit(con: sqlite3.Connection) -> int:
+    """Raises the number of databases con can attach as far as the SQLite
+    build allows and returns the new limit"""
+    if sys.version_info < (3, 11):
+        # setlimit is only available from Python 3.11 on
+        return MAX_ATTACHED_SHARDS
+    # Gets capped at the SQLITE_MAX_ATTACHED the library was compiled with
+    con.setlimit(sqlite3.SQLITE_LIMIT_ATTACHED, SQLITE_MAX_ATTACHED)
+    return con.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+
+
+def get_max_attached_shards() -> int:
+    """Returns how many shards `connect` can open at once"""
+    con = sqlite3.connect(":memory:")
+    try:
+        return _raise_attach_limit(con)
+    finally:
+        con.close()
+
+
+def _connect_shards(shards: List[Path]) -> Optional[sqlite3.Connection]:
+    """Attaches all shards and creates the UNION ALL views, returns None if
+    there are more shards than SQLite can attach"""
+    con = sqlite3.connect(":memory:")
+    if len(shards) > _raise_attach_limit(con):
+        con.close()
+        return None
+    for i, shard in enumerate(shards):
+        con.execute(f"ATTACH DATABASE ? AS shard{i}", (str(shard),))
+    # Every shard is created from the same schema
+    rows = con.execute(
+        "SELECT name FROM shard0.sqlite_master WHERE type = 'table' "
+        "AND name NOT LIKE 'sqlite_%'"
+    )
+    for (table,) in rows.fetchall():
+        selects = [f"SELECT * FROM shard{i}.{table}" for i in range(len(shards))]
+        con.execute(f"CREATE TEMP VIEW {table} AS {' UNION ALL '.join(selects)}")
+    return con
+
+
+def connect(db: Path) -> sqlite3.Connection:
+    """Opens a single database or all shards written by a ShardedSQLiteProvider
+
+    If db is a directory, every shard gets attached to an in-memory database
+    and each table is exposed as a temporary view over the UNION ALL of that
+    table across all shards, so queries see the shards as one database.
+    Raises a ValueError if there are more shards than SQLite can attach,
+    see get_max_attached_shards.
+    """
+    if not Path(db).is_dir():
+        return sqlite3.connect(db)
+    shards = _get_shards(db)
+    con = _connect_shards(shards)
+    if con is None:
+        raise ValueError(
+            f"Can't attach all {len(shards)} shards in {db}, this SQLite build "
+            f"only supports {get_max_attached_shards()}"
+        )
+    return con
+
 
 def query_db(
     db: Path, query: str, params: Any = None, as_tuple: bool = False
 ) -> List[Union[sqlite3.Row, Tuple[Any, ...]]]:
     """Run a query against the given db.
 
+    db can also be the directory of a ShardedSQLiteProvider, which gets
+    opened with `connect`. If there are more shards than SQLite can attach
+    the query runs against every shard on its own instead and the rows get
+    concatenated, so aggregates, ORDER BY and LIMIT then apply per shard.
     If params is not None, securely construct a query from the given
     query string and params.
     """
-    with sqlite3.connect(db) as con:
+    if Path(db).is_dir():
+        shards = _get_shards(db)
+        shard_con = _connect_shards(shards)
+        if shard_con is None:
+            logging.getLogger("openwpm").warning(
+                "Too many shards to attach in %s, running the query per shard", db
+            )
+            rows: List[Union[sqlite3.Row, Tuple[Any, ...]]] = []
+            for shard in shards:
+                rows.extend(query_db(shard, query, params, as_tuple))
+            return rows
+        return _execute(shard_con, query, params, as_tuple)
+    return _execute(sqlite3.connect(db), query, params, as_tuple)
+
+
+def _execute(
+    con: sqlite3.Connection, query: str, params: Any, as_tuple: bool
+) -> List[Union[sqlite3.Row, Tuple[Any, ...]]]:
+    with con:
         if not as_tuple:
             con.row_factory = sqlite3.Row
         if params is None:
             rows = con.execute(query).fetchall()
         else:
             rows = con.execute(query, params).fetchall()
+    con.close()
     return rows
 
 
@@ -0,0 +1,73 @@
+"""Measures the storage saved by content-defined chunking over whole-blob deduplication
+
+The corpus is either a directory (all files below it are used) or the
+LevelDB content database of a previous crawl. Every blob is stored in a
+ChunkedUnstructuredProvider backed by a temporary LevelDB and read back to
+check the reassembly. Sizes are before compression.
+
+Run from the repository root:
+    PYTHONPATH=. python scripts/benchmark-chunking.py <corpus>
+"""
+import asyncio
+import hashlib
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+from openwpm.storage.chunked_storage import ChunkedUnstructuredProvider
+from openwpm.storage.leveldb import LevelDbProvider
+from openwpm.utilities.db_utils import get_content
+
+AVG_CHUNK_SIZES = [2 * 1024, 4 * 1024, 8 * 1024, 16 * 1024]
+
+
+def load_corpus(path: Path) -> List[bytes]:
+    if (path / "CURRENT").exists():
+        return [content for _, content in get_content(path)]
+    return [p.read_bytes() for p in sorted(path.rglob("*")) if p.is_file()]
+
+
+async def measure(avg_chunk_size: int, blobs: List[bytes], whole: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        provider = ChunkedUnstructuredProvider(
+            LevelDbProvider(Path(tmp_dir) / "content.ldb"),
+            min_chunk_size=avg_chunk_size // 4,
+            avg_chunk_size=avg_chunk_size,
+            max_chunk_size=avg_chunk_size * 8,
+        )
+        await provider.init()
+        start = time.perf_counter()
+        for blob in blobs:
+            await provider.store_blob(hashlib.sha256(blob).hexdigest(), blob)
+        await provider.flush_cache()
+        elapsed = time.perf_counter() - start
+        for blob in blobs[:: max(1, len(blobs) // 100)]:
+            content = await provider.read_blob(hashlib.sha256(blob).hexdigest())
+            assert content == blob, "Reassembled blob doesn't match"
+        await provider.shutdown()
+    stored = provider.chunk_bytes + provider.recipe_bytes
+    print(
+        f"avg {avg_chunk_size // 1024:3d} KiB"
+        f"  stored {stored / 1e6:8.1f} MB"
+        f"  saved {1 - stored / whole:6.1%} over whole-blob dedup"
+        f"  ({len(provider.chunk_cache)} chunks,"
+        f" {provider.blob_bytes / elapsed / 1e6:.1f} MB/s)"
+    )
+
+
+def main() -> None:
+    blobs = [blob for blob in load_corpus(Path(sys.argv[1])) if blob]
+    unique = {hashlib.sha256(blob).digest(): blob for blob in blobs}
+    whole = sum(len(blob) for blob in unique.values())
+    print(
+        f"{len(blobs)} blobs, {sum(len(b) for b in blobs) / 1e6:.1f} MB, "
+        f"{len(unique)} unique blobs, {whole / 1e6:.1f} MB"
+    )
+    for avg_chunk_size in AVG_CHUNK_SIZES:
+        asyncio.run(measure(avg_chunk_size, list(unique.values()), whole))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Compares the compression ratio and speed of the unstructured storage codecs
+
+The corpus is either a directory (all files below it are used) or the
+LevelDB content database of a previous crawl. The dictionary gets trained
+on the first tenth of the corpus and the codecs are measured on the rest.
+
+Run from the repository root:
+    PYTHONPATH=. python scripts/benchmark-codecs.py <corpus>
+"""
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from openwpm.storage.codecs import Codec, GzipCodec, ZstdCodec, train_dictionary
+from openwpm.utilities.db_utils import get_content
+
+
+def load_corpus(path: Path) -> List[bytes]:
+    if (path / "CURRENT").exists():
+        return [content for _, content in get_content(path)]
+    return [p.read_bytes() for p in sorted(path.rglob("*")) if p.is_file()]
+
+
+def measure(name: str, codec: Codec, blobs: List[bytes]) -> None:
+    total = sum(len(blob) for blob in blobs)
+    start = time.perf_counter()
+    compressed = [codec.compress(blob) for blob in blobs]
+    compress_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for data in compressed:
+        codec.decompress(data)
+    decompress_time = time.perf_counter() - start
+    ratio = total / sum(len(data) for data in compressed)
+    print(
+        f"{name:16} ratio {ratio:6.2f}"
+        f"  compress {total / compress_time / 1e6:8.1f} MB/s"
+        f"  decompress {total / decompress_time / 1e6:8.1f} MB/s"
+    )
+
+
+def main() -> None:
+    blobs = [blob for blob in load_corpus(Path(sys.argv[1])) if blob]
+    split = len(blobs) // 10
+    samples, blobs = blobs[:split], blobs[split:]
+    print(
+        f"{len(blobs)} blobs, {sum(len(b) for b in blobs) / 1e6:.1f} MB "
+        f"({len(samples)} used for training)"
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dictionary_path = Path(tmp_dir) / "dictionary.zstd"
+        dictionary_path.write_bytes(train_dictionary(samples))
+        codecs: Dict[str, Codec] = {
+            "gzip 1": GzipCodec(level=1),
+            "gzip 6": GzipCodec(level=6),
+            "gzip 9": GzipCodec(level=9),
+            "zstd 3": ZstdCodec(level=3),
+            "zstd 9": ZstdCodec(level=9),
+            "zstd 3 + dict": ZstdCodec(level=3, dictionary_path=dictionary_path),
+            "zstd 9 + dict": ZstdCodec(level=9, dictionary_path=dictionary_path),
+        }
+        for name, codec in codecs.items():
+            measure(name, codec, blobs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Compares the RecordNormalizer against the per record schema walk
+ArrowProvider.store_record and SQLiteStorageProvider.store_record used to do.
+
+Run from the repository root:
+    PYTHONPATH=. python scripts/benchmark-record-normalizer.py
+"""
+import json
+import random
+import timeit
+from typing import Any, Dict, List
+
+import pyarrow as pa
+
+from openwpm.storage.parquet_schema import PQ_SCHEMAS
+from openwpm.storage.record_normalizer import RecordNormalizer
+from openwpm.storage.storage_providers import TableName
+
+TABLES = [TableName("javascript"), TableName("http_requests")]
+RECORDS = 10000
+REPEAT = 5
+
+
+def make_record(schema: pa.Schema) -> Dict[str, Any]:
+    """Builds a record that is missing about a quarter of the columns"""
+    record: Dict[str, Any] = {}
+    for field in schema:
+        if field.name == "instance_id" or random.random() < 0.25:
+            continue
+        if pa.types.is_string(field.type):
+            record[field.name] = "x" * random.randint(5, 200)
+        elif pa.types.is_boolean(field.type):
+            record[field.name] = random.choice([True, False])
+        else:
+            record[field.name] = random.randint(0, 2**31)
+    return record
+
+
+def legacy_arrow(table: TableName, record: Dict[str, Any]) -> Dict[str, Any]:
+    for item in PQ_SCHEMAS[table].names:
+        if item not in record:
+            record[item] = None
+    record["instance_id"] = 1
+    return record
+
+
+def legacy_sqlite(table: TableName, record: Dict[str, Any]) -> List[Any]:
+    args = list(record.values())
+    for i in range(len(args)):
+        if isinstance(args[i], bytes):
+            args[i] = str(args[i], errors="ignore")
+        elif callable(args[i]):
+            args[i] = str(args[i])
+        elif type(args[i]) == dict:
+            args[i] = json.dumps(args[i])
+    return args
+
+
+def main() -> None:
+    arrow_normalizer = RecordNormalizer(PQ_SCHEMAS, overrides={"instance_id": 1})
+    sqlite_normalizer = RecordNormalizer()
+    for table in TABLES:
+        records = [make_record(PQ_SCHEMAS[table]) for _ in range(RECORDS)]
+        candidates = {
+            "legacy arrow": lambda: [legacy_arrow(table, dict(r)) for r in records],
+            "normalizer arrow": lambda: [
+                arrow_normalizer.normalize(table, r) for r in records
+            ],
+            "legacy sqlite": lambda: [legacy_sqlite(table, r) for r in records],
+            "normalizer sqlite": lambda: [
+                sqlite_normalizer.normalize(table, r) for r in records
+            ],
+        }
+        for name, candidate in candidates.items():
+            best = min(timeit.repeat(candidate, number=1, repeat=REPEAT))
+            print(f"{table:14} {name:18} {best / RECORDS * 1e6:6.2f} us/record")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
-from typing import Any, List
+from typing import Any, Generator, List
 
 import pytest
 from _pytest.fixtures import FixtureRequest
+from moto.server import ThreadedMotoServer
 
 from openwpm.storage.in_memory_storage import (
     MemoryArrowProvider,
@@ -10,6 +11,8 @@ from openwpm.storage.in_memory_storage import (
 )
 from openwpm.storage.leveldb import LevelDbProvider
 from openwpm.storage.local_storage import LocalGzipProvider
+from openwpm.storage.pack_storage import LocalPackProvider
+from openwpm.storage.sharded_sql_provider import ShardedSQLiteProvider
 from openwpm.storage.sql_provider import SQLiteStorageProvider
 from openwpm.storage.storage_controller import INVALID_VISIT_ID
 from openwpm.storage.storage_providers import (
@@ -21,6 +24,7 @@ from test.storage.test_values import dt_test_values, generate_test_values
 memory_structured = "memory_structured"
 sqlite = "sqlite"
 memory_arrow = "memory_arrow"
+sharded_sqlite = "sharded_sqlite"
 
 
 @pytest.fixture
@@ -34,6 +38,8 @@ def structured_provider(
         return SQLiteStorageProvider(tmp_path / "test_db.sqlite")
     elif request.param == memory_arrow:
         return MemoryArrowProvider()
+    elif request.param == sharded_sqlite:
+        return ShardedSQLiteProvider(tmp_path_factory.mktemp(sharded_sqlite))
     assert isinstance(
         request, FixtureRequest
     )  # See https://github.com/pytest-dev/pytest/issues/8073 for why this can't be type annotated
@@ -44,12 +50,14 @@ structured_scenarios: List[str] = [
     memory_structured,
     sqlite,
     memory_arrow,
+    sharded_sqlite,
 ]
 
 # Unstructured Providers
 memory_unstructured = "memory_unstructured"
 leveldb = "leveldb"
 local_gzip = "local_gzip"
+local_pack = "local_pack"
 
 
 @pytest.fixture
@@ -64,13 +72,20 @@ def unstructured_provider(
     elif request.param == local_gzip:
         tmp_path = tmp_path_factory.mktemp(local_gzip)
         return LocalGzipProvider(tmp_path)
+    elif request.param == local_pack:
+        return LocalPackProvider(tmp_path_factory.mktemp(local_pack))
     assert isinstance(
         request, FixtureRequest
     )  # See https://github.com/pytest-dev/pytest/issues/8073 for why this can't be type annotated
     request.raiseerror("invalid internal test config")
 
 
-unstructured_scenarios: List[str] = [memory_unstructured, leveldb, local_gzip]
+unstructured_scenarios: List[str] = [
+    memory_unstructured,
+    leveldb,
+    local_gzip,
+    local_pack,
+]
 
 
 @pytest.fixture
@@ -82,3 +97,13 @@ def test_values() -> dt_test_values:
         )
     visit_ids.add(INVALID_VISIT_ID)
     return data, visit_ids
+
+
+@pytest.fixture(scope="session")
+def s3_endpoint() -> Generator[str, None, None]:
+    """Runs a local S3 compatible server and returns its url"""
+    server = ThreadedMotoServer(port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    yield f"http://{host}:{port}"
+    server.stop()
@@ -5,25 +5,36 @@ import pytest
 from pandas import DataFrame
 
 from openwpm.mp_logger import MPLogger
-from openwpm.storage.arrow_storage import CACHE_SIZE
 from openwpm.storage.in_memory_storage import MemoryArrowProvider
 from openwpm.storage.storage_providers import TableName
 from openwpm.types import VisitId
 from test.storage.test_values import dt_test_values
 
+CACHE_SIZE_BYTES = 4 * 1024
+
 
 @pytest.mark.asyncio
 async def test_arrow_cache(mp_logger: MPLogger, test_values: dt_test_values) -> None:
-    prov = MemoryArrowProvider()
+    prov = MemoryArrowProvider(cache_size_bytes=CACHE_SIZE_BYTES)
     await prov.init()
     site_visit = test_values[0][TableName("site_visits")]
     for j in range(5):  # Testing that the cache works repeatedly
         d: Dict[VisitId, Awaitable[None]] = {}
-        for i in range(CACHE_SIZE + 1):
-            visit_id = VisitId(i + j * 1000)
+        max_cache_bytes = 0
+        i = 0
+        while True:
+            visit_id = VisitId(i + j * 100000)
             site_visit["visit_id"] = visit_id
             await prov.store_record(TableName("site_visits"), visit_id, site_visit)
             d[visit_id] = await prov.finalize_visit_id(visit_id)
+            i += 1
+            if prov.cache_bytes == 0:
+                # The high watermark was reached and the cache got flushed
+                break
+            max_cache_bytes = max(max_cache_bytes, prov.cache_bytes)
+
+        assert len(d) > 1
+        assert max_cache_bytes < CACHE_SIZE_BYTES
 
         for visit_id in d:
             await d[visit_id]
@@ -42,3 +53,27 @@ async def test_arrow_cache(mp_logger: MPLogger, test_values: dt_test_values) ->
 
         assert len(d) == 0
     await prov.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_arrow_cache_budget_is_global(test_values: dt_test_values) -> None:
+    prov = MemoryArrowProvider(cache_size_bytes=CACHE_SIZE_BYTES)
+    await prov.init()
+    tables = [TableName("site_visits"), TableName("javascript")]
+    total = 0
+    i = 0
+    while prov.cache_bytes < CACHE_SIZE_BYTES // 2:
+        visit_id = VisitId(i)
+        for table in tables:
+            record = dict(test_values[0][table])
+            record["visit_id"] = visit_id
+            await prov.store_record(table, visit_id, record)
+        before = prov.cache_bytes
+        await prov.finalize_visit_id(visit_id)
+        total += prov.cache_bytes - before
+        i += 1
+    assert prov.cache_bytes == total
+    assert set(prov._batches.keys()) == set(tables)
+    await prov.flush_cache()
+    assert prov.cache_bytes == 0
+    await prov.shutdown()
@@ -0,0 +1,53 @@
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from openwpm.storage.sql_provider import SQLiteStorageProvider
+from openwpm.storage.storage_providers import TableName
+from openwpm.types import VisitId
+from openwpm.utilities.build_analysis_tables import build_analysis_tables
+from openwpm.utilities.db_utils import query_db
+
+from .test_values import dt_test_values
+
+
+@pytest.mark.asyncio
+async def test_build_analysis_tables(
+    tmp_path: Path, test_values: dt_test_values
+) -> None:
+    test_table, _ = test_values
+    db_path = tmp_path / "crawl-data.sqlite"
+    provider = SQLiteStorageProvider(db_path)
+    await provider.init()
+    visit_id = VisitId(test_table[TableName("site_visits")]["visit_id"])
+    for table in ("site_visits", "http_requests", "http_responses", "javascript"):
+        record = dict(test_table[TableName(table)], visit_id=visit_id)
+        await provider.store_record(TableName(table), visit_id, record)
+    await (await provider.finalize_visit_id(visit_id, interrupted=True))
+    await provider.shutdown()
+
+    # Running it twice must work, e.g. after resuming a crawl
+    build_analysis_tables(db_path)
+    build_analysis_tables(db_path)
+
+    indexes = query_db(
+        db_path, "SELECT name FROM sqlite_master WHERE type = 'index'", as_tuple=True
+    )
+    assert ("idx_http_requests_visit_id_request_id",) in indexes
+    views = query_db(
+        db_path, "SELECT name FROM sqlite_master WHERE type = 'view'", as_tuple=True
+    )
+    assert sorted(views) == [("http_exchanges",), ("http_request_callstacks",)]
+    assert len(query_db(db_path, "SELECT * FROM http_exchanges")) == 1
+
+    summary = query_db(db_path, "SELECT * FROM visit_summary")
+    assert len(summary) == 1
+    row = summary[0]
+    assert isinstance(row, sqlite3.Row)
+    assert row["visit_id"] == visit_id
+    assert row["incomplete"] == 1
+    assert row["http_requests"] == 1
+    assert row["http_responses"] == 1
+    assert row["javascript_calls"] == 1
+    assert len(query_db(db_path, "SELECT * FROM sqlite_stat1")) > 0
@@ -0,0 +1,280 @@
+import gzip
+import os
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List
+
+import pyarrow as pa
+import pytest
+from s3fs import S3FileSystem
+
+from openwpm.storage.cloud_storage.bundle_storage import (
+    BundledUnstructuredProvider,
+    BundleReader,
+)
+from openwpm.storage.cloud_storage.dedup_index import DedupIndex
+from openwpm.storage.cloud_storage.s3_storage import (
+    S3StructuredProvider,
+    S3UnstructuredProvider,
+)
+from openwpm.storage.cloud_storage.spool import SpoolUploader
+from openwpm.storage.cloud_storage.uploader import BlobUploader, UploadError
+from openwpm.storage.codecs import GzipCodec
+from openwpm.storage.storage_providers import TableName
+from openwpm.types import VisitId
+
+CREDENTIALS: Dict[str, Any] = {"key": "testing", "secret": "testing"}
+
+
+@pytest.mark.asyncio
+async def test_s3_unstructured_uploads(s3_endpoint: str) -> None:
+    file_system = S3FileSystem(endpoint_url=s3_endpoint, **CREDENTIALS)
+    file_system.mkdir("openwpm-test")
+    file_system.pipe_file("openwpm-test/content/existing", b"original")
+
+    provider = S3UnstructuredProvider(
+        "openwpm-test",
+        "content",
+        max_concurrency=4,
+        endpoint_url=s3_endpoint,
+        **CREDENTIALS,
+    )
+    await provider.init()
+    for i in range(20):
+        await provider.store_blob(f"blob{i}", f"content {i}".encode())
+        await provider.store_blob(f"blob{i}", b"duplicate")
+        assert provider.uploader.in_flight <= 4
+    await provider.store_blob("existing", b"changed")
+    await provider.flush_cache()
+    assert provider.uploader.in_flight == 0
+    await provider.shutdown()
+
+    file_system.invalidate_cache()
+    assert len(file_system.ls("openwpm-test/content")) == 21
+    assert file_system.cat("openwpm-test/content/blob7") == b"content 7"
+    assert file_system.cat("openwpm-test/content/existing") == b"original"
+
+
+@pytest.mark.asyncio
+async def test_s3_unstructured_codec(s3_endpoint: str) -> None:
+    file_system = S3FileSystem(endpoint_url=s3_endpoint, **CREDENTIALS)
+    file_system.mkdir("openwpm-codec")
+    provider = S3UnstructuredProvider(
+        "openwpm-codec",
+        "content",
+        codec=GzipCodec(),
+        endpoint_url=s3_endpoint,
+        **CREDENTIALS,
+    )
+    await provider.init()
+    await provider.store_blob("blob", b"content")
+    await provider.shutdown()
+    file_system.invalidate_cache()
+    assert (
+        gzip.decompress(file_system.cat("openwpm-codec/content/blob.zip")) == b"content"
+    )
+
+
+@pytest.mark.asyncio
+async def test_s3_unstructured_upload_failures(s3_endpoint: str) -> None:
+    provider = S3UnstructuredProvider(
+        "openwpm-missing-bucket",
+        "content",
+        max_retries=0,
+        endpoint_url=s3_endpoint,
+        **CREDENTIALS,
+    )
+    await provider.init()
+    await provider.store_blob("blob", b"content")
+    with pytest.raises(UploadError) as e:
+        await provider.flush_cache()
+    assert e.value.failed == ["blob"]
+    # Failures are only reported once and the blob can be stored again
+    assert "blob" not in provider.file_name_cache
+    await provider.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_uploader_retries() -> None:
+    uploader = BlobUploader(max_retries=2, backoff_base=0.01)
+    attempts: List[str] = []
+    failed: List[str] = []
+
+    def flaky(name: str, failures: int) -> Callable[[], Awaitable[None]]:
+        async def upload() -> None:
+            attempts.append(name)
+            if attempts.count(name) <= failures:
+                raise ConnectionError("Connection reset")
+
+        return upload
+
+    await uploader.submit("flaky", flaky("flaky", 2), lambda: failed.append("flaky"))
+    await uploader.submit("broken", flaky("broken", 3), lambda: failed.append("broken"))
+    assert await uploader.drain() == ["broken"]
+    assert attempts.count("flaky") == 3
+    assert attempts.count("broken") == 3
+    assert failed == ["broken"]
+
+
+def test_dedup_index_manifests(tmp_path: Path) -> None:
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("content/hash1\ncontent/hash2\n\n")
+    inventory = tmp_path / "inventory.csv.gz"
+    with gzip.open(inventory, "wt") as f:
+        f.write('"openwpm-test","content/hash3","42"\n')
+
+    index = DedupIndex(tmp_path / "dedup.sqlite")
+    index.load_manifest(manifest, "openwpm-test")
+    index.load_manifest(inventory, "ignored")
+    index.add("openwpm-other/content/hash4")
+    index.close()
+
+    index = DedupIndex(tmp_path / "dedup.sqlite")
+    assert len(index) == 4
+    assert "openwpm-test/content/hash1" in index
+    assert "openwpm-test/content/hash3" in index
+    # Blobs are only known under their full path
+    assert "hash1" not in index
+    assert "openwpm-other/content/hash1" not in index
+    index.close()
+
+
+@pytest.mark.asyncio
+async def test_s3_unstructured_dedup_index(s3_endpoint: str, tmp_path: Path) -> None:
+    file_system = S3FileSystem(endpoint_url=s3_endpoint, **CREDENTIALS)
+    file_system.mkdir("openwpm-dedup")
+    manifest = tmp_path / "manifest.txt"
+    # Listed in the manifest but not in the bucket, so it mustn't get uploaded
+    manifest.write_text("content/listed\n")
+    provider_args: Dict[str, Any] = dict(
+        dedup_index_path=tmp_path / "dedup.sqlite",
+        endpoint_url=s3_endpoint,
+        **CREDENTIALS,
+    )
+
+    provider = S3UnstructuredProvider(
+        "openwpm-dedup", "content", manifest_path=manifest, **provider_args
+    )
+    await provider.init()
+    await provider.store_blob("listed", b"content")
+    await provider.store_blob("new", b"content")
+    await provider.shutdown()
+
+    # A new worker knows about the upload without asking the bucket
+    provider = S3UnstructuredProvider("openwpm-dedup", "content", **provider_args)
+    await provider.init()
+    assert provider.dedup_index is not None
+    assert "openwpm-dedup/content/new" in provider.dedup_index
+    await provider.shutdown()
+
+    # The same blob under another prefix isn't deduplicated
+    provider = S3UnstructuredProvider("openwpm-dedup", "other", **provider_args)
+    await provider.init()
+    await provider.store_blob("new", b"content")
+    await provider.shutdown()
+
+    file_system.invalidate_cache()
+    assert file_system.ls("openwpm-dedup/content") == ["openwpm-dedup/content/new"]
+    assert file_system.ls("openwpm-dedup/other") == ["openwpm-dedup/other/new"]
+
+
+@pytest.mark.asyncio
+async def test_bundled_uploads(s3_endpoint: str) -> None:
+    storage_options: Dict[str, Any] = dict(endpoint_url=s3_endpoint, **CREDENTIALS)
+    file_system = S3FileSystem(**storage_options)
+    file_system.mkdir("openwpm-bundles")
+    blobs = {f"hash{i}": f"content {i}".encode() * 10 for i in range(30)}
+
+    provider = BundledUnstructuredProvider(
+        "openwpm-bundles/content", max_bundle_bytes=1000, **storage_options
+    )
+    await provider.init()
+    for filename, blob in blobs.items():
+        await provider.store_blob(filename, blob)
+        await provider.store_blob(filename, b"duplicate")
+    await provider.store_blob("hash0", b"replaced", overwrite=True)
+    await provider.shutdown()
+    blobs["hash0"] = b"replaced"
+
+    file_system.invalidate_cache()
+    bundles = file_system.ls("openwpm-bundles/content/bundles")
+    manifests = file_system.ls("openwpm-bundles/content/manifests")
+    assert len(bundles) == len(manifests) == 3
+    reader = BundleReader("openwpm-bundles/content", **storage_options)
+    assert len(reader) == 30
+    assert {h: reader[h] for h in reader} == blobs
+
+
+@pytest.mark.asyncio
+async def test_bundled_upload_failures(s3_endpoint: str) -> None:
+    provider = BundledUnstructuredProvider(
+        "openwpm-missing-bucket/content",
+        max_retries=0,
+        endpoint_url=s3_endpoint,
+        **CREDENTIALS,
+    )
+    await provider.init()
+    await provider.store_blob("hash1", b"content")
+    await provider.store_blob("hash2", b"content")
+    with pytest.raises(UploadError) as e:
+        await provider.flush_cache()
+    assert e.value.failed == ["hash1", "hash2"]
+    # Failures are only reported once and the blobs can be stored again
+    assert not provider.file_name_cache
+    await provider.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_s3_structured_spool(s3_endpoint: str, tmp_path: Path) -> None:
+    storage_options: Dict[str, Any] = dict(endpoint_url=s3_endpoint, **CREDENTIALS)
+    file_system = S3FileSystem(**storage_options)
+    file_system.mkdir("openwpm-spool")
+    spool_path = tmp_path / "spool"
+    # Left behind by a crashed run
+    leftover = spool_path / "ready" / "site_visits" / "leftover.parquet"
+    leftover.parent.mkdir(parents=True)
+    leftover.write_bytes(b"parquet")
+    # Written by a process that has exited and by one that is still running
+    stale = spool_path / ".incoming-999999999-0" / "partial"
+    stale.mkdir(parents=True)
+    running = spool_path / f".incoming-{os.getpid()}-0"
+    running.mkdir()
+
+    provider = S3StructuredProvider(
+        "openwpm-spool", "crawl", spool_path=spool_path, **storage_options
+    )
+    await provider.init()
+    assert not stale.parent.exists()
+    assert running.exists()
+    running.rmdir()
+    for i in range(3):
+        await provider.store_record(
+            TableName("site_visits"),
+            VisitId(i),
+            {"visit_id": i, "browser_id": 1, "site_url": f"https://{i}.com"},
+        )
+        token = await provider.finalize_visit_id(VisitId(i))
+        await provider.flush_cache()
+        await token
+    await provider.shutdown()
+    assert provider.spool is not None
+    assert provider.spool.spool_bytes == 0
+    assert not any(p.is_file() for p in spool_path.rglob("*"))
+
+    file_system.invalidate_cache()
+    remote = file_system.ls("openwpm-spool/crawl/visits/site_visits")
+    assert "openwpm-spool/crawl/visits/site_visits/leftover.parquet" in remote
+    assert len(remote) == 4
+
+
+@pytest.mark.asyncio
+async def test_spool_reports_failed_uploads(s3_endpoint: str, tmp_path: Path) -> None:
+    spool = SpoolUploader(tmp_path, "openwpm-missing-bucket/crawl", max_retries=0)
+    await spool.start(S3FileSystem(endpoint_url=s3_endpoint, **CREDENTIALS))
+    await spool.add_table(
+        "site_visits", pa.table({"visit_id": [1]}), partition_cols=None
+    )
+    with pytest.raises(UploadError) as e:
+        await spool.drain()
+    assert len(e.value.failed) == 1
+    # The file stays spooled for the next attempt
+    assert Path(e.value.failed[0]).exists()
@@ -0,0 +1,65 @@
+import gzip
+from pathlib import Path
+
+import pytest
+import zstandard
+
+from openwpm.storage.codecs import TRAINING_ATTEMPTS, GzipCodec, ZstdCodec
+from openwpm.storage.leveldb import LevelDbProvider
+
+
+def make_script(i: int) -> bytes:
+    return (
+        f"(function() {{ var tracker_{i} = window.analytics || [];"
+        f" tracker_{i}.push(['site', '{i}.example.com']);"
+        " document.addEventListener('DOMContentLoaded', function() {"
+        " tracker.init(); }); })();"
+    ).encode() * 3
+
+
+def test_gzip_codec() -> None:
+    codec = GzipCodec(level=1)
+    compressed = codec.compress(b"content")
+    assert gzip.decompress(compressed) == b"content"
+    assert codec.decompress(compressed) == b"content"
+
+
+def test_zstd_codec_trains_dictionary(tmp_path: Path) -> None:
+    dictionary_path = tmp_path / "dictionary.zstd"
+    codec = ZstdCodec(dictionary_path=dictionary_path, training_samples=200)
+    blobs = [make_script(i) for i in range(400)]
+    compressed = [codec.compress(blob) for blob in blobs]
+    assert codec.dictionary is not None
+    assert dictionary_path.exists()
+    dict_ids = {zstandard.get_frame_parameters(c).dict_id for c in compressed}
+    assert dict_ids == {0, codec.dictionary.dict_id()}
+    # The dictionary makes the later blobs a lot smaller
+    assert len(compressed[-1]) < len(compressed[0]) / 2
+
+    # A new codec picks up the stored dictionary and reads all blobs
+    codec = ZstdCodec(dictionary_path=dictionary_path)
+    assert codec.dictionary is not None
+    assert [codec.decompress(c) for c in compressed] == blobs
+
+
+def test_zstd_codec_gives_up_training(tmp_path: Path) -> None:
+    dictionary_path = tmp_path / "dictionary.zstd"
+    # Far too few samples to train a dictionary on
+    codec = ZstdCodec(dictionary_path=dictionary_path, training_samples=2)
+    for i in range(10):
+        codec.compress(make_script(i))
+    assert codec.dictionary is None
+    assert codec._training_attempts == TRAINING_ATTEMPTS
+    assert codec._samples == []
+    assert not dictionary_path.exists()
+
+
+@pytest.mark.asyncio
+async def test_leveldb_codec(tmp_path: Path) -> None:
+    provider = LevelDbProvider(tmp_path / "content.ldb", codec=GzipCodec())
+    await provider.init()
+    await provider.store_blob("hash", make_script(1))
+    await provider.flush_cache()
+    assert gzip.decompress(provider.ldb.get(b"hash")) == make_script(1)
+    assert await provider.read_blob("hash") == make_script(1)
+    await provider.shutdown()
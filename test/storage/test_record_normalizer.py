@@ -0,0 +1,44 @@
+import json
+
+import pyarrow as pa
+
+from openwpm.storage.record_normalizer import RecordNormalizer
+from openwpm.storage.storage_providers import TableName
+
+SCHEMAS = {
+    "site_visits": pa.schema(
+        [
+            pa.field("visit_id", pa.int64()),
+            pa.field("site_url", pa.string()),
+            pa.field("instance_id", pa.uint32()),
+        ]
+    )
+}
+
+
+def test_fills_missing_columns_and_overrides() -> None:
+    normalizer = RecordNormalizer(SCHEMAS, overrides={"instance_id": 7})
+    record = {"visit_id": 1, "instance_id": 3}
+    normalized = normalizer.normalize(TableName("site_visits"), record)
+    assert normalized == {"visit_id": 1, "site_url": None, "instance_id": 7}
+    assert record == {"visit_id": 1, "instance_id": 3}
+
+
+def test_coerces_values() -> None:
+    normalizer = RecordNormalizer()
+    record = {"a": b"bytes", "b": {"key": "value"}, "c": 1, "d": None}
+    normalized = normalizer.normalize(TableName("unknown_table"), record)
+    assert normalized == {
+        "a": "bytes",
+        "b": json.dumps({"key": "value"}),
+        "c": 1,
+        "d": None,
+    }
+    # Tables without a schema don't get any columns added
+    assert normalized.keys() == record.keys()
+
+
+def test_coercion_can_be_disabled() -> None:
+    normalizer = RecordNormalizer(coerce=False)
+    record = {"a": b"bytes"}
+    assert normalizer.normalize(TableName("table"), record) == record
@@ -0,0 +1,349 @@
+import asyncio
+import sqlite3
+import threading
+from pathlib import Path
+
+import pytest
+
+from openwpm.storage import sql_provider
+from openwpm.storage.sharded_sql_provider import ShardedSQLiteProvider, get_shard_paths
+from openwpm.storage.sql_provider import PRAGMA_PROFILE_BULK_LOAD, SQLiteStorageProvider
+from openwpm.storage.storage_controller import INVALID_VISIT_ID
+from openwpm.storage.storage_providers import TableName
+from openwpm.types import VisitId
+from openwpm.utilities.db_utils import (
+    connect,
+    get_javascript_entries,
+    get_max_attached_shards,
+    query_db,
+)
+
+
+def pragma(provider: SQLiteStorageProvider, name: str) -> object:
+    """Reads a pragma on the writer thread's connection"""
+    return provider._run_in_writer(
+        lambda: provider.db.execute(f"PRAGMA {name}").fetchone()[0]
+    ).result()
+
+
+@pytest.mark.asyncio
+async def test_batched_inserts(tmp_path: Path) -> None:
+    db_path = tmp_path / "crawl-data.sqlite"
+    provider = SQLiteStorageProvider(db_path, batch_size=10)
+    await provider.init()
+    for i in range(25):
+        record = {"visit_id": i, "browser_id": 1, "site_url": f"https://{i}.com"}
+        if i % 2:
+            record["site_rank"] = i
+        await provider.store_record(TableName("site_visits"), VisitId(i), record)
+    # Two full batches got handed to the writer, the rest is still buffered
+    assert provider._buffered_rows == 5
+    await provider.flush_cache()
+    assert provider._buffered_rows == 0
+    # One statement per set of columns
+    assert len(provider._statement_cache) == 2
+
+    rows = query_db(
+        db_path, "SELECT visit_id, site_rank FROM site_visits", as_tuple=True
+    )
+    assert len(rows) == 25
+    for visit_id, site_rank in rows:
+        assert site_rank == (visit_id if visit_id % 2 else None)
+    await provider.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_batch_timeout(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sql_provider, "SQL_BATCH_TIMEOUT", 0.1)
+    db_path = tmp_path / "crawl-data.sqlite"
+    provider = SQLiteStorageProvider(db_path)
+    await provider.init()
+    await provider.store_record(
+        TableName("site_visits"),
+        VisitId(1),
+        {"visit_id": 1, "browser_id": 1, "site_url": "https://a.com"},
+    )
+    assert provider._buffered_rows == 1
+    # No further records arrive, the timer hands off the buffer anyway
+    await asyncio.sleep(0.2)
+    assert provider._buffered_rows == 0
+    await provider.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_broken_record_in_batch(tmp_path: Path) -> None:
+    db_path = tmp_path / "crawl-data.sqlite"
+    provider = SQLiteStorageProvider(db_path)
+    await provider.init()
+    for i in range(3):
+        await provider.store_record(
+            TableName("site_visits"),
+            VisitId(i),
+            # visit_id is the primary key, so the last record gets rejected
+            {"visit_id": min(i, 1), "browser_id": 1, "site_url": "https://a.com"},
+        )
+    await (await provider.finalize_visit_id(VisitId(1)))
+    rows = query_db(db_path, "SELECT visit_id FROM site_visits", as_tuple=True)
+    assert sorted(rows) == [(0,), (1,)]
+    await provider.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_finalize_token_resolves_after_commit(tmp_path: Path) -> None:
+    db_path = tmp_path / "crawl-data.sqlite"
+    provider = SQLiteStorageProvider(db_path)
+    await provider.init()
+    # Keep the writer thread busy so nothing can be committed yet
+    release = threading.Event()
+    provider._run_in_writer(release.wait)
+    await provider.store_record(
+        TableName("site_visits"),
+        VisitId(1),
+        {"visit_id": 1, "browser_id": 1, "site_url": "https://a.com"},
+    )
+    token = await provider.finalize_visit_id(VisitId(1), interrupted=True)
+    assert not token.done()
+    assert query_db(db_path, "SELECT * FROM site_visits") == []
+    release.set()
+    await token
+    assert len(query_db(db_path, "SELECT * FROM site_visits")) == 1
+    assert len(query_db(db_path, "SELECT * FROM incomplete_visits")) == 1
+    await provider.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_full_queue_waits_without_blocking(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(sql_provider, "SQL_QUEUE_SIZE", 2)
+    db_path = tmp_path / "crawl-data.sqlite"
+    provider = SQLiteStorageProvider(db_path)
+    await provider.init()
+    release = threading.Event()
+    provider._run_in_writer(release.wait)
+    # The writer is stuck on the first operation while these are queued
+    for _ in range(2):
+        provider._run_in_writer(lambda: None)
+    await provider.store_record(
+        TableName("site_visits"),
+        VisitId(1),
+        {"visit_id": 1, "browser_id": 1, "site_url": "https://a.com"},
+    )
+    finalize = asyncio.create_task(provider.finalize_visit_id(VisitId(1)))
+    # The event loop keeps running while finalize_visit_id waits
+    await asyncio.sleep(0.1)
+    assert not finalize.done()
+    release.set()
+    await (await finalize)
+    assert len(query_db(db_path, "SELECT * FROM site_visits")) == 1
+    await provider.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_finalize_token_raises_on_failed_commit(tmp_path: Path) -> None:
+    db_path = tmp_path / "crawl-data.sqlite"
+    provider = SQLiteStorageProvider(db_path)
+    await provider.init()
+    # A deferred foreign key violation only fails on commit
+    await asyncio.wrap_future(
+        provider._run_in_writer(
+            lambda: provider.db.executescript(
+                "PRAGMA foreign_keys = ON;"
+                "CREATE TABLE parent (id INTEGER PRIMARY KEY);"
+                "CREATE TABLE child (parent_id INTEGER REFERENCES parent (id) "
+                "DEFERRABLE INITIALLY DEFERRED);"
+            )
+        )
+    )
+    release = threading.Event()
+    provider._run_in_writer(release.wait)
+    provider._run_in_writer(lambda: provider.db.execute("INSERT INTO child VALUES (1)"))
+    token = await provider.finalize_visit_id(VisitId(1))
+    release.set()
+    with pytest.raises(sqlite3.IntegrityError):
+        await token
+    # The failed transaction got rolled back, so later commits succeed
+    await provider.execute_statement("PRAGMA foreign_keys = OFF")
+    await provider.store_record(
+        TableName("site_visits"),
+        VisitId(2),
+        {"visit_id": 2, "browser_id": 1, "site_url": "https://a.com"},
+    )
+    await (await provider.finalize_visit_id(VisitId(2)))
+    assert len(query_db(db_path, "SELECT * FROM site_visits")) == 1
+    await provider.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_pragma_profiles(tmp_path: Path) -> None:
+    db_path = tmp_path / "crawl-data.sqlite"
+    provider = SQLiteStorageProvider(db_path)
+    await provider.init()
+    assert pragma(provider, "journal_mode") == "wal"
+    assert pragma(provider, "synchronous") == 1  # NORMAL
+    await provider.store_record(
+        TableName("site_visits"),
+        VisitId(1),
+        {"visit_id": 1, "browser_id": 1, "site_url": "https://a.com"},
+    )
+    await (await provider.finalize_visit_id(VisitId(1)))
+
+    # Hold an uncommitted write transaction open on the writer thread
+    written = threading.Event()
+    release = threading.Event()
+
+    def write_and_wait() -> None:
+        provider.db.execute(
+            "INSERT INTO site_visits (visit_id, browser_id, site_url) "
+            "VALUES (2, 1, 'https://b.com')"
+        )
+        written.set()
+        release.wait()
+
+    provider._run_in_writer(write_and_wait)
+    written.wait()
+    # Readers don't get blocked by the writer and only see committed data
+    assert len(query_db(db_path, "SELECT * FROM site_visits")) == 1
+    release.set()
+    await provider.flush_cache()
+    assert len(query_db(db_path, "SELECT * FROM site_visits")) == 2
+    await provider.shutdown()
+
+    bulk_path = tmp_path / "bulk.sqlite"
+    provider = SQLiteStorageProvider(bulk_path, pragmas=PRAGMA_PROFILE_BULK_LOAD)
+    await provider.init()
+    assert pragma(provider, "page_size") == 16384
+    assert pragma(provider, "synchronous") == 0  # OFF
+    await provider.shutdown()
+
+    with pytest.raises(ValueError):
+        SQLiteStorageProvider(db_path, pragmas={"journal_mode": "WAL; DROP TABLE"})
+
+
+@pytest.mark.asyncio
+async def test_sharded_by_browser(tmp_path: Path) -> None:
+    provider = ShardedSQLiteProvider(tmp_path)
+    await provider.init()
+    for i in range(6):
+        await provider.store_record(
+            TableName("site_visits"),
+            VisitId(i),
+            {"visit_id": i, "browser_id": i % 2, "site_url": f"https://{i}.com"},
+        )
+        await provider.store_record(
+            TableName("javascript"),
+            VisitId(i),
+            {
+                "visit_id": i,
+                "browser_id": i % 2,
+                "symbol": "window.name",
+                "time_stamp": "2021-01-01T00:00:00.000Z",
+            },
+        )
+    await provider.store_record(
+        TableName("task"),
+        INVALID_VISIT_ID,
+        {
+            "task_id": 1,
+            "manager_params": "{}",
+            "openwpm_version": "0.0.0",
+            "browser_version": "0.0",
+        },
+    )
+    for i in range(6):
+        token = await provider.finalize_visit_id(VisitId(i))
+        assert token is not None
+        await token
+    await provider.flush_cache()
+
+    assert [p.name for p in get_shard_paths(tmp_path)] == [
+        "crawl-data-browser-0.sqlite",
+        "crawl-data-browser-1.sqlite",
+        "crawl-data-main.sqlite",
+    ]
+    rows = query_db(
+        tmp_path / "crawl-data-browser-1.sqlite",
+        "SELECT visit_id FROM javascript",
+        as_tuple=True,
+    )
+    assert {visit_id for (visit_id,) in rows} == {1, 3, 5}
+    # Querying the directory covers all shards
+    rows = query_db(tmp_path, "SELECT visit_id FROM site_visits", as_tuple=True)
+    assert sorted(rows) == [(i,) for i in range(6)]
+    assert len(get_javascript_entries(tmp_path)) == 6
+    assert len(query_db(tmp_path, "SELECT * FROM task")) == 1
+    # Aggregates, ORDER BY and LIMIT apply across all shards
+    assert query_db(tmp_path, "SELECT COUNT(*) FROM site_visits", as_tuple=True) == [
+        (6,)
+    ]
+    rows = query_db(
+        tmp_path,
+        "SELECT visit_id FROM site_visits ORDER BY visit_id DESC LIMIT 2",
+        as_tuple=True,
+    )
+    assert rows == [(5,), (4,)]
+    await provider.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_sharded_by_visits(tmp_path: Path) -> None:
+    provider = ShardedSQLiteProvider(tmp_path, shard_by="visits", visits_per_shard=2)
+    await provider.init()
+    for i in range(5):
+        await provider.store_record(
+            TableName("site_visits"),
+            VisitId(i),
+            {"visit_id": i, "browser_id": 1, "site_url": f"https://{i}.com"},
+        )
+        token = await provider.finalize_visit_id(VisitId(i))
+        assert token is not None
+        await token
+    # Shards that are full get closed
+    assert list(provider.shards) == ["00002"]
+    await provider.shutdown()
+    assert len(get_shard_paths(tmp_path)) == 3
+    rows = query_db(tmp_path, "SELECT visit_id FROM site_visits", as_tuple=True)
+    assert sorted(rows) == [(i,) for i in range(5)]
+
+
+@pytest.mark.asyncio
+async def test_sharded_visit_stays_in_first_shard(tmp_path: Path) -> None:
+    provider = ShardedSQLiteProvider(tmp_path)
+    await provider.init()
+    # The first record of the visit doesn't tell the browser_id yet
+    await provider.store_record(
+        TableName("crawl_history"),
+        VisitId(1),
+        {"visit_id": 1, "command": "GetCommand", "command_status": "ok"},
+    )
+    await provider.store_record(
+        TableName("site_visits"),
+        VisitId(1),
+        {"visit_id": 1, "browser_id": 1, "site_url": "https://a.com"},
+    )
+    token = await provider.finalize_visit_id(VisitId(1))
+    assert token is not None
+    await token
+    await provider.shutdown()
+    assert [p.name for p in get_shard_paths(tmp_path)] == ["crawl-data-main.sqlite"]
+
+
+@pytest.mark.asyncio
+async def test_query_db_over_many_shards(tmp_path: Path) -> None:
+    # More shards than SQLite can attach to a single connection
+    shard_count = get_max_attached_shards() + 2
+    provider = ShardedSQLiteProvider(tmp_path, shard_by="visits", visits_per_shard=1)
+    await provider.init()
+    for i in range(shard_count):
+        await provider.store_record(
+            TableName("site_visits"),
+            VisitId(i),
+            {"visit_id": i, "browser_id": 1, "site_url": f"https://{i}.com"},
+        )
+        await provider.finalize_visit_id(VisitId(i))
+    await provider.shutdown()
+    assert len(get_shard_paths(tmp_path)) == shard_count
+    rows = query_db(tmp_path, "SELECT visit_id FROM site_visits", as_tuple=True)
+    assert sorted(rows) == [(i,) for i in range(shard_count)]
+    with pytest.raises(ValueError):
+        connect(tmp_path)
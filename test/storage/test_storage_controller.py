@@ -1,16 +1,29 @@
+import asyncio
+from pathlib import Path
+
 import pandas as pd
+import pytest
+from multiprocess import Queue
 from pandas.testing import assert_frame_equal
+from pyarrow.parquet import ParquetDataset
 
 from openwpm.mp_logger import MPLogger
+from openwpm.storage import storage_controller
+from openwpm.storage.cloud_storage.uploader import UploadError
 from openwpm.storage.in_memory_storage import (
     MemoryArrowProvider,
     MemoryStructuredProvider,
+    MemoryUnstructuredProvider,
 )
+from openwpm.storage.local_storage import LocalArrowProvider
 from openwpm.storage.storage_controller import (
     INVALID_VISIT_ID,
     DataSocket,
+    StorageController,
     StorageControllerHandle,
 )
+from openwpm.storage.storage_providers import TableName
+from openwpm.types import VisitId
 from test.storage.fixtures import dt_test_values
 
 
@@ -67,3 +80,108 @@ def test_arrow_provider(mp_logger: MPLogger, test_values: dt_test_values) -> Non
         t2 = pd.DataFrame({k: [v] for k, v in data.items()})
         # Since t2 doesn't get created schema the inferred types are different
         assert_frame_equal(t1, t2, check_dtype=False)
+
+
+def test_content_catalog(mp_logger: MPLogger) -> None:
+    structured = MemoryStructuredProvider()
+    unstructured = MemoryUnstructuredProvider()
+    controller_handle = StorageControllerHandle(structured, unstructured)
+    controller_handle.launch()
+    assert controller_handle.listener_address is not None
+    cs = DataSocket(controller_handle.listener_address, "Test")
+    script = b"console.log('hello');" * 100
+    visit_id = VisitId(1)
+    cs.store_content(script, "hash1", visit_id, 2, "text/javascript; charset=utf-8")
+    cs.store_content(script, "hash1", VisitId(3), 2, "text/javascript")
+    cs.store_content(b"<html></html>", "hash2", visit_id, 2, None)
+    cs.close()
+    controller_handle.shutdown()
+
+    handle = structured.handle
+    handle.poll_queue()
+    rows = {row["content_hash"]: row for row in handle.storage["content_catalog"]}
+    assert rows.keys() == {"hash1", "hash2"}
+    assert rows["hash1"]["visit_id"] == visit_id
+    assert rows["hash1"]["browser_id"] == 2
+    assert rows["hash1"]["size"] == len(script)
+    assert rows["hash1"]["mime_type"] == "text/javascript"
+    assert rows["hash1"]["compression_ratio"] > 10
+    assert rows["hash2"]["mime_type"] is None
+    unstructured.handle.poll_queue()
+    assert unstructured.handle.storage.keys() == {"hash1", "hash2"}
+
+
+@pytest.mark.asyncio
+async def test_content_catalog_batches(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(storage_controller, "CATALOG_BATCH_SIZE", 2)
+    structured = MemoryArrowProvider()
+    controller = StorageController(structured, None, Queue(), Queue(), Queue())
+    await structured.init()
+    # Both bodies arrive after their visits have been finalized
+    await controller._catalog_content(b"first", "hash1", VisitId(1), 1, None)
+    await controller._catalog_content(b"second", "hash2", INVALID_VISIT_ID, 1, None)
+    # The rows don't wait for the TaskManager to close
+    assert INVALID_VISIT_ID not in structured._records
+    await structured.flush_cache()
+    await asyncio.wait_for(asyncio.gather(*controller._catalog_tokens), 1)
+
+    table_name, table = structured.queue.get(timeout=1)
+    assert table_name == "content_catalog"
+    assert table.column("visit_id").to_pylist() == [1, None]
+
+
+def test_persistent_writers(mp_logger: MPLogger, tmp_path: Path) -> None:
+    structured = LocalArrowProvider(tmp_path, persistent_writers=True)
+    controller_handle = StorageControllerHandle(structured, None)
+    controller_handle.launch()
+    assert controller_handle.listener_address is not None
+    cs = DataSocket(controller_handle.listener_address, "Test")
+    visit_ids = [VisitId(1), VisitId(2)]
+    for visit_id in visit_ids:
+        cs.store_record(
+            TableName("site_visits"),
+            visit_id,
+            {"visit_id": visit_id, "browser_id": 1, "site_url": "https://example.com"},
+        )
+        cs.finalize_visit_id(visit_id, True)
+    cs.close()
+    controller_handle.shutdown()
+
+    # The shutdown doesn't wait for the writers to roll over
+    assert sorted(controller_handle.get_new_completed_visits()) == [
+        (visit_id, True) for visit_id in visit_ids
+    ]
+    df = ParquetDataset(tmp_path / "site_visits").read().to_pandas()
+    assert sorted(df["visit_id"]) == visit_ids
+
+
+class FailingShutdownProvider(MemoryStructuredProvider):
+    async def shutdown(self) -> None:
+        await super().shutdown()
+        raise UploadError(["site_visits/leftover.parquet"])
+
+
+class RecordingUnstructuredProvider(MemoryUnstructuredProvider):
+    def __init__(self) -> None:
+        super().__init__()
+        self.calls: list[str] = []
+
+    async def flush_cache(self) -> None:
+        self.calls.append("flush_cache")
+
+    async def shutdown(self) -> None:
+        self.calls.append("shutdown")
+
+
+@pytest.mark.asyncio
+async def test_shutdown_after_structured_failure() -> None:
+    structured = FailingShutdownProvider()
+    unstructured = RecordingUnstructuredProvider()
+    controller = StorageController(structured, unstructured, Queue(), Queue(), Queue())
+    await structured.init()
+    controller._shutdown_flag = True
+    completion_queue_task = asyncio.create_task(controller.update_completion_queue())
+    with pytest.raises(UploadError):
+        await controller.shutdown(completion_queue_task)
+    # The unstructured provider still got shut down
+    assert unstructured.calls == ["flush_cache", "shutdown"]
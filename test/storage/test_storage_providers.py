@@ -1,18 +1,53 @@
 import asyncio
+import gzip
+import os
+import random
+from datetime import datetime, tzinfo
 from pathlib import Path
+from typing import Any, Dict, List, Optional
 
+import duckdb
+import pyarrow.parquet as pq
 import pytest
 from pandas import DataFrame
 from pyarrow.parquet import ParquetDataset
 
-from openwpm.storage.local_storage import LocalArrowProvider
+from openwpm.storage import arrow_storage
+from openwpm.storage.arrow_storage import (
+    PARTITION_CRAWL_DATE,
+    PARTITION_INSTANCE_ID,
+    PARTITION_VISIT_ID_BUCKET,
+)
+from openwpm.storage.chunked_storage import (
+    MAX_CHUNK_SIZE,
+    MIN_CHUNK_SIZE,
+    ChunkedUnstructuredProvider,
+    chunk_boundaries,
+)
+from openwpm.storage.cloud_storage.uploader import UploadError
+from openwpm.storage.duckdb_storage import DuckDbProvider
+from openwpm.storage.fanout_storage import FanOutStructuredProvider, SinkFailedError
+from openwpm.storage.in_memory_storage import MemoryUnstructuredProvider
+from openwpm.storage.leveldb import LevelDbProvider
+from openwpm.storage.local_storage import (
+    LocalArrowIpcProvider,
+    LocalArrowProvider,
+    LocalGzipProvider,
+    convert_ipc_to_parquet,
+    read_ipc_table,
+)
+from openwpm.storage.pack_storage import LocalPackProvider, PackReader, repack
+from openwpm.storage.sql_provider import SQLiteStorageProvider
 from openwpm.storage.storage_controller import INVALID_VISIT_ID
 from openwpm.storage.storage_providers import (
+    ReadableUnstructuredStorageProvider,
     StructuredStorageProvider,
     TableName,
     UnstructuredStorageProvider,
 )
+from openwpm.storage.tiered_storage import TieredUnstructuredProvider
 from openwpm.types import VisitId
+from openwpm.utilities.db_utils import query_db
 
 from .fixtures import structured_scenarios, unstructured_scenarios
 from .test_values import dt_test_values
@@ -39,12 +74,238 @@ async def test_local_arrow_storage_provider(
         dataset = ParquetDataset(tmp_path / table_name)
         df: DataFrame = dataset.read().to_pandas()
         assert df.shape[0] == 1
+        # The records passed in don't get modified
+        assert "instance_id" not in test_data
+        test_data["instance_id"] = structured_provider._instance_id
         for row in df.itertuples(index=False):
             if test_data["visit_id"] == INVALID_VISIT_ID:
                 del test_data["visit_id"]
             assert row._asdict() == test_data
 
 
+async def _store_site_visits(
+    structured_provider: StructuredStorageProvider,
+    visit_ids: List[VisitId],
+    wait: bool = True,
+) -> "List[asyncio.Task[None]]":
+    for visit_id in visit_ids:
+        await structured_provider.store_record(
+            TableName("site_visits"),
+            visit_id,
+            {"visit_id": visit_id, "browser_id": 1, "site_url": "https://example.com"},
+        )
+    token_list = []
+    for visit_id in visit_ids:
+        token_list.append(await structured_provider.finalize_visit_id(visit_id))
+    await structured_provider.flush_cache()
+    tokens = [t for t in token_list if t is not None]
+    if wait:
+        await asyncio.gather(*tokens)
+    return tokens
+
+
+@pytest.mark.asyncio
+async def test_local_arrow_partitioning(tmp_path: Path) -> None:
+    structured_provider = LocalArrowProvider(
+        tmp_path,
+        partition_cols=[
+            PARTITION_INSTANCE_ID,
+            PARTITION_CRAWL_DATE,
+            PARTITION_VISIT_ID_BUCKET,
+        ],
+        visit_id_buckets=4,
+    )
+    await structured_provider.init()
+    await _store_site_visits(structured_provider, [VisitId(i) for i in range(8)])
+
+    table_path = tmp_path / "site_visits"
+    instance_dirs = list(table_path.iterdir())
+    assert [d.name for d in instance_dirs] == [
+        f"instance_id={structured_provider._instance_id}"
+    ]
+    date_dirs = list(instance_dirs[0].iterdir())
+    assert len(date_dirs) == 1
+    assert date_dirs[0].name.startswith("crawl_date=")
+    bucket_dirs = sorted(d.name for d in date_dirs[0].iterdir())
+    assert bucket_dirs == [f"visit_id_bucket={i}" for i in range(4)]
+
+    # Partition pruning: only the matching directory gets read
+    df: DataFrame = (
+        ParquetDataset(table_path, filters=[("visit_id_bucket", "=", 1)])
+        .read()
+        .to_pandas()
+    )
+    assert sorted(df["visit_id"]) == [1, 5]
+    await structured_provider.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_local_arrow_crawl_date(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    class Yesterday(datetime):
+        @classmethod
+        def now(cls, tz: Optional[tzinfo] = None) -> "Yesterday":
+            return cls(2023, 10, 13, 23, 59, tzinfo=tz)
+
+    structured_provider = LocalArrowProvider(
+        tmp_path, partition_cols=[PARTITION_CRAWL_DATE]
+    )
+    await structured_provider.init()
+    monkeypatch.setattr(arrow_storage, "datetime", Yesterday)
+    await structured_provider.store_record(
+        TableName("site_visits"),
+        VisitId(1),
+        {"visit_id": 1, "browser_id": 1, "site_url": "https://example.com"},
+    )
+    # Flushed after midnight
+    monkeypatch.undo()
+    token = await structured_provider.finalize_visit_id(VisitId(1))
+    await structured_provider.flush_cache()
+    await structured_provider.shutdown()
+    await token
+
+    date_dirs = [d.name for d in (tmp_path / "site_visits").iterdir()]
+    assert date_dirs == ["crawl_date=2023-10-13"]
+
+
+@pytest.mark.asyncio
+async def test_local_arrow_persistent_writers(tmp_path: Path) -> None:
+    # Every finalized visit fills up the cache
+    structured_provider = LocalArrowProvider(
+        tmp_path, persistent_writers=True, cache_size_bytes=1
+    )
+    await structured_provider.init()
+    table_path = tmp_path / "site_visits"
+    tokens = []
+    for i in range(3):
+        await structured_provider.store_record(
+            TableName("site_visits"),
+            VisitId(i),
+            {"visit_id": i, "browser_id": 1, "site_url": "https://example.com"},
+        )
+        tokens.append(await structured_provider.finalize_visit_id(VisitId(i)))
+        # Only the hidden in-progress file exists while the writer is open
+        files = list(table_path.iterdir())
+        assert len(files) == 1
+        assert files[0].name.startswith(".")
+    # The visits are only saved once the file is finalized
+    await asyncio.sleep(0)
+    assert not any(t.done() for t in tokens)
+    # which an explicit flush does
+    await structured_provider.flush_cache()
+    await asyncio.wait_for(asyncio.gather(*tokens), 1)
+    await structured_provider.shutdown()
+
+    files = list(table_path.iterdir())
+    assert len(files) == 1
+    assert not files[0].name.startswith(".")
+    assert pq.ParquetFile(files[0]).metadata.num_row_groups == 3
+    df: DataFrame = ParquetDataset(table_path).read().to_pandas()
+    assert sorted(df["visit_id"]) == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_local_arrow_persistent_writers_rollover(tmp_path: Path) -> None:
+    structured_provider = LocalArrowProvider(
+        tmp_path, persistent_writers=True, max_file_bytes=1
+    )
+    await structured_provider.init()
+    for i in range(3):
+        await _store_site_visits(structured_provider, [VisitId(i)])
+    await structured_provider.shutdown()
+    table_path = tmp_path / "site_visits"
+    files = list(table_path.iterdir())
+    assert len(files) == 3
+    assert all(not f.name.startswith(".") for f in files)
+    df: DataFrame = ParquetDataset(table_path).read().to_pandas()
+    assert sorted(df["visit_id"]) == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_local_arrow_row_group_bytes(tmp_path: Path) -> None:
+    structured_provider = LocalArrowProvider(
+        tmp_path, persistent_writers=True, row_group_bytes=1
+    )
+    await structured_provider.init()
+    await _store_site_visits(
+        structured_provider, [VisitId(i) for i in range(3)], wait=False
+    )
+    await structured_provider.shutdown()
+    (file,) = (tmp_path / "site_visits").iterdir()
+    # A target below the size of a single row gives one row per row group
+    assert pq.ParquetFile(file).metadata.num_row_groups == 3
+
+
+@pytest.mark.usefixtures("mp_logger")
+@pytest.mark.asyncio
+async def test_local_arrow_ipc_provider(
+    tmp_path: Path, test_values: dt_test_values
+) -> None:
+    test_table, visit_ids = test_values
+    ipc_path = tmp_path / "ipc"
+    structured_provider = LocalArrowIpcProvider(ipc_path)
+    await structured_provider.init()
+    # Two flushes to check that batches get appended to the same stream
+    for _ in range(2):
+        for table_name, test_data in test_table.items():
+            await structured_provider.store_record(
+                TableName(table_name), test_data["visit_id"], test_data
+            )
+        token_list = []
+        for i in visit_ids:
+            token_list.append(await structured_provider.finalize_visit_id(i))
+        await structured_provider.flush_cache()
+        await asyncio.gather(*token_list)
+    await structured_provider.shutdown()
+
+    parquet_path = tmp_path / "parquet"
+    convert_ipc_to_parquet(ipc_path, parquet_path)
+    for table_name, test_data in test_table.items():
+        ipc_files = list((ipc_path / table_name).iterdir())
+        assert len(ipc_files) == 1
+        ipc_df: DataFrame = read_ipc_table(ipc_files[0]).to_pandas()
+        parquet_df: DataFrame = (
+            ParquetDataset(parquet_path / table_name).read().to_pandas()
+        )
+        assert ipc_df.shape[0] == 2
+        assert parquet_df.shape[0] == 2
+        if test_data["visit_id"] == INVALID_VISIT_ID:
+            del test_data["visit_id"]
+        test_data["instance_id"] = structured_provider._instance_id
+        for df in (ipc_df, parquet_df):
+            for row in df.itertuples(index=False):
+                assert row._asdict() == test_data
+
+
+@pytest.mark.asyncio
+async def test_duckdb_provider(tmp_path: Path, test_values: dt_test_values) -> None:
+    test_table, visit_ids = test_values
+    db_path = tmp_path / "crawl-data.duckdb"
+    structured_provider = DuckDbProvider(db_path)
+    await structured_provider.init()
+    for table_name, test_data in test_table.items():
+        await structured_provider.store_record(
+            TableName(table_name), test_data["visit_id"], test_data
+        )
+    token_list = []
+    for i in visit_ids:
+        token_list.append(await structured_provider.finalize_visit_id(i))
+    await structured_provider.flush_cache()
+    await asyncio.gather(*token_list)
+    await structured_provider.shutdown()
+
+    con = duckdb.connect(str(db_path), read_only=True)
+    for table_name, test_data in test_table.items():
+        df: DataFrame = con.sql(f"SELECT * FROM {table_name}").df()
+        assert df.shape[0] == 1
+        if test_data["visit_id"] == INVALID_VISIT_ID:
+            del test_data["visit_id"]
+        test_data["instance_id"] = structured_provider._instance_id
+        assert df.to_dict("records")[0] == test_data
+    con.close()
+
+
 @pytest.mark.parametrize("structured_provider", structured_scenarios, indirect=True)
 @pytest.mark.asyncio
 async def test_basic_access(structured_provider: StructuredStorageProvider) -> None:
@@ -75,3 +336,233 @@ async def test_basic_unstructured_storing(
     await unstructured_provider.store_blob("test", blob)
     await unstructured_provider.flush_cache()
     await unstructured_provider.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_leveldb_deduplication(tmp_path: Path) -> None:
+    db_path = tmp_path / "content.ldb"
+    unstructured_provider = LevelDbProvider(db_path)
+    await unstructured_provider.init()
+    await unstructured_provider.store_blob("hash", b"content")
+    # Still in the uncommitted write batch
+    await unstructured_provider.store_blob("hash", b"content")
+    assert unstructured_provider._ldb_counter == 1
+    await unstructured_provider.flush_cache()
+    await unstructured_provider.shutdown()
+
+    unstructured_provider = LevelDbProvider(db_path)
+    await unstructured_provider.init()
+    await unstructured_provider.store_blob("hash", b"other content")
+    assert unstructured_provider._ldb_counter == 0
+    await unstructured_provider.store_blob("hash", b"other content", overwrite=True)
+    await unstructured_provider.flush_cache()
+    assert unstructured_provider.ldb.get(b"hash") == b"other content"
+    await unstructured_provider.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_local_pack_provider(tmp_path: Path) -> None:
+    # Random bytes don't compress, so every blob is bigger than a segment
+    blobs = {f"hash{i}": os.urandom(200) for i in range(10)}
+    unstructured_provider = LocalPackProvider(tmp_path, max_segment_bytes=100)
+    await unstructured_provider.init()
+    for filename, blob in blobs.items():
+        await unstructured_provider.store_blob(filename, blob)
+        await unstructured_provider.store_blob(filename, b"duplicate")
+    await unstructured_provider.shutdown()
+    assert len(list(tmp_path.glob("*.pack"))) == 10
+
+    unstructured_provider = LocalPackProvider(tmp_path)
+    await unstructured_provider.init()
+    await unstructured_provider.store_blob("hash0", b"ignored")
+    await unstructured_provider.store_blob("hash1", b"replaced", overwrite=True)
+    await unstructured_provider.shutdown()
+    blobs["hash1"] = b"replaced"
+    assert len(list(tmp_path.glob("*.pack"))) == 11
+
+    with PackReader(tmp_path) as reader:
+        assert dict((h, reader[h]) for h in reader) == blobs
+    repack(tmp_path)
+    assert len(list(tmp_path.glob("*.pack"))) == 1
+    with PackReader(tmp_path) as reader:
+        assert len(reader) == 10
+        assert "hash1" in reader
+        assert dict((h, reader[h]) for h in reader) == blobs
+
+
+@pytest.mark.parametrize("local_tier", ["leveldb", "local_gzip"])
+@pytest.mark.asyncio
+async def test_tiered_unstructured_provider(tmp_path: Path, local_tier: str) -> None:
+    local: ReadableUnstructuredStorageProvider
+    if local_tier == "leveldb":
+        local = LevelDbProvider(tmp_path / "content.ldb")
+    else:
+        local = LocalGzipProvider(tmp_path)
+    remote = MemoryUnstructuredProvider()
+    tiered = TieredUnstructuredProvider(
+        local, remote, migration_batch_size=4, max_local_bytes=200
+    )
+    await tiered.init()
+    for i in range(10):
+        await tiered.store_blob(f"hash{i}", b"x" * 50)
+        await tiered.store_blob(f"hash{i}", b"duplicate")
+    await tiered.flush_cache()
+    await tiered.shutdown()
+
+    assert sorted(remote.storage) == sorted(f"hash{i}" for i in range(10))
+    assert gzip.decompress(remote.storage["hash3"]) == b"x" * 50
+    # Only the newest 200 bytes are left in the local tier
+    assert tiered.local_bytes == 200
+    assert [f for f, _ in tiered._migrated] == [f"hash{i}" for i in range(6, 10)]
+
+
+class FlakyRemoteProvider(MemoryUnstructuredProvider):
+    """Reports the upload of the blobs in `failing` as failed"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.failing = {"hash1"}
+
+    async def flush_cache(self) -> None:
+        failed = sorted(self.failing & set(self.storage))
+        for filename in failed:
+            del self.storage[filename]
+        if failed:
+            raise UploadError(failed)
+
+
+@pytest.mark.asyncio
+async def test_tiered_unstructured_provider_failures(tmp_path: Path) -> None:
+    local = LocalGzipProvider(tmp_path)
+    remote = FlakyRemoteProvider()
+    journal_path = tmp_path / "journal.sqlite"
+    tiered = TieredUnstructuredProvider(
+        local, remote, max_local_bytes=0, journal_path=journal_path
+    )
+    await tiered.init()
+    for i in range(3):
+        await tiered.store_blob(f"hash{i}", b"x" * 50)
+    await tiered.shutdown()
+    assert sorted(remote.storage) == ["hash0", "hash2"]
+    # The failed blob is kept locally, the migrated ones are gone
+    assert [p.name for p in tmp_path.glob("*.zip")] == ["hash1.zip"]
+
+    # The next run resumes the migration
+    remote = FlakyRemoteProvider()
+    remote.failing.clear()
+    tiered = TieredUnstructuredProvider(
+        LocalGzipProvider(tmp_path),
+        remote,
+        max_local_bytes=0,
+        journal_path=journal_path,
+    )
+    await tiered.init()
+    await tiered.shutdown()
+    assert sorted(remote.storage) == ["hash1"]
+    assert list(tmp_path.glob("*.zip")) == []
+    assert tiered.local_bytes == 0
+
+    with pytest.raises(TypeError):
+        TieredUnstructuredProvider(MemoryUnstructuredProvider(), remote)  # type: ignore[arg-type]
+
+
+class FailingStructuredProvider(LocalArrowProvider):
+    async def store_record(
+        self, table: TableName, visit_id: VisitId, record: Dict[str, Any]
+    ) -> None:
+        raise RuntimeError("The sink is broken")
+
+
+@pytest.mark.asyncio
+async def test_fanout_structured_provider(tmp_path: Path) -> None:
+    sqlite = SQLiteStorageProvider(tmp_path / "crawl-data.sqlite")
+    arrow = LocalArrowProvider(tmp_path / "arrow")
+    failing = FailingStructuredProvider(tmp_path / "failing")
+    fanout = FanOutStructuredProvider(sqlite, failing, arrow, max_buffered=2)
+    await fanout.init()
+    tokens = await _store_site_visits(
+        fanout, [VisitId(i) for i in range(5)], wait=False
+    )
+    # The visits are missing in one of the children
+    results = await asyncio.gather(*tokens, return_exceptions=True)
+    assert all(isinstance(r, SinkFailedError) for r in results)
+    await fanout.shutdown()
+
+    rows = query_db(
+        tmp_path / "crawl-data.sqlite",
+        "SELECT visit_id FROM site_visits",
+        as_tuple=True,
+    )
+    assert sorted(rows) == [(i,) for i in range(5)]
+    df = ParquetDataset(tmp_path / "arrow" / "site_visits").read().to_pandas()
+    assert sorted(df["visit_id"]) == list(range(5))
+    # The broken sink got skipped instead of holding up the others
+    assert [sink.failed for sink in fanout.sinks] == [False, True, False]
+    assert not (tmp_path / "failing" / "site_visits").exists()
+
+
+class StalledStructuredProvider(LocalArrowProvider):
+    async def store_record(
+        self, table: TableName, visit_id: VisitId, record: Dict[str, Any]
+    ) -> None:
+        await asyncio.Event().wait()
+
+
+@pytest.mark.asyncio
+async def test_fanout_stalled_child(tmp_path: Path) -> None:
+    sqlite = SQLiteStorageProvider(tmp_path / "crawl-data.sqlite")
+    stalled = StalledStructuredProvider(tmp_path / "stalled")
+    fanout = FanOutStructuredProvider(
+        stalled, sqlite, max_buffered=2, stall_timeout=0.1
+    )
+    await fanout.init()
+    # Only blocks for stall_timeout once the stalled child's queue is full
+    tokens = await _store_site_visits(
+        fanout, [VisitId(i) for i in range(5)], wait=False
+    )
+    results = await asyncio.gather(*tokens, return_exceptions=True)
+    assert all(isinstance(r, SinkFailedError) for r in results)
+    assert fanout.sinks[0].stalled
+    await fanout.shutdown()
+    rows = query_db(
+        tmp_path / "crawl-data.sqlite",
+        "SELECT visit_id FROM site_visits",
+        as_tuple=True,
+    )
+    assert sorted(rows) == [(i,) for i in range(5)]
+
+
+@pytest.mark.asyncio
+async def test_chunked_unstructured_provider(tmp_path: Path) -> None:
+    provider = ChunkedUnstructuredProvider(LevelDbProvider(tmp_path / "content.ldb"))
+    await provider.init()
+    script = random.Random(46).randbytes(200_000)
+    # The same script with different cache busters
+    versions = {
+        f"hash{i}": script[:50_000] + b"?v=%d" % i + script[50_000:] for i in range(5)
+    }
+    versions["small"] = b"tiny"
+    for filename, blob in versions.items():
+        await provider.store_blob(filename, blob)
+    await provider.store_blob("hash0", b"ignored")
+    await provider.flush_cache()
+
+    for filename, blob in versions.items():
+        assert await provider.read_blob(filename) == blob
+    assert await provider.read_blob("missing") is None
+    # Only the chunk around the cache buster differs between the versions
+    assert provider.chunk_bytes < len(versions["hash0"]) + 4 * MAX_CHUNK_SIZE
+    assert provider.blob_bytes == sum(len(blob) for blob in versions.values())
+    await provider.shutdown()
+
+
+def test_chunk_boundaries_resynchronize() -> None:
+    data = random.Random(46).randbytes(500_000)
+    edited = data[:1000] + b"inserted" + data[1000:]
+    boundaries = chunk_boundaries(data)
+    assert boundaries[-1] == len(data)
+    lengths = [end - start for start, end in zip([0] + boundaries, boundaries)]
+    assert all(MIN_CHUNK_SIZE <= n <= MAX_CHUNK_SIZE for n in lengths[:-1])
+    # All chunk boundaries after the edit are shifted by its length
+    shifted = [end - len(b"inserted") for end in chunk_boundaries(edited)]
+    assert set(boundaries[1:]) <= set(shifted)
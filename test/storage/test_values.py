@@ -234,6 +234,16 @@ def generate_test_values() -> dt_test_values:
         "time_stamp": random_word(12),
     }
     test_values[TableName("dns_responses")] = fields
+    # content_catalog
+    fields = {
+        "content_hash": random_word(12),
+        "browser_id": random.randint(0, 2**31 - 1),
+        "visit_id": random.randint(0, 2**63 - 1),
+        "size": random.randint(0, 2**63 - 1),
+        "mime_type": random_word(12),
+        "compression_ratio": random.random(),
+    }
+    test_values[TableName("content_catalog")] = fields
     visit_id_set = set(
         d["visit_id"] for d in filter(lambda d: "visit_id" in d, test_values.values())
     )
@@ -1,11 +1,15 @@
 """Test TaskManager functionality."""
+import asyncio
 from contextlib import nullcontext as does_not_raise
 
 import pytest
 
+from openwpm.async_task_manager import AsyncTaskManager
 from openwpm.command_sequence import CommandSequence
 from openwpm.commands.types import BaseCommand
 from openwpm.errors import CommandExecutionError
+from openwpm.storage.sql_provider import SQLiteStorageProvider
+from openwpm.utilities import db_utils
 
 from .utilities import BASE_TEST_URL
 
@@ -81,3 +85,79 @@ def test_assertion_error_propagation(
     with expectation:
         with manager:
             manager.execute_command_sequence(cs)
+
+
+def test_idle_browser_dispatch(task_manager_creator, default_params):
+    """Test that command sequences are spread over all idle browsers"""
+    manager_params, browser_params = default_params
+    manager_params.num_browsers = 2
+    manager, db = task_manager_creator((manager_params, browser_params[:2]))
+    test_site = BASE_TEST_URL + "/test_pages/simple_a.html"
+    for rank in range(4):
+        cs = CommandSequence(test_site, site_rank=rank)
+        cs.get()
+        manager.execute_command_sequence(cs)
+    cs = CommandSequence(test_site, site_rank=4, blocking=True)
+    cs.get()
+    manager.execute_command_sequence(cs, index=1)
+    browser_ids = [browser.browser_id for browser in manager.browsers]
+    manager.close()
+
+    rows = db_utils.query_db(db, "SELECT browser_id, site_rank FROM site_visits")
+    assert sorted(row["site_rank"] for row in rows) == list(range(5))
+    assert {row["browser_id"] for row in rows} == set(browser_ids)
+    assert [row["browser_id"] for row in rows if row["site_rank"] == 4] == [
+        browser_ids[1]
+    ]
+
+
+def test_execute_command_sequences(task_manager_creator, default_params):
+    """Test that the bulk API consumes the sequences lazily and yields them once saved"""
+    manager_params, browser_params = default_params
+    manager, db = task_manager_creator((manager_params, browser_params))
+    test_site = BASE_TEST_URL + "/test_pages/simple_a.html"
+    taken = []
+    callbacks = []
+
+    def command_sequences():
+        for rank in range(6):
+            taken.append(rank)
+            cs = CommandSequence(test_site, site_rank=rank, callback=callbacks.append)
+            cs.get()
+            yield cs
+
+    results = manager.execute_command_sequences(command_sequences(), max_in_flight=2)
+    assert taken == []
+    completed = []
+    for cs, success in results:
+        # Only max_in_flight sequences can be waiting to be saved
+        assert len(taken) - len(completed) <= 2
+        completed.append(cs.site_rank)
+        assert success
+    manager.close()
+
+    assert sorted(completed) == list(range(6))
+    assert callbacks == [True] * 6
+    rows = db_utils.query_db(db, "SELECT site_rank FROM site_visits")
+    assert sorted(row["site_rank"] for row in rows) == list(range(6))
+
+
+@pytest.mark.usefixtures("server", "xpi")
+@pytest.mark.asyncio
+async def test_async_task_manager(default_params):
+    """Test that the futures returned by submit resolve once the data is saved"""
+    manager_params, browser_params = default_params
+    db_path = manager_params.data_directory / "crawl-data.sqlite"
+    test_site = BASE_TEST_URL + "/test_pages/simple_a.html"
+    async with AsyncTaskManager(
+        manager_params, browser_params, SQLiteStorageProvider(db_path), None
+    ) as manager:
+        saved = []
+        for rank in range(4):
+            cs = CommandSequence(test_site, site_rank=rank)
+            cs.get()
+            saved.append(await manager.submit(cs))
+        assert await asyncio.gather(*saved) == [True] * 4
+        rows = db_utils.query_db(db_path, "SELECT site_rank FROM site_visits")
+        assert sorted(row["site_rank"] for row in rows) == list(range(4))
+    assert manager.task_manager.closing